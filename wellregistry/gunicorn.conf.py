@@ -7,3 +7,27 @@ import multiprocessing
 
 bind = ':8000'
 workers = multiprocessing.cpu_count()*2 + 1
+
+
+def when_ready(server):
+    """The master is listening, the workers warm up before they accept requests."""
+    server.log.info('gunicorn ready, %s workers warming up', server.num_workers)
+
+
+def post_fork(server, worker):
+    """A new worker must not share connections opened before the fork."""
+    # pylint: disable=unused-argument,import-outside-toplevel
+    from django.conf import settings
+    from django.db import connections
+
+    # only a preloaded application has settings, and possibly connections, before the fork
+    if settings.configured:
+        connections.close_all()
+
+
+def post_worker_init(worker):
+    """The application is loaded, warm the worker up before it accepts requests."""
+    # pylint: disable=unused-argument,import-outside-toplevel
+    from wellregistry.warmup import warm_up
+
+    warm_up()
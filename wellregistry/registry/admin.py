@@ -2,9 +2,15 @@
 Django Registry Administration.
 """
 
-from django.contrib import admin
-from django.utils.html import format_html
-from .models import Registry
+import json
+
+from django.contrib import admin, messages
+from django.http import HttpResponseRedirect
+from django.utils.html import format_html, format_html_join
+from wellregistry.routers import read_alias, stick_to_primary
+from .forms import RegistryForm
+from .models import DuplicateCandidate, LinkCheck, Registry, RequestProfile, VersionConflict
+from .validation import BatchValidator
 
 # this is the Django property for the admin main page header
 admin.site.site_header = 'NGWMN Well Registry Administration'
@@ -28,6 +34,8 @@ class MultiDBModelAdmin(admin.ModelAdmin):
     to use in a db action. This helper class ensures that the admin access to the registry table uses the connection
     alias with the appropriate granted access or db roles.
     see RegistryAdmin for an example.
+    When replicas of the 'other' database are configured the reads of safe requests go to a replica,
+    after a save or delete the reads of the session stay on the 'other' database for a few seconds.
 
     """
     # A handy constant for the name of the alternate connection.
@@ -36,14 +44,21 @@ class MultiDBModelAdmin(admin.ModelAdmin):
     def save_model(self, request, obj, form, change):
         """Tell Django to save objects to the 'other' database."""
         obj.save(using=self.using)
+        stick_to_primary(request)
 
     def delete_model(self, request, obj):
         """Tell Django to delete objects from the 'other' database."""
         obj.delete(using=self.using)
+        stick_to_primary(request)
+
+    def delete_queryset(self, request, queryset):
+        """Tell Django to delete the selected objects from the 'other' database."""
+        queryset.using(self.using).delete()
+        stick_to_primary(request)
 
     def get_queryset(self, request):
-        """Tell Django to look for objects on the 'other' database."""
-        return super().get_queryset(request).using(self.using)
+        """Tell Django to look for objects on the 'other' database or one of its replicas."""
+        return super().get_queryset(request).using(read_alias(self.using, request))
 
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         """Tell Django to populate ForeignKey widgets using a query on the 'other' database."""
@@ -61,10 +76,18 @@ class RegistryAdmin(MultiDBModelAdmin):
     Model class that manages how to display a Registry object in the Django admin.
     It extends MultiDBModelAdmin so that it utilizes the admin database connection.
     see MultiDBModelAdmin
+    Edits are saved only when the well is still at the version the form was opened at, see RegistryForm.
 
     """
+    form = RegistryForm
     list_display = ('site_id', 'agency_cd', 'site_no', 'displayed', 'has_qw', 'has_wl', 'insert_date', 'update_date',)
     list_filter = ('agency_cd', 'site_no', 'update_date',)
+    actions = ['validate_wells']
+
+    # the most invalid wells listed after a validation
+    max_invalid_shown = 20
+    # the times a save is handled again after a conflicting save by someone else
+    max_conflict_retries = 3
 
     # change this value when we have an full UI
     # change_list_template = 'path/to/ui/templates/registry.html
@@ -89,6 +112,165 @@ class RegistryAdmin(MultiDBModelAdmin):
         """Transforms water level boolean to HTML check mark."""
         return check_mark(obj.wl_sn_flag)
 
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        """Handle the form again when the well was saved by someone else between its validation and its save."""
+        for _ in range(self.max_conflict_retries):
+            try:
+                return super().changeform_view(request, object_id, form_url, extra_context)
+            except VersionConflict:
+                # the form now sees the newer version and merges or shows the conflicts
+                continue
+        self.message_user(request, 'The well keeps being changed by someone else, nothing was saved. '
+                                   'Check the latest version and save again.', messages.ERROR)
+        return HttpResponseRedirect(request.get_full_path())
+
+    def validate_wells(self, request, queryset):
+        """Admin action that runs the batch validation on the selected wells."""
+        rows = list(queryset.values())
+        report = BatchValidator(using=self.using).validate(rows)
+        if report.is_valid:
+            self.message_user(request, f"{report}.", messages.SUCCESS)
+            return
+
+        self.message_user(request, f"{report}.", messages.WARNING)
+        for index in report.invalid_rows[:self.max_invalid_shown]:
+            errors = '; '.join(f"{field}: {' '.join(field_errors)}"
+                               for field, field_errors in report.errors[index].items())
+            self.message_user(request, f"{self.site_id_of(rows[index])} {errors}", messages.ERROR)
+    validate_wells.short_description = 'Validate selected wells'
+
+    @staticmethod
+    def site_id_of(row):
+        """Constructs a site id from the values of a row."""
+        return f"{row['agency_cd']}:{row['site_no']}"
+
+
+class DuplicateCandidateAdmin(MultiDBModelAdmin):
+    """
+    Django Duplicate Candidate review.
+
+    The report of the wells that find_duplicate_wells scored as likely the same physical well.
+    Reviewers set the status, the reviewed pairs are kept when the job runs again.
+
+    """
+    list_display = ('well_site', 'other_well_site', 'distance_meters', 'similarity', 'depth_difference', 'score',
+                    'status',)
+    list_editable = ('status',)
+    list_filter = ('status', 'well__agency_cd',)
+    list_select_related = ('well', 'other_well',)
+    ordering = ('-score',)
+    readonly_fields = ('well', 'other_well', 'distance', 'name_similarity', 'depth_difference', 'score',
+                       'found_date',)
+
+    def has_add_permission(self, request):
+        """Candidates are only added by the matching job."""
+        return False
+
+    @staticmethod
+    def well_site(obj):
+        """The site id and name of the first well."""
+        return f"{obj.well.agency_cd}:{obj.well.site_no} {obj.well.site_name}"
+
+    @staticmethod
+    def other_well_site(obj):
+        """The site id and name of the second well."""
+        return f"{obj.other_well.agency_cd}:{obj.other_well.site_no} {obj.other_well.site_name}"
+
+    @staticmethod
+    def distance_meters(obj):
+        """The distance rounded to the meter."""
+        return f"{obj.distance:.0f} m"
+
+    @staticmethod
+    def similarity(obj):
+        """The site name similarity as a percent."""
+        return f"{obj.name_similarity:.0%}"
+
+
+class RequestProfileAdmin(MultiDBModelAdmin):
+    """
+    Django Request Profile reports.
+
+    The profiles that staff users asked for with the X-Profile header or the _profile parameter,
+    see wellregistry.profiling. They are read only.
+
+    """
+    list_display = ('profiled_date', 'method', 'path', 'username', 'status_code', 'duration_ms', 'query_count',
+                    'query_duration_ms',)
+    list_filter = ('method', 'status_code',)
+    search_fields = ('path', 'username',)
+    ordering = ('-profiled_date',)
+    fields = ('profiled_date', 'method', 'path', 'username', 'status_code', 'duration_ms', 'query_count',
+              'query_duration_ms', 'slowest_queries', 'profile',)
+    readonly_fields = fields
+
+    # the queries listed, by duration
+    max_queries_shown = 25
+
+    def has_add_permission(self, request):
+        """Profiles are only added by the profiling middleware."""
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        """Profiles are reports."""
+        return False
+
+    @staticmethod
+    def duration_ms(obj):
+        """The request duration rounded to the millisecond."""
+        return f"{obj.duration:.0f} ms"
+
+    @staticmethod
+    def query_duration_ms(obj):
+        """The time spent in queries rounded to the millisecond."""
+        return f"{obj.query_duration:.0f} ms"
+
+    def slowest_queries(self, obj):
+        """The slowest queries with their plans."""
+        queries = sorted(json.loads(obj.queries), key=lambda query: query['duration'], reverse=True)
+        return format_html_join(
+            '', '<p><b>{} ms</b> {}</p><pre>{}</pre><pre>{}</pre>',
+            ((f"{query['duration']:.1f}", query['alias'], query['sql'], query.get('plan') or '')
+             for query in queries[:self.max_queries_shown]))
+
+    @staticmethod
+    def profile(obj):
+        """The profile stats."""
+        return format_html('<pre>{}</pre>', obj.stats)
+
+
+class LinkCheckAdmin(MultiDBModelAdmin):
+    """
+    Django Link Check reports.
+
+    The last check of each distinct well link by the check_links command. They are read only, a deleted
+    check is done again on the next run.
+
+    """
+    list_display = ('url', 'ok', 'status_code', 'error', 'failures', 'elapsed_ms', 'checked_date',)
+    list_filter = ('ok', 'status_code',)
+    search_fields = ('url', 'final_url',)
+    ordering = ('ok', '-failures', 'url',)
+    fields = ('url', 'ok', 'status_code', 'error', 'final_url', 'etag', 'last_modified', 'failures', 'elapsed_ms',
+              'checked_date',)
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        """Checks are only added by the check_links command."""
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        """Checks are reports."""
+        return False
+
+    @staticmethod
+    def elapsed_ms(obj):
+        """The check duration rounded to the millisecond."""
+        return f"{obj.elapsed:.0f} ms"
+
 
 # below here will maintain all the tables Django admin should be aware
 admin.site.register(Registry, RegistryAdmin)
+admin.site.register(DuplicateCandidate, DuplicateCandidateAdmin)
+admin.site.register(RequestProfile, RequestProfileAdmin)
+admin.site.register(LinkCheck, LinkCheckAdmin)
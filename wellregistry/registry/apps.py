@@ -9,3 +9,8 @@ class RegistryConfig(AppConfig):
     Register the registry Django app.
     """
     name = 'registry'
+
+    def ready(self):
+        """Register the system checks."""
+        # pylint: disable=import-outside-toplevel,unused-import
+        from . import checks
@@ -0,0 +1,33 @@
+"""
+Chunked batch work over a process pool, shared by the commands that process every well.
+
+The wells are read in chunks from a server side cursor and the chunks are handed to the pool with a
+bounded window of outstanding tasks, so that neither the reading nor the pool holds the whole registry.
+> python -m manage derive_state_county counties.geojson --processes 8
+"""
+from collections import deque
+from itertools import islice
+
+
+def chunks(iterable, size):
+    """Split an iterable into lists of size."""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+def submit(pool, function, tasks, window):
+    """
+    Yield the pool results of the function of each task in order, with at most window tasks outstanding.
+
+    The tasks are read here, in the thread that owns the database cursor, and not by the pool.
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(function, (task,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
@@ -0,0 +1,105 @@
+"""
+State and county boundaries for point in polygon lookups.
+
+The boundaries are county polygons read from a GeoJSON file, each with its state and county code
+properties, for example the census cartographic boundary files converted with
+> ogr2ogr -f GeoJSON counties.geojson cb_2019_us_county_500k.shp
+A grid index over the polygon bounding boxes limits each lookup to the few polygons whose box
+covers the grid cell of the point.
+"""
+import json
+import math
+from collections import defaultdict
+
+# the grid cell size in degrees, about the size of a county
+GRID_DEGREES = 0.5
+
+
+def point_in_ring(lng, lat, ring):
+    """Ray casting test of a point in a closed ring of (lng, lat) vertices."""
+    inside = False
+    x_prev, y_prev = ring[-1][0], ring[-1][1]
+    for vertex in ring:
+        x_curr, y_curr = vertex[0], vertex[1]
+        if (y_curr > lat) != (y_prev > lat):
+            crossing = x_curr + (lat - y_curr) * (x_prev - x_curr) / (y_prev - y_curr)
+            if lng < crossing:
+                inside = not inside
+        x_prev, y_prev = x_curr, y_curr
+    return inside
+
+
+class Boundary:
+    """
+    The polygons of one county, each an exterior ring followed by any holes.
+
+    """
+    __slots__ = ('state_cd', 'county_cd', 'polygons', 'bbox')
+
+    def __init__(self, state_cd, county_cd, polygons):
+        """The codes and the polygons in GeoJSON coordinate order."""
+        self.state_cd = state_cd
+        self.county_cd = county_cd
+        self.polygons = polygons
+        lngs = [vertex[0] for polygon in polygons for vertex in polygon[0]]
+        lats = [vertex[1] for polygon in polygons for vertex in polygon[0]]
+        self.bbox = (min(lngs), min(lats), max(lngs), max(lats))
+
+    def contains(self, lng, lat):
+        """True when the point is inside an exterior ring and none of its holes."""
+        min_lng, min_lat, max_lng, max_lat = self.bbox
+        if not (min_lng <= lng <= max_lng and min_lat <= lat <= max_lat):
+            return False
+        for polygon in self.polygons:
+            if point_in_ring(lng, lat, polygon[0]) and not any(point_in_ring(lng, lat, hole) for hole in polygon[1:]):
+                return True
+        return False
+
+
+class BoundaryIndex:
+    """
+    A grid index of the boundaries by the cells their bounding boxes overlap.
+
+    """
+    def __init__(self, boundaries, grid_degrees=GRID_DEGREES):
+        """Index the boundaries."""
+        self.grid_degrees = grid_degrees
+        self.cells = defaultdict(list)
+        self.size = 0
+        for boundary in boundaries:
+            self.size += 1
+            min_lng, min_lat, max_lng, max_lat = boundary.bbox
+            for row in range(self.cell(min_lat), self.cell(max_lat) + 1):
+                for column in range(self.cell(min_lng), self.cell(max_lng) + 1):
+                    self.cells[(row, column)].append(boundary)
+        self.cells = dict(self.cells)
+
+    def cell(self, degrees):
+        """The grid row or column of a coordinate."""
+        return math.floor(degrees / self.grid_degrees)
+
+    def locate(self, lat, lng):
+        """The (state_cd, county_cd) of the boundary containing the point, or None."""
+        for boundary in self.cells.get((self.cell(lat), self.cell(lng)), ()):
+            if boundary.contains(lng, lat):
+                return boundary.state_cd, boundary.county_cd
+        return None
+
+    @classmethod
+    def from_geojson(cls, path, state_property='STATEFP', county_property='COUNTYFP', grid_degrees=GRID_DEGREES):
+        """Load the county features of a GeoJSON feature collection."""
+        with open(path, encoding='utf-8') as geojson:
+            collection = json.load(geojson)
+
+        boundaries = []
+        for feature in collection['features']:
+            geometry = feature.get('geometry') or {}
+            if geometry.get('type') == 'Polygon':
+                polygons = [geometry['coordinates']]
+            elif geometry.get('type') == 'MultiPolygon':
+                polygons = geometry['coordinates']
+            else:
+                continue
+            properties = feature['properties']
+            boundaries.append(Boundary(str(properties[state_property]), str(properties[county_property]), polygons))
+        return cls(boundaries, grid_degrees)
@@ -0,0 +1,30 @@
+"""
+System checks of the registry settings, run by Django at the start of the management commands.
+> python -m manage check
+"""
+from django.conf import settings
+from django.core.checks import Error, register
+
+from .validation import load_lookups
+
+
+@register()
+def check_alt_unit_meters(app_configs, **kwargs):
+    """The ALT_UNIT_METERS must map alt_units lookup codes to positive meters."""
+    # pylint: disable=unused-argument
+    errors = []
+    for unit, meters in settings.ALT_UNIT_METERS.items():
+        if not isinstance(unit, int) or not isinstance(meters, (int, float)) or meters <= 0:
+            errors.append(Error(f"ALT_UNIT_METERS maps {unit!r} to {meters!r}, not a unit id to positive meters.",
+                                id='registry.E001'))
+    try:
+        units = load_lookups().get('alt_units')
+    except (OSError, ValueError) as error:
+        return errors + [Error(f"The lookups file cannot be read: {error}", id='registry.E002')]
+    if units is None:
+        return errors
+    unknown = sorted(unit for unit in settings.ALT_UNIT_METERS if isinstance(unit, int) and unit not in units)
+    if unknown:
+        errors.append(Error(f"ALT_UNIT_METERS has the units {unknown}, which are not alt_units lookup codes.",
+                            hint='Use the UNITS_DIM ids of the lookups file.', id='registry.E003'))
+    return errors
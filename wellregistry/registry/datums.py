@@ -0,0 +1,151 @@
+"""
+Horizontal and vertical datum normalization of the well coordinates.
+
+The wells come with their coordinates in the horizontal datum of horz_datum and their altitude in the
+vertical datum of alt_datum_cd. The normalized coordinates are the same positions in NAD83 and the
+altitudes in NAVD88, computed with NumPy over whole columns at once: the wells of each datum are
+shifted together by a bilinear interpolation of a shift grid.
+
+The shift grids are local NumPy .npz files named after the datums they convert, SOURCE_TARGET.npz, for
+example NAD27_NAD83.npz and NGVD29_NAVD88.npz. Each has the south west corner lat0 and lon0 and the
+cell sizes lat_step and lon_step in decimal degrees, longitudes positive east, and shift arrays of
+rows by latitude and columns by longitude: dlat and dlon in arc seconds for a horizontal grid, as the
+NADCON grids, or dz in meters for a vertical grid, as the VERTCON grids. The altitude units are the
+ALT_UNIT_METERS setting, checked against the alt_units lookup codes at startup. A well outside its grid,
+in an unknown datum or with unknown altitude units has no normalized value.
+"""
+import os
+
+import numpy
+from django.conf import settings
+
+from .models import COORDINATE_PLACES
+
+HORIZONTAL_DATUM = 'NAD83'
+VERTICAL_DATUM = 'NAVD88'
+# datums taken as the normalized ones, WGS84 and NAD83 differ by less than the accuracy of most wells
+HORIZONTAL_EQUIVALENTS = ('NAD83', 'WGS84')
+VERTICAL_EQUIVALENTS = ('NAVD88',)
+# the decimal places of the normalized altitude, as alt_va
+ALTITUDE_PLACES = 6
+
+ARC_SECONDS = 3600.0
+
+
+class ShiftGrid:
+    """
+    A regular latitude longitude grid of datum shifts.
+
+    """
+    def __init__(self, lat0, lon0, lat_step, lon_step, shifts):
+        """The grid origin and cell sizes in degrees and its shift arrays by name."""
+        self.lat0 = float(lat0)
+        self.lon0 = float(lon0)
+        self.lat_step = float(lat_step)
+        self.lon_step = float(lon_step)
+        self.shifts = {name: numpy.asarray(values, dtype=numpy.float64) for name, values in shifts.items()}
+        shapes = {values.shape for values in self.shifts.values()}
+        if len(shapes) != 1 or len(next(iter(shapes))) != 2 or min(next(iter(shapes))) < 2:
+            raise ValueError('The shift arrays must be 2 dimensional arrays of the same shape, at least 2 by 2.')
+        self.rows, self.columns = shapes.pop()
+
+    @classmethod
+    def load(cls, path):
+        """Load a grid from a .npz file."""
+        with numpy.load(path) as data:
+            missing = {'lat0', 'lon0', 'lat_step', 'lon_step'} - set(data.files)
+            if missing:
+                raise ValueError(f"{path} has no {', '.join(sorted(missing))}")
+            shifts = {name: data[name] for name in ('dlat', 'dlon', 'dz') if name in data.files}
+            if set(shifts) not in ({'dlat', 'dlon'}, {'dz'}):
+                raise ValueError(f"{path} must have the dlat and dlon shifts of a horizontal grid or the dz shifts "
+                                 f"of a vertical grid")
+            return cls(data['lat0'], data['lon0'], data['lat_step'], data['lon_step'], shifts)
+
+    @property
+    def vertical(self):
+        """True for a grid of height shifts."""
+        return 'dz' in self.shifts
+
+    def interpolate(self, lat, lng):
+        """The bilinear interpolation of each shift at the positions, NaN outside of the grid."""
+        row = (lat - self.lat0) / self.lat_step
+        column = (lng - self.lon0) / self.lon_step
+        inside = (row >= 0) & (row <= self.rows - 1) & (column >= 0) & (column <= self.columns - 1)
+        row0 = numpy.clip(numpy.floor(numpy.nan_to_num(row)), 0, self.rows - 2).astype(numpy.intp)
+        column0 = numpy.clip(numpy.floor(numpy.nan_to_num(column)), 0, self.columns - 2).astype(numpy.intp)
+        row_weight = row - row0
+        column_weight = column - column0
+
+        interpolated = {}
+        for name, values in self.shifts.items():
+            south = values[row0, column0] * (1 - column_weight) + values[row0, column0 + 1] * column_weight
+            north = values[row0 + 1, column0] * (1 - column_weight) + values[row0 + 1, column0 + 1] * column_weight
+            interpolated[name] = numpy.where(inside, south * (1 - row_weight) + north * row_weight, numpy.nan)
+        return interpolated
+
+
+class DatumNormalizer:
+    """
+    The shift grids of the datums converted to NAD83 and NAVD88.
+
+    """
+    def __init__(self, horizontal=None, vertical=None, unit_meters=None):
+        """The horizontal and vertical grids by source datum code and the meters per altitude unit id."""
+        self.horizontal = horizontal or {}
+        self.vertical = vertical or {}
+        self.unit_meters = settings.ALT_UNIT_METERS if unit_meters is None else unit_meters
+
+    @classmethod
+    def from_directory(cls, path):
+        """Load the grids converting to the normalized datums from a directory of .npz files."""
+        horizontal, vertical = {}, {}
+        for name in sorted(os.listdir(path)):
+            stem, extension = os.path.splitext(name)
+            source, _, target = stem.rpartition('_')
+            if extension != '.npz' or target not in (HORIZONTAL_DATUM, VERTICAL_DATUM):
+                continue
+            grid = ShiftGrid.load(os.path.join(path, name))
+            if grid.vertical != (target == VERTICAL_DATUM):
+                raise ValueError(f"{name} does not have the shifts of a {target} grid")
+            (vertical if grid.vertical else horizontal)[source] = grid
+        return cls(horizontal, vertical)
+
+    @property
+    def datums(self):
+        """The source datums with a grid."""
+        return sorted(self.horizontal) + sorted(self.vertical)
+
+    def normalize(self, lat, lng, horz_datum, alt, alt_datum, alt_units):
+        """
+        The normalized latitudes, longitudes and altitudes of columns of wells.
+
+        The coordinates and altitudes are float arrays, the datums arrays of codes and the units an
+        integer array. The altitudes stay in their units.
+        """
+        norm_lat = numpy.full(lat.shape, numpy.nan)
+        norm_lng = numpy.full(lat.shape, numpy.nan)
+        same = numpy.isin(horz_datum, HORIZONTAL_EQUIVALENTS)
+        norm_lat[same] = lat[same]
+        norm_lng[same] = lng[same]
+        for datum, grid in self.horizontal.items():
+            wells = horz_datum == datum
+            if wells.any():
+                shifts = grid.interpolate(lat[wells], lng[wells])
+                norm_lat[wells] = lat[wells] + shifts['dlat'] / ARC_SECONDS
+                norm_lng[wells] = lng[wells] + shifts['dlon'] / ARC_SECONDS
+
+        norm_alt = numpy.full(alt.shape, numpy.nan)
+        same = numpy.isin(alt_datum, VERTICAL_EQUIVALENTS)
+        norm_alt[same] = alt[same]
+        unit_meters = numpy.full(alt.shape, numpy.nan)
+        for unit, meters in self.unit_meters.items():
+            unit_meters[alt_units == unit] = meters
+        for datum, grid in self.vertical.items():
+            wells = alt_datum == datum
+            if wells.any():
+                # the shift at the original position, a few meters off does not change it
+                norm_alt[wells] = alt[wells] + grid.interpolate(lat[wells], lng[wells])['dz'] / unit_meters[wells]
+
+        return (numpy.round(norm_lat, COORDINATE_PLACES), numpy.round(norm_lng, COORDINATE_PLACES),
+                numpy.round(norm_alt, ALTITUDE_PLACES))
@@ -0,0 +1,167 @@
+"""
+Near duplicate well detection.
+
+The same physical well can be registered by several providers under different agency_cd and
+site_no. Comparing every pair of wells is quadratic, so the wells are blocked into grid cells at
+least as large as the match distance and only wells in the same or neighbouring cells are compared.
+The cells wrap around the antimeridian, so wells either side of it are neighbours.
+The cells are matched in parallel and each candidate pair is scored by distance, site name
+similarity and well depth.
+"""
+import math
+import multiprocessing
+import re
+from collections import defaultdict
+from difflib import SequenceMatcher
+
+# meters per degree of latitude
+METERS_PER_DEGREE = 111320.0
+# mean earth radius in meters
+EARTH_RADIUS = 6371008.8
+# longitude cells are sized for this latitude so that they are wide enough everywhere below it
+MAX_BLOCK_LATITUDE = 75.0
+
+# the cell and the neighbours ahead of it, each pair of neighbouring cells is visited once
+FORWARD_NEIGHBOURS = ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1))
+
+# how much each measure contributes to the score
+DISTANCE_WEIGHT = 0.5
+NAME_WEIGHT = 0.3
+DEPTH_WEIGHT = 0.2
+# depth differences beyond this, in the well depth units, score zero
+DEPTH_TOLERANCE = 10.0
+# the depth score when a depth is unknown
+UNKNOWN_DEPTH_SCORE = 0.5
+
+# the cells of the current matching run, set in each worker process by init_worker
+_CELLS = {}
+
+
+class Well:
+    """
+    The few well values needed for matching, small to pass to worker processes.
+
+    """
+    __slots__ = ('pk', 'lat', 'lng', 'name', 'depth')
+
+    def __init__(self, pk, lat, lng, name, depth):
+        """The registry id, coordinates, site name and well depth."""
+        self.pk = pk
+        self.lat = lat
+        self.lng = lng
+        self.name = normalize_name(name)
+        self.depth = float(depth) if depth is not None else None
+
+
+def normalize_name(name):
+    """Lower case the site name and collapse punctuation and white space."""
+    return re.sub(r'[\W_]+', ' ', name or '').strip().lower()
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """The great circle distance in meters."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    chord = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(chord))
+
+
+def cell_size(distance):
+    """
+    The latitude degrees of a grid cell and the number of cells around the globe for a match distance in meters.
+
+    The columns divide the 360 degrees of longitude evenly, so the last one is as wide as the others.
+    """
+    lat_degrees = distance / METERS_PER_DEGREE
+    lng_degrees = lat_degrees / math.cos(math.radians(MAX_BLOCK_LATITUDE))
+    return lat_degrees, max(int(360.0 // lng_degrees), 1)
+
+
+def neighbour_column(column, d_column, columns):
+    """The column d_column away, wrapped around the antimeridian when the columns are distinct neighbours."""
+    # with fewer than three columns every column already neighbours the others
+    return (column + d_column) % columns if columns >= 3 else column + d_column
+
+
+def block(wells, distance):
+    """Group the wells into grid cells keyed by (row, column), the columns count east from the antimeridian."""
+    lat_degrees, columns = cell_size(distance)
+    cells = defaultdict(list)
+    for well in wells:
+        column = math.floor((well.lng + 180.0) * columns / 360.0) % columns
+        cells[(math.floor(well.lat / lat_degrees), column)].append(well)
+    return dict(cells)
+
+
+def score(well, other, distance, max_distance):
+    """The weighted score of a candidate pair and its name similarity and depth difference."""
+    name_similarity = SequenceMatcher(None, well.name, other.name).ratio() if well.name and other.name else 0.0
+    if well.depth is None or other.depth is None:
+        depth_difference = None
+        depth_score = UNKNOWN_DEPTH_SCORE
+    else:
+        depth_difference = abs(well.depth - other.depth)
+        depth_score = 1.0 - min(depth_difference / DEPTH_TOLERANCE, 1.0)
+    total = (DISTANCE_WEIGHT * (1.0 - distance / max_distance) + NAME_WEIGHT * name_similarity
+             + DEPTH_WEIGHT * depth_score)
+    return total, name_similarity, depth_difference
+
+
+def match_cell(key, cells, max_distance, min_score):
+    """The candidate pairs of a cell with itself and its forward neighbours."""
+    row, column = key
+    wells = cells[key]
+    columns = cell_size(max_distance)[1]
+    candidates = []
+    for d_row, d_column in FORWARD_NEIGHBOURS:
+        neighbours = cells.get((row + d_row, neighbour_column(column, d_column, columns)))
+        if not neighbours:
+            continue
+        same_cell = d_row == 0 and d_column == 0
+        for index, well in enumerate(wells):
+            for other in (neighbours[index + 1:] if same_cell else neighbours):
+                distance = haversine(well.lat, well.lng, other.lat, other.lng)
+                if distance > max_distance:
+                    continue
+                total, name_similarity, depth_difference = score(well, other, distance, max_distance)
+                if total >= min_score:
+                    first, second = (well, other) if well.pk < other.pk else (other, well)
+                    candidates.append((first.pk, second.pk, distance, name_similarity, depth_difference, total))
+    return candidates
+
+
+def init_worker(cells):
+    """Give a worker process the cells of the run."""
+    global _CELLS  # pylint: disable=global-statement
+    _CELLS = cells
+
+
+def match_cells(task):
+    """Worker entry point, match a list of cell keys."""
+    keys, max_distance, min_score = task
+    candidates = []
+    for key in keys:
+        candidates.extend(match_cell(key, _CELLS, max_distance, min_score))
+    return candidates
+
+
+def find_candidates(wells, max_distance, min_score, processes=1, cells_per_task=256):
+    """
+    Find the candidate duplicate pairs among the wells.
+
+    Returns tuples of (lower id, higher id, distance, name similarity, depth difference, score).
+    With more than one process the cells are matched in a process pool, cells_per_task at a time.
+    """
+    if max_distance <= 0:
+        raise ValueError(f"max_distance must be positive, not {max_distance}")
+    cells = block(wells, max_distance)
+    if processes <= 1:
+        return [candidate for key in sorted(cells) for candidate in match_cell(key, cells, max_distance, min_score)]
+
+    keys = sorted(cells)
+    tasks = [(keys[start:start + cells_per_task], max_distance, min_score)
+             for start in range(0, len(keys), cells_per_task)]
+
+    with multiprocessing.Pool(processes, initializer=init_worker, initargs=(cells,)) as pool:
+        return [candidate for result in pool.imap_unordered(match_cells, tasks) for candidate in result]
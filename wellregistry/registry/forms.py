@@ -0,0 +1,86 @@
+"""
+Registry forms.
+"""
+from django import forms
+
+from .models import Registry, hashed_fields
+
+
+def data_value(field, value):
+    """The submitted form data that a form field reads back as the value."""
+    if isinstance(field.widget, forms.CheckboxInput):
+        return 'on' if value else ''
+    return '' if value is None else str(value)
+
+
+class RegistryForm(forms.ModelForm):
+    """
+    Registry change form with optimistic concurrency.
+
+    The form carries the version of the well it was opened at and, as hidden initial values, the field values
+    the user started from. When the well was saved by someone else meanwhile, clean merges field by field:
+    the fields only the other user changed take their value, the fields only this user changed keep this
+    user's value and the fields both changed differently are conflicts. A form with conflicts is shown again
+    with the other user's values in the field errors and the latest version, so that saving it again keeps
+    what the user then submits.
+
+    """
+    version = forms.IntegerField(widget=forms.HiddenInput, required=False)
+
+    class Meta:
+        model = Registry
+        fields = '__all__'
+
+    def __init__(self, *args, **kwargs):
+        """Send the initial values of the business fields along with the form when editing."""
+        super().__init__(*args, **kwargs)
+        if self.instance.pk is not None:
+            self.fields['version'].initial = self.instance.version
+            for field in hashed_fields(Registry):
+                if field.name in self.fields:
+                    self.fields[field.name].show_hidden_initial = True
+
+    def initial_value(self, name):
+        """The value of a field when the user opened the form."""
+        field = self.fields[name]
+        submitted = field.hidden_widget().value_from_datadict(self.data, self.files, self.add_initial_prefix(name))
+        try:
+            return field.to_python(submitted)
+        except forms.ValidationError:
+            return None
+
+    def clean(self):
+        """Merge the changes saved by someone else since the form was opened."""
+        cleaned_data = super().clean()
+        if self.instance.pk is None or cleaned_data.get('version') is None:
+            return cleaned_data
+
+        self.instance.version = cleaned_data['version']
+        current = Registry.objects.using(self.instance._state.db).filter(pk=self.instance.pk).first()
+        if current is None or current.version == self.instance.version:
+            return cleaned_data
+
+        self.data = self.data.copy()
+        conflicts = []
+        for model_field in hashed_fields(Registry):
+            name = model_field.name
+            if name not in self.fields or name not in cleaned_data:
+                continue
+            base, mine, theirs = self.initial_value(name), cleaned_data[name], getattr(current, model_field.attname)
+            if mine == theirs or theirs == base:
+                continue
+            if mine == base:
+                cleaned_data[name] = theirs
+                self.data[name] = data_value(self.fields[name], theirs)
+            else:
+                conflicts.append(name)
+                self.add_error(name, f"Saved meanwhile by {current.update_user_id} as: {theirs}")
+
+        # the merged form now applies to the latest version
+        self.instance.version = current.version
+        self.data['version'] = str(current.version)
+        if conflicts:
+            raise forms.ValidationError(
+                'This well was changed by %(user)s since you opened it. Review the fields marked below and save '
+                'again to keep your values.', code='version_conflict', params={'user': current.update_user_id})
+        return cleaned_data
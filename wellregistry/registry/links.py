@@ -0,0 +1,268 @@
+"""
+Concurrent checks of the well links.
+
+The LinkChecker checks many links at once on an asyncio event loop with a small HTTP/1.1 client of
+the standard library. Requests are HEAD, or GET for servers that refuse HEAD, and only read the
+headers. Redirects are followed. Each host gets at most a few requests at once, started at least
+a politeness delay apart. A link checked before is requested with its ETag and Last-Modified, so an
+unchanged target answers 304 without a body.
+
+The loop runs in a thread of its own and hands the results back as they complete, so the caller
+can save them with the ORM, which must not be used from the loop.
+> python -m manage check_links --ttl-hours 168
+"""
+import asyncio
+import logging
+import queue
+import ssl
+import threading
+import time
+import urllib.parse
+
+# the redirects followed before a link is reported as a redirect loop
+MAX_REDIRECTS = 5
+# the response headers read before a response is reported as invalid
+MAX_HEADERS = 100
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# the statuses of servers that do not answer HEAD, the link is requested again with GET
+HEAD_REFUSED_STATUSES = (405, 501)
+USER_AGENT = 'wellregistry-linkcheck/1.0'
+
+_DONE = object()
+
+logger = logging.getLogger(__name__)
+
+
+class LinkResult:
+    """
+    The outcome of the check of a link.
+
+    """
+    __slots__ = ('url', 'status_code', 'error', 'etag', 'last_modified', 'final_url', 'elapsed')
+
+    def __init__(self, url, status_code=None, error='', etag='', last_modified='', final_url='', elapsed=0.0):
+        """The link, the last status code or the error, the validators of the final URL and the seconds taken."""
+        self.url = url
+        self.status_code = status_code
+        self.error = error
+        self.etag = etag
+        self.last_modified = last_modified
+        self.final_url = final_url
+        self.elapsed = elapsed
+
+    @property
+    def not_modified(self):
+        """True when the target did not change since the validators sent."""
+        return self.status_code == 304
+
+    @property
+    def ok(self):
+        """True for a link that answers without an error."""
+        return not self.error and self.status_code is not None and self.status_code < 400
+
+
+def absolute_url(link):
+    """The http or https URL of a link, links without a scheme are taken as http, None when it is invalid."""
+    link = link.strip()
+    if '://' not in link:
+        link = f"http://{link}"
+    parts = urllib.parse.urlsplit(link)
+    try:
+        parts.port  # pylint: disable=pointless-statement
+    except ValueError:
+        return None
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return None
+    return link
+
+
+class LinkChecker:
+    """
+    Check links concurrently with per host limits.
+
+    """
+    def __init__(self, concurrency=50, per_host=4, delay=0.1, timeout=10.0):
+        """The links checked at once, the requests at once and the seconds between requests per host, the timeout."""
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.delay = delay
+        self.timeout = timeout
+        self.ssl_context = ssl.create_default_context()
+        self.hosts = {}
+        # the errors of the checks and workers that failed unexpectedly in the last run
+        self.failures = []
+
+    def run(self, links):
+        """
+        Yield the result of each (url, etag, last modified, final url) link as the checks complete.
+
+        The etag and last modified are the validators of the final url of the previous check, blank when
+        there are none. The links are read in the thread of the loop, so they must not be a queryset.
+        The unexpected errors are in failures once the results are all read.
+        """
+        results = queue.Queue(maxsize=self.concurrency * 2)
+        self.failures = []
+
+        def check_in_thread():
+            try:
+                asyncio.run(self.check_all(links, results))
+            except Exception as error:  # pylint: disable=broad-except
+                logger.exception('The link checks stopped')
+                self.failures.append(error)
+            finally:
+                results.put(_DONE)
+
+        thread = threading.Thread(target=check_in_thread, name='link-checker', daemon=True)
+        thread.start()
+        while True:
+            result = results.get()
+            if result is _DONE:
+                break
+            yield result
+        thread.join()
+
+    async def check_all(self, links, results):
+        """Check the links with concurrency workers and put the results in the queue."""
+        self.hosts = {}
+        links = iter(links)
+        loop = asyncio.get_running_loop()
+
+        async def worker():
+            for url, etag, last_modified, final_url in links:
+                try:
+                    result = await self.check(url, etag, last_modified, final_url)
+                except Exception as error:  # pylint: disable=broad-except
+                    # an unexpected error is reported with its link rather than losing the link
+                    logger.exception('The check of %s failed', url)
+                    self.failures.append(error)
+                    result = LinkResult(url, error=f"check failed: {error!r}"[:300])
+                # the consumer may be slow to save, wait for it outside of the loop
+                await loop.run_in_executor(None, results.put, result)
+
+        for outcome in await asyncio.gather(*[worker() for _ in range(self.concurrency)], return_exceptions=True):
+            if isinstance(outcome, BaseException):
+                logger.error('A link check worker failed', exc_info=outcome)
+                self.failures.append(outcome)
+
+    async def check(self, link, etag='', last_modified='', final_url=''):
+        """Check a link and its redirects."""
+        start = time.perf_counter()
+        url = absolute_url(link)
+        if url is None:
+            return LinkResult(link, error='invalid url')
+        try:
+            result = await asyncio.wait_for(self.follow(link, url, etag, last_modified, final_url),
+                                            self.timeout)
+        except asyncio.TimeoutError:
+            result = LinkResult(link, error='timeout')
+        except (OSError, ValueError, UnicodeError) as error:
+            result = LinkResult(link, error=(str(error) or type(error).__name__)[:300])
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    async def follow(self, link, url, etag, last_modified, final_url):
+        """Request the url and follow its redirects, the validators are sent to the previous final url."""
+        for _ in range(MAX_REDIRECTS + 1):
+            headers = {}
+            if url == final_url:
+                if etag:
+                    headers['If-None-Match'] = etag
+                if last_modified:
+                    headers['If-Modified-Since'] = last_modified
+            status, response_headers = await self.request('HEAD', url, headers)
+            if status in HEAD_REFUSED_STATUSES:
+                status, response_headers = await self.request('GET', url, headers)
+            location = response_headers.get('location')
+            if status in REDIRECT_STATUSES and location:
+                url = urllib.parse.urljoin(url, location)
+                if absolute_url(url) != url:
+                    return LinkResult(link, status, error='invalid redirect')
+                continue
+            return LinkResult(link, status, etag=response_headers.get('etag', ''),
+                              last_modified=response_headers.get('last-modified', ''), final_url=url)
+        return LinkResult(link, status, error='too many redirects')
+
+    async def request(self, method, url, headers):
+        """Send one request within the limits of its host and read the status and headers of the response."""
+        parts = urllib.parse.urlsplit(url)
+        async with HostSlot(self.host_limit(parts.hostname)):
+            https = parts.scheme == 'https'
+            reader, writer = await asyncio.open_connection(
+                parts.hostname, parts.port or (443 if https else 80), ssl=self.ssl_context if https else None)
+            try:
+                target = urllib.parse.quote(parts.path or '/', safe="/%;:@&=+$,!~*'()")
+                if parts.query:
+                    target += f"?{urllib.parse.quote(parts.query, safe='=&%;/:+,!~*()')}"
+                host = parts.hostname if parts.port is None else f"{parts.hostname}:{parts.port}"
+                lines = [f"{method} {target} HTTP/1.1", f"Host: {host}", f"User-Agent: {USER_AGENT}",
+                         'Accept: */*', 'Connection: close']
+                lines += [f"{name}: {value}" for name, value in headers.items()]
+                writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+                await writer.drain()
+                return await read_head(reader)
+            finally:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except (OSError, ssl.SSLError):  # the server closed first
+                    pass
+
+    def host_limit(self, host):
+        """The semaphore and the next start time of a host."""
+        limit = self.hosts.get(host)
+        if limit is None:
+            limit = self.hosts[host] = HostLimit(self.per_host, self.delay)
+        return limit
+
+
+class HostLimit:
+    """
+    The requests in flight and the politeness delay of a host.
+
+    """
+    def __init__(self, per_host, delay):
+        """At most per_host requests at once, started delay seconds apart."""
+        self.semaphore = asyncio.Semaphore(per_host)
+        self.delay = delay
+        self.next_start = 0.0
+
+
+class HostSlot:
+    """
+    Hold one of the request slots of a host, after its politeness delay.
+
+    """
+    def __init__(self, limit):
+        """A slot of the host limit."""
+        self.limit = limit
+
+    async def __aenter__(self):
+        """Wait for a slot and for the time of the next request to the host."""
+        await self.limit.semaphore.acquire()
+        now = time.monotonic()
+        # the start time is taken before sleeping, so that the waiting requests are spaced out
+        start = max(now, self.limit.next_start)
+        self.limit.next_start = start + self.limit.delay
+        if start > now:
+            await asyncio.sleep(start - now)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        """Free the slot."""
+        self.limit.semaphore.release()
+
+
+async def read_head(reader):
+    """The status code and the lower cased headers of an HTTP response."""
+    status_line = await reader.readline()
+    parts = status_line.decode('latin-1').split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+        raise ValueError('invalid response')
+    headers = {}
+    for _ in range(MAX_HEADERS):
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            return int(parts[1]), headers
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    raise ValueError('too many headers')
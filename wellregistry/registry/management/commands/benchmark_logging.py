@@ -0,0 +1,117 @@
+"""
+Measure the request latency with logging off, synchronous and queued.
+
+Each mode replaces the root handlers while it runs: 'off' disables logging, 'sync' writes the basic
+format from the request thread as the StreamHandler did and 'queue' is the NonBlockingHandler of
+wellregistry.logs. The records go to a sink that sleeps --write-delay milliseconds per write, to stand
+for a slow or blocked stdout, and the root level is DEBUG so that every record of the request is
+written. Each mode prints the mean and 95th percentile latency and the records the queue dropped.
+> python -m manage benchmark_logging --path /registry/ --requests 200 --write-delay 1
+"""
+import logging
+import os
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+
+from wellregistry.logs import JsonFormatter, NonBlockingHandler
+from wellregistry.warmup import warmup_host
+
+MODES = ('off', 'sync', 'queue')
+
+
+class SlowSink:
+    """
+    A stream that discards what it is given after a delay per write.
+
+    """
+    def __init__(self, delay):
+        """The seconds each write takes."""
+        self.delay = delay
+        self.devnull = open(os.devnull, 'w')
+
+    def write(self, text):
+        """Discard the text, slowly."""
+        if self.delay:
+            time.sleep(self.delay)
+        return self.devnull.write(text)
+
+    def flush(self):
+        """Nothing is buffered."""
+
+    def close(self):
+        """Close the underlying null device."""
+        self.devnull.close()
+
+
+def mode_handler(mode, sink):
+    """The root handler of a mode, None for 'off'."""
+    if mode == 'sync':
+        handler = logging.StreamHandler(sink)
+        handler.setFormatter(logging.Formatter(settings.LOGGING['formatters']['basic']['format']))
+        return handler
+    if mode == 'queue':
+        handler = NonBlockingHandler(settings.LOG_QUEUE_SIZE, settings.LOG_SAMPLING, sink)
+        handler.setFormatter(JsonFormatter())
+        return handler
+    return None
+
+
+def measure(mode, path, requests, delay):
+    """The request latencies in seconds of the path and the records dropped, in a logging mode."""
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    sink = SlowSink(delay)
+    handler = mode_handler(mode, sink)
+    root.handlers = [handler] if handler else []
+    root.setLevel(logging.DEBUG)
+    if handler is None:
+        logging.disable(logging.CRITICAL)
+
+    client = Client(HTTP_HOST=warmup_host())
+    latencies = []
+    # the rate limits are not what is measured
+    limits = override_settings(RATE_LIMIT_EXEMPT_PATHS=['/'])
+    limits.enable()
+    try:
+        client.get(path)
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = client.get(path)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise CommandError(f"GET {path} answered {response.status_code}")
+    finally:
+        limits.disable()
+        dropped = getattr(handler, 'dropped', 0)
+        if handler is not None:
+            handler.close()
+        logging.disable(logging.NOTSET)
+        root.handlers, root.level = handlers, level
+        sink.close()
+    return latencies, dropped
+
+
+class Command(BaseCommand):
+    """
+    Django command to compare the request latency of the logging modes.
+
+    """
+    help = 'Print the request latency with logging off, synchronous and queued to a slow stream.'
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument('--path', default='/registry/', help='The page to request.')
+        parser.add_argument('--requests', type=int, default=100, help='Requests per mode.')
+        parser.add_argument('--write-delay', type=float, default=1.0, help='Milliseconds each log write takes.')
+
+    def handle(self, *args, **options):
+        """Measure each mode."""
+        for mode in MODES:
+            latencies, dropped = measure(mode, options['path'], options['requests'], options['write_delay'] / 1000)
+            p95 = sorted(latencies)[int(len(latencies) * 0.95) - 1] if latencies else 0
+            self.stdout.write(f"{mode:<6} mean {statistics.mean(latencies) * 1000:7.2f}ms "
+                              f"p95 {p95 * 1000:7.2f}ms, {dropped} records dropped")
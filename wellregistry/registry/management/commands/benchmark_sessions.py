@@ -0,0 +1,66 @@
+"""
+Measure an admin page for each session mode.
+
+Each mode logs the user in, requests the page once to fill the caches, then requests it again and
+prints the mean latency and the database queries per request, all aliases together.
+> python -m manage benchmark_sessions admin --path /admin/registry/registry/ --requests 50
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from wellregistry.warmup import warmup_host
+
+
+def measure(user, path, requests):
+    """The (mean seconds, queries) per request of the path for a logged in user in the current session mode."""
+    client = Client(HTTP_HOST=warmup_host())
+    client.force_login(user)
+    client.get(path)
+
+    captures = [CaptureQueriesContext(connections[alias]) for alias in connections]
+    for capture in captures:
+        capture.__enter__()
+    start = time.perf_counter()
+    try:
+        for _ in range(requests):
+            response = client.get(path)
+            if response.status_code != 200:
+                raise CommandError(f"GET {path} answered {response.status_code}")
+    finally:
+        elapsed = time.perf_counter() - start
+        for capture in captures:
+            capture.__exit__(None, None, None)
+    client.logout()
+    return elapsed / requests, sum(len(capture) for capture in captures) / requests
+
+
+class Command(BaseCommand):
+    """
+    Django command to compare the session modes.
+
+    """
+    help = 'Print the mean latency and queries per request of an admin page for each session mode.'
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument('username', help='An existing staff user to log in.')
+        parser.add_argument('--path', default='/admin/', help='The page to request.')
+        parser.add_argument('--requests', type=int, default=20, help='Requests per mode.')
+
+    def handle(self, *args, **options):
+        """Measure each mode."""
+        try:
+            user = get_user_model().objects.get(username=options['username'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"no user {options['username']}")
+
+        for mode, engine in settings.SESSION_ENGINES.items():
+            with override_settings(SESSION_ENGINE=engine):
+                latency, queries = measure(user, options['path'], options['requests'])
+            self.stdout.write(f"{mode:<15} {latency * 1000:8.1f}ms {queries:5.1f} queries per request")
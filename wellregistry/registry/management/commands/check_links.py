@@ -0,0 +1,119 @@
+"""
+Check the well links and store the results.
+
+Only the distinct links not checked within --ttl-hours are checked, so a nightly run looks at the
+stale links and the new ones. The links are checked concurrently with at most --per-host requests
+at once to a host, --delay seconds apart, see registry.links. A link checked before is requested
+with the validators of its last response and a 304 keeps its stored result. The checks of links no
+well has any more are deleted. The results are saved in batches as they complete.
+> python -m manage check_links --ttl-hours 168 --concurrency 50 --per-host 4 --delay 0.1
+"""
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+
+from registry.links import LinkChecker
+from registry.models import LinkCheck, Registry
+
+BATCH_SIZE = 500
+# a week between checks of a link
+TTL_HOURS = 168
+
+SAVED_FIELDS = ['status_code', 'ok', 'error', 'final_url', 'etag', 'last_modified', 'failures', 'elapsed',
+                'checked_date']
+
+
+def stale_links(using, ttl, limit=None):
+    """The distinct well links without a check within the ttl, by url."""
+    fresh = LinkCheck.objects.using(using).filter(checked_date__gte=timezone.now() - ttl).values('url')
+    links = Registry.objects.using(using).exclude(link='').exclude(link__in=fresh).order_by('link').values_list(
+        'link', flat=True).distinct()
+    return list(links[:limit] if limit else links)
+
+
+def apply_result(check, result, checked_date):
+    """Update a check with a result, a not modified target keeps the previous result."""
+    if not result.not_modified:
+        check.status_code = result.status_code
+        check.ok = result.ok
+        check.error = result.error
+        check.final_url = result.final_url[:2000]
+        check.etag = result.etag[:200]
+        check.last_modified = result.last_modified[:50]
+        check.failures = 0 if result.ok else check.failures + 1
+    check.elapsed = result.elapsed * 1000
+    check.checked_date = checked_date
+    return check
+
+
+class Command(BaseCommand):
+    """
+    Django command to check the well links.
+
+    """
+    help = 'Check the stale well links concurrently and store the results for the admin.'
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument('--ttl-hours', type=float, default=TTL_HOURS,
+                            help='The hours before a checked link is checked again.')
+        parser.add_argument('--limit', type=int, help='The most links checked in the run.')
+        parser.add_argument('--concurrency', type=int, default=50, help='The links checked at once.')
+        parser.add_argument('--per-host', type=int, default=4, help='The requests at once to a host.')
+        parser.add_argument('--delay', type=float, default=0.1,
+                            help='The seconds between the starts of the requests to a host.')
+        parser.add_argument('--timeout', type=float, default=10.0, help='The seconds to check a link.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='The database alias.')
+
+    def handle(self, *args, **options):
+        """Check the stale links and save the results."""
+        using = options['database']
+        pruned, _ = LinkCheck.objects.using(using).exclude(
+            url__in=Registry.objects.using(using).values('link')).delete()
+
+        start = time.perf_counter()
+        urls = stale_links(using, timedelta(hours=options['ttl_hours']), options['limit'])
+        checks = LinkCheck.objects.using(using).in_bulk(urls, field_name='url') if urls else {}
+        links = [(url, checks[url].etag, checks[url].last_modified, checks[url].final_url) if url in checks
+                 else (url, '', '', '') for url in urls]
+        checker = LinkChecker(options['concurrency'], options['per_host'], options['delay'], options['timeout'])
+
+        counts = {'ok': 0, 'unchanged': 0, 'broken': 0}
+        batch = []
+        for result in checker.run(links):
+            if result.not_modified:
+                counts['unchanged'] += 1
+            else:
+                counts['ok' if result.ok else 'broken'] += 1
+            batch.append(result)
+            if len(batch) >= BATCH_SIZE:
+                self.save(batch, checks, using)
+                batch = []
+        self.save(batch, checks, using)
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(f"{len(urls)} links checked in {elapsed:.1f}s, {len(urls) / elapsed if elapsed else 0:,.1f} "
+                          f"links/s: {counts['ok']} ok, {counts['unchanged']} unchanged, {counts['broken']} broken; "
+                          f"{pruned} checks of removed links deleted")
+        if checker.failures:
+            raise CommandError(f"{len(checker.failures)} link checks failed unexpectedly, the first: "
+                               f"{checker.failures[0]!r}")
+
+    @staticmethod
+    def save(results, checks, using):
+        """Save a batch of results, updating the checks made before."""
+        checked_date = timezone.now()
+        updated, created = [], []
+        for result in results:
+            check = checks.get(result.url)
+            if check is None:
+                created.append(apply_result(LinkCheck(url=result.url), result, checked_date))
+            else:
+                updated.append(apply_result(check, result, checked_date))
+        if created:
+            LinkCheck.objects.using(using).bulk_create(created)
+        if updated:
+            LinkCheck.objects.using(using).bulk_update(updated, SAVED_FIELDS)
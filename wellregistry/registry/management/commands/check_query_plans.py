@@ -0,0 +1,114 @@
+"""
+Check the plans of the critical registry queries against their baselines.
+
+The queries run with EXPLAIN (ANALYZE, BUFFERS) on postgres. A query whose scans changed or whose
+buffers grew past the tolerance is printed with a diff of its summary and the command fails, so that
+it can gate a migration in CI. A query without a baseline in the baseline file fails too, unless --update
+records it. Without a baseline file nothing is compared: the plans are printed with a warning, so that
+the check only gates once the baselines of the reference database are recorded.
+With --seed-rows the synthetic wells are inserted and analyzed in a transaction that is rolled back at
+the end, the database is left as it was.
+> python -m manage check_query_plans --seed-rows 200000 --update
+> python -m manage check_query_plans --seed-rows 200000
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from registry.models import Registry
+from registry.query_plans import (BASELINE_PATH, BUFFER_TOLERANCE, CATALOG, explain_analyze, load_baselines,
+                                  plan_summary, regressions, sample_well, save_baselines, seed_registry,
+                                  summary_diff)
+
+
+def scan_list(summary):
+    """The table accesses of a plan summary, as text."""
+    return ', '.join(f"{scan['node']} {scan['index'] or scan['relation']}" for scan in summary['scans'])
+
+
+class Rollback(Exception):
+    """Raised to roll back the seeded wells."""
+
+
+class Command(BaseCommand):
+    """
+    Django command to check the query plans.
+
+    """
+    help = 'Compare the plans of the critical registry queries with their baselines.'
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument('queries', nargs='*',
+                            help=f"The queries to check, of {', '.join(CATALOG)}, all of them by default.")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='The database alias.')
+        parser.add_argument('--seed-rows', type=int, default=0,
+                            help='Synthetic wells inserted for the check and rolled back after it.')
+        parser.add_argument('--baseline', default=BASELINE_PATH, help='The baseline file.')
+        parser.add_argument('--tolerance', type=float, default=BUFFER_TOLERANCE,
+                            help='Growth of the buffers tolerated, as a fraction of the baseline.')
+        parser.add_argument('--update', action='store_true', help='Record the current plans as the baselines.')
+
+    def handle(self, *args, **options):
+        """Explain the queries, then compare or record them."""
+        using = options['database']
+        if connections[using].vendor != 'postgresql':
+            raise CommandError('check_query_plans requires a postgres database.')
+
+        names = options['queries'] or list(CATALOG)
+        unknown = set(names) - set(CATALOG)
+        if unknown:
+            raise CommandError(f"unknown queries: {', '.join(sorted(unknown))}")
+        summaries = {}
+        try:
+            with transaction.atomic(using=using):
+                if options['seed_rows']:
+                    seed_registry(options['seed_rows'], using)
+                    with connections[using].cursor() as cursor:
+                        cursor.execute(f"ANALYZE {Registry._meta.db_table}")
+                well = sample_well(using)
+                if well is None:
+                    raise CommandError('The registry is empty, seed it with --seed-rows.')
+                for name in names:
+                    summaries[name] = plan_summary(explain_analyze(CATALOG[name](well).using(using), using))
+                raise Rollback()
+        except Rollback:
+            pass
+
+        baselines = load_baselines(options['baseline'])
+        if options['update']:
+            baselines = baselines or {'seed_rows': None, 'plans': {}}
+            baselines['seed_rows'] = options['seed_rows']
+            baselines['plans'].update(summaries)
+            save_baselines(baselines, options['baseline'])
+            self.stdout.write(f"recorded {len(summaries)} baselines in {options['baseline']}")
+            return
+        self.compare(summaries, baselines, options)
+
+    def compare(self, summaries, baselines, options):
+        """Print the queries compared with their baselines and fail on the regressions."""
+        if baselines is None:
+            self.stdout.write(self.style.WARNING(
+                f"no baseline file {options['baseline']}, the plans are not checked, record them with --update"))
+            for name, summary in summaries.items():
+                self.stdout.write(f"{name}: {scan_list(summary)}, {summary['buffers']} buffers")
+            return
+
+        if baselines['seed_rows'] != options['seed_rows']:
+            self.stdout.write(self.style.WARNING(
+                f"the baselines were recorded with --seed-rows {baselines['seed_rows']}"))
+        failed = []
+        for name, summary in summaries.items():
+            baseline = baselines['plans'].get(name)
+            reasons = regressions(baseline, summary, options['tolerance'])
+            if not reasons:
+                self.stdout.write(f"{name}: ok, {scan_list(summary)}, {summary['buffers']} buffers")
+                continue
+            failed.append(name)
+            self.stdout.write(self.style.ERROR(f"{name}: {'; '.join(reasons)}"))
+            if baseline is not None:
+                self.stdout.write(summary_diff(name, baseline, summary))
+            else:
+                self.stdout.write(f"{name}: {scan_list(summary)}, {summary['buffers']} buffers")
+
+        if failed:
+            raise CommandError(f"{len(failed)} query plan regressions or missing baselines: {', '.join(failed)}")
@@ -0,0 +1,51 @@
+"""
+Delete the expired sessions in batches.
+
+The db and cached_db session modes keep a row per session that Django never deletes on its own.
+Deleting them in small batches, each in its own transaction, keeps the locks and the WAL of each
+delete short on a large session table. Run it from a schedule, for example daily.
+> python -m manage clear_expired_sessions --batch-size 1000
+"""
+import time
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+BATCH_SIZE = 1000
+
+
+def clear_expired(using=DEFAULT_DB_ALIAS, batch_size=BATCH_SIZE, pause=0.0):
+    """Delete the sessions expired now in batches, returns the number deleted."""
+    now = timezone.now()
+    expired = Session.objects.using(using).filter(expire_date__lt=now)
+    deleted = 0
+    while True:
+        with transaction.atomic(using=using):
+            keys = list(expired.values_list('session_key', flat=True)[:batch_size])
+            if not keys:
+                return deleted
+            deleted += Session.objects.using(using).filter(session_key__in=keys).delete()[0]
+        if pause:
+            time.sleep(pause)
+
+
+class Command(BaseCommand):
+    """
+    Django command to delete the expired sessions.
+
+    """
+    help = 'Delete the expired sessions in batches.'
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='The database alias of the sessions.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Sessions deleted per transaction.')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to wait between batches.')
+
+    def handle(self, *args, **options):
+        """Delete the batches and print the total."""
+        start = time.perf_counter()
+        deleted = clear_expired(options['database'], options['batch_size'], options['pause'])
+        self.stdout.write(f"deleted {deleted} expired sessions in {time.perf_counter() - start:.1f}s")
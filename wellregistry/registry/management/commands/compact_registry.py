@@ -0,0 +1,182 @@
+"""
+Rewrite the registry table with a compact physical column order.
+
+Postgres stores the columns in the order of the CREATE TABLE and pads each fixed width column
+to its alignment. This opt-in command copies the table into a new one with the fixed width columns
+first, widest alignment first, then the short character columns and the 4000 character notes last,
+so scans of the hot columns do not need to walk past the wide ones.
+
+The rewrite holds an exclusive lock on the registry table while it runs.
+> python -m manage compact_registry --report-only
+> python -m manage compact_registry
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from registry.models import Registry
+
+# byte width, which postgres also uses as the alignment, of the fixed width column types
+FIXED_WIDTHS = {
+    'BigAutoField': 8,
+    'BigIntegerField': 8,
+    'DateTimeField': 8,
+    'FloatField': 8,
+    'AutoField': 4,
+    'IntegerField': 4,
+    'PositiveIntegerField': 4,
+    'SmallIntegerField': 2,
+    'PositiveSmallIntegerField': 2,
+    'BooleanField': 1,
+}
+
+# character columns of at least this length are placed after all the others
+WIDE_LENGTH = 1000
+
+# a typical scan of the hot columns used to measure throughput
+SCAN_SQL = """
+    SELECT count(*) FROM {table}
+    WHERE display_flag AND dec_lat_va BETWEEN -90 AND 90 AND dec_long_va BETWEEN -180 AND 180
+"""
+SCAN_REPEATS = 3
+
+
+def compact_column_order(fields):
+    """Order fields as fixed width by descending alignment, then variable width, then wide character fields."""
+    def sort_key(indexed):
+        index, field = indexed
+        width = FIXED_WIDTHS.get(field.get_internal_type())
+        if width is not None:
+            return 0, -width, index
+        if (field.max_length or 0) >= WIDE_LENGTH:
+            return 2, 0, index
+        return 1, 0, index
+
+    return [field for _, field in sorted(enumerate(fields), key=sort_key)]
+
+
+def table_report(cursor, table):
+    """The table size, index size, row count and rows per second of the hot column scan."""
+    cursor.execute("SELECT pg_table_size(%s::regclass), pg_indexes_size(%s::regclass)", [table, table])
+    table_size, index_size = cursor.fetchone()
+    cursor.execute(f"SELECT count(*) FROM {table}")
+    rows = cursor.fetchone()[0]
+
+    best = None
+    for _ in range(SCAN_REPEATS):
+        start = time.perf_counter()
+        cursor.execute(SCAN_SQL.format(table=table))
+        cursor.fetchone()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return {
+        'table_size': table_size,
+        'index_size': index_size,
+        'rows': rows,
+        'rows_per_second': rows / best if best else 0,
+    }
+
+
+class Command(BaseCommand):
+    """
+    Django command to rewrite the registry table in the compact column order.
+
+    """
+    help = 'Rewrite the registry table with hot fixed width columns first and report sizes and scan throughput.'
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS,
+                            help='The database alias, it requires the table owner.')
+        parser.add_argument('--report-only', action='store_true',
+                            help='Only report the sizes and scan throughput.')
+
+    def handle(self, *args, **options):
+        """Report, rewrite and report again."""
+        connection = connections[options['database']]
+        if connection.vendor != 'postgresql':
+            raise CommandError('compact_registry requires a postgres database.')
+        table = Registry._meta.db_table
+
+        with connection.cursor() as cursor:
+            self.write_report('before', table_report(cursor, table))
+        if options['report_only']:
+            return
+
+        start = time.perf_counter()
+        self.rewrite(connection, table)
+        self.stdout.write(f"rewrite took {time.perf_counter() - start:.1f}s")
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {table}")
+            self.write_report('after', table_report(cursor, table))
+
+    def write_report(self, label, report):
+        """Print one size and throughput report."""
+        self.stdout.write(
+            f"{label}: table {report['table_size']:,} bytes, indexes {report['index_size']:,} bytes, "
+            f"{report['rows']:,} rows, scan {report['rows_per_second']:,.0f} rows/s")
+
+    @staticmethod
+    def rewrite(connection, table):
+        """Copy the table into the compact column order and swap it in, all in one transaction."""
+        compact = f"{table}_compact"
+        fields = compact_column_order(Registry._meta.concrete_fields)
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+
+        with connection.schema_editor(atomic=True) as editor:
+            definitions = []
+            for field in fields:
+                definition, _ = editor.column_sql(Registry, field, include_default=False)
+                definitions.append(f"{connection.ops.quote_name(field.column)} {definition}")
+
+            with connection.cursor() as cursor:
+                cursor.execute(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE")
+
+                # remember everything that hangs off the table before it is dropped
+                cursor.execute("""
+                    SELECT pg_get_indexdef(i.indexrelid) FROM pg_index i
+                    WHERE i.indrelid = %s::regclass AND NOT i.indisprimary
+                    AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.indexrelid)
+                """, [table])
+                indexes = [row[0] for row in cursor.fetchall()]
+                cursor.execute("""
+                    SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+                    WHERE conrelid = %s::regclass AND contype <> 'p'
+                """, [table])
+                constraints = cursor.fetchall()
+                cursor.execute("""
+                    SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid) FROM pg_constraint
+                    WHERE confrelid = %s::regclass AND conrelid <> %s::regclass
+                """, [table, table])
+                references = cursor.fetchall()
+                cursor.execute("""
+                    SELECT grantee, string_agg(privilege_type, ', ') FROM information_schema.role_table_grants
+                    WHERE table_schema = current_schema() AND table_name = %s AND grantee <> current_user
+                    GROUP BY grantee
+                """, [table])
+                grants = cursor.fetchall()
+                cursor.execute(
+                    "SELECT pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = %s::regclass AND NOT tgisinternal",
+                    [table])
+                triggers = [row[0] for row in cursor.fetchall()]
+
+            editor.execute(f"CREATE TABLE {compact} ({', '.join(definitions)})")
+            editor.execute(f"INSERT INTO {compact} ({columns}) SELECT {columns} FROM {table}")
+            editor.execute(f"DROP TABLE {table} CASCADE")
+            editor.execute(f"ALTER TABLE {compact} RENAME TO {table}")
+            editor.execute(f"ALTER SEQUENCE {compact}_id_seq RENAME TO {table}_id_seq")
+            editor.execute(f"ALTER INDEX {compact}_pkey RENAME TO {table}_pkey")
+            editor.execute(f"SELECT setval('{table}_id_seq', coalesce(max(id), 1)) FROM {table}")
+            for index in indexes:
+                editor.execute(index)
+            for name, definition in constraints:
+                editor.execute(f"ALTER TABLE {table} ADD CONSTRAINT {name} {definition}")
+            for referencing_table, name, definition in references:
+                editor.execute(f"ALTER TABLE {referencing_table} ADD CONSTRAINT {name} {definition}")
+            for grantee, privileges in grants:
+                editor.execute(f"GRANT {privileges} ON {table} TO {grantee}")
+            for trigger in triggers:
+                editor.execute(trigger)
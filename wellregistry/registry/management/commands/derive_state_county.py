@@ -0,0 +1,132 @@
+"""
+Derive or verify the state and county of every well from its coordinates.
+
+The county boundaries are loaded from a GeoJSON file into a grid index and the wells are
+located in chunks across a process pool. With --assign the wells whose codes differ from their
+location are updated, one set based UPDATE per distinct state and county in each chunk. The updates
+bump the row versions so that admin edits of those wells opened before conflict instead of overwriting.
+> python -m manage derive_state_county counties.geojson
+> python -m manage derive_state_county counties.geojson --assign --processes 8
+"""
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.functions import Now
+
+from registry.batching import chunks, submit
+from registry.boundaries import GRID_DEGREES, BoundaryIndex
+from registry.models import Registry, refresh_content_hashes
+
+CHUNK_SIZE = 5000
+# the most mismatches listed when verifying
+MAX_MISMATCHES_SHOWN = 50
+
+# the boundary index of the run, set in each worker process by init_worker
+_INDEX = None
+
+
+def init_worker(index):
+    """Give a worker process the boundary index."""
+    global _INDEX  # pylint: disable=global-statement
+    _INDEX = index
+
+
+def locate_chunk(chunk):
+    """
+    Locate a chunk of (id, lat, lng, state_cd, county_cd) wells.
+
+    Returns the count of wells, the count outside every boundary and the (id, state_cd, county_cd,
+    derived state, derived county) of the wells whose codes differ from their location.
+    """
+    outside = 0
+    mismatches = []
+    for pk, lat, lng, state_cd, county_cd in chunk:
+        location = _INDEX.locate(lat, lng)
+        if location is None:
+            outside += 1
+        elif location != (state_cd, county_cd):
+            mismatches.append((pk, state_cd, county_cd) + location)
+    return len(chunk), outside, mismatches
+
+
+class Command(BaseCommand):
+    """
+    Django command to derive the well state and county codes from the coordinates.
+
+    """
+    help = 'Verify, or with --assign update, the well state and county codes from county boundary polygons.'
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument('path', help='GeoJSON feature collection of county polygons.')
+        parser.add_argument('--assign', action='store_true', help='Update the wells whose codes differ.')
+        parser.add_argument('--state-property', default='STATEFP', help='The feature property of the state code.')
+        parser.add_argument('--county-property', default='COUNTYFP',
+                            help='The feature property of the county code.')
+        parser.add_argument('--grid-degrees', type=float, default=GRID_DEGREES, help='The index grid cell size.')
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help='The number of worker processes.')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Wells per worker task.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='The database alias.')
+
+    def handle(self, *args, **options):
+        """Load the index, locate the wells and report or assign."""
+        using = options['database']
+        start = time.perf_counter()
+        index = BoundaryIndex.from_geojson(options['path'], options['state_property'], options['county_property'],
+                                           options['grid_degrees'])
+        self.stdout.write(f"indexed {index.size} boundaries in {time.perf_counter() - start:.1f}s")
+
+        wells = Registry.objects.using(using).order_by().values_list(
+            'id', 'dec_lat_va', 'dec_long_va', 'state_cd', 'county_cd').iterator(chunk_size=options['chunk_size'])
+        tasks = chunks(wells, options['chunk_size'])
+
+        start = time.perf_counter()
+        if options['processes'] <= 1:
+            init_worker(index)
+            total, outside, mismatches = self.collect(map(locate_chunk, tasks))
+        else:
+            with multiprocessing.Pool(options['processes'], initializer=init_worker, initargs=(index,)) as pool:
+                total, outside, mismatches = self.collect(submit(pool, locate_chunk, tasks, options['processes'] * 2))
+        elapsed = time.perf_counter() - start
+
+        rate = total / elapsed if elapsed else 0
+        self.stdout.write(f"{total} wells located in {elapsed:.1f}s, {rate:,.0f} wells/s: "
+                          f"{len(mismatches)} differ, {outside} outside every boundary")
+        if options['assign']:
+            updated = self.assign(mismatches, using, options['chunk_size'])
+            self.stdout.write(f"{updated} wells updated")
+        else:
+            for pk, state_cd, county_cd, derived_state, derived_county in mismatches[:MAX_MISMATCHES_SHOWN]:
+                self.stdout.write(f"id {pk}: {state_cd}:{county_cd} located in {derived_state}:{derived_county}")
+
+    @staticmethod
+    def collect(results):
+        """Sum the chunk results, returns the total, the outside count and the mismatches."""
+        total = outside = 0
+        mismatches = []
+        for chunk_total, chunk_outside, chunk_mismatches in results:
+            total += chunk_total
+            outside += chunk_outside
+            mismatches.extend(chunk_mismatches)
+        return total, outside, mismatches
+
+    @staticmethod
+    def assign(mismatches, using, chunk_size):
+        """Set based updates of the mismatched wells grouped by their derived codes."""
+        updated = 0
+        with transaction.atomic(using=using):
+            for chunk in chunks(mismatches, chunk_size):
+                by_location = defaultdict(list)
+                for pk, _, _, derived_state, derived_county in chunk:
+                    by_location[(derived_state, derived_county)].append(pk)
+                for (state_cd, county_cd), ids in by_location.items():
+                    entries = Registry.objects.using(using).filter(id__in=ids)
+                    updated += entries.update(state_cd=state_cd, county_cd=county_cd, update_date=Now(),
+                                              update_user_id='derive_state_county')
+                    # and bumps the version
+                    refresh_content_hashes(entries)
+        return updated
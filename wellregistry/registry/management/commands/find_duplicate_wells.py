@@ -0,0 +1,70 @@
+"""
+Find candidate duplicate wells and store them for review.
+
+The wells are blocked into grid cells by their coordinates and the cells are matched in a
+process pool, see registry.duplicates. The previous unreviewed candidates are replaced while
+the pairs already reviewed in the admin are kept as they are.
+> python -m manage find_duplicate_wells --distance 100 --processes 4
+"""
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from registry.duplicates import Well, find_candidates
+from registry.models import DuplicateCandidate, Registry
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    """
+    Django command to find the candidate duplicate wells.
+
+    """
+    help = 'Find candidate duplicate wells by spatial blocking and store them for review in the admin.'
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument('--distance', type=float, default=100.0,
+                            help='The greatest distance in meters between candidate wells.')
+        parser.add_argument('--min-score', type=float, default=0.6,
+                            help='The lowest score, 0 to 1, of a stored candidate.')
+        parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                            help='The number of matching processes.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='The database alias.')
+
+    def handle(self, *args, **options):
+        """Load the wells, match them and store the candidates."""
+        if options['distance'] <= 0:
+            raise CommandError('--distance must be positive.')
+        using = options['database']
+        start = time.perf_counter()
+
+        wells = [Well(*values) for values in Registry.objects.using(using).values_list(
+            'id', 'dec_lat_va', 'dec_long_va', 'site_name', 'well_depth').iterator(chunk_size=BATCH_SIZE)]
+        candidates = find_candidates(wells, options['distance'], options['min_score'], options['processes'])
+        stored = self.store(candidates, using)
+
+        self.stdout.write(f"{len(wells)} wells, {len(candidates)} candidates, {stored} stored for review "
+                          f"in {time.perf_counter() - start:.1f}s")
+
+    @staticmethod
+    def store(candidates, using):
+        """Replace the unreviewed candidates, returns the number stored."""
+        found_date = timezone.now()
+        with transaction.atomic(using=using):
+            existing = DuplicateCandidate.objects.using(using)
+            reviewed = set(existing.exclude(status=DuplicateCandidate.NEW).values_list('well_id', 'other_well_id'))
+            existing.filter(status=DuplicateCandidate.NEW).delete()
+            new_candidates = [
+                DuplicateCandidate(well_id=well_id, other_well_id=other_well_id, distance=distance,
+                                   name_similarity=name_similarity, depth_difference=depth_difference,
+                                   score=score, found_date=found_date)
+                for well_id, other_well_id, distance, name_similarity, depth_difference, score in candidates
+                if (well_id, other_well_id) not in reviewed
+            ]
+            existing.bulk_create(new_candidates, batch_size=BATCH_SIZE)
+        return len(new_candidates)
@@ -0,0 +1,144 @@
+"""
+Normalize the coordinates of every well to NAD83 and the altitudes to NAVD88.
+
+The shift grids are loaded from a directory of .npz files, see registry.datums. The wells are read
+in chunks and normalized column by column across a process pool. Only the wells whose normalized
+values differ from the stored ones are written, with a versioned update per chunk, so a run after a
+reload only writes the wells that moved and a well edited meanwhile is left for the next run. The
+throughput of the run is printed, the normalization time is the CPU time spent in the workers.
+> python -m manage normalize_datums grids/ --dry-run
+> python -m manage normalize_datums grids/ --processes 8
+"""
+import multiprocessing
+import os
+import time
+
+import numpy
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from registry.batching import chunks, submit
+from registry.datums import DatumNormalizer
+from registry.models import Registry, versioned_update
+
+CHUNK_SIZE = 20000
+
+COLUMNS = ('id', 'version', 'content_hash', 'dec_lat_va', 'dec_long_va', 'horz_datum', 'alt_va', 'alt_datum_cd',
+           'alt_units', 'norm_lat_va', 'norm_long_va', 'norm_alt_va')
+NORMALIZED_FIELDS = ['norm_lat_va', 'norm_long_va', 'norm_alt_va']
+
+# the normalizer of the run, set in each worker process by init_worker
+_NORMALIZER = None
+
+
+def init_worker(normalizer):
+    """Give a worker process the shift grids."""
+    global _NORMALIZER  # pylint: disable=global-statement
+    _NORMALIZER = normalizer
+
+
+def differs(new, old):
+    """True where the new values are not the old ones, NaN equal to NaN."""
+    return ~((new == old) | (numpy.isnan(new) & numpy.isnan(old)))
+
+
+def normalize_chunk(chunk):
+    """
+    Normalize a chunk of wells with the COLUMNS values.
+
+    Returns the count of wells, the CPU seconds, the counts of wells without normalized coordinates and
+    without normalized altitude, and the (id, version, content hash, lat, long, alt) of the wells whose
+    normalized values changed, None for a missing value.
+    """
+    start = time.process_time()
+    columns = list(zip(*chunk))
+    lat = numpy.array(columns[3], dtype=numpy.float64)
+    lng = numpy.array(columns[4], dtype=numpy.float64)
+    alt = numpy.array(columns[6], dtype=numpy.float64)
+    norm_lat, norm_lng, norm_alt = _NORMALIZER.normalize(
+        lat, lng, numpy.array(columns[5], dtype=object), alt, numpy.array(columns[7], dtype=object),
+        numpy.array(columns[8], dtype=numpy.int64))
+
+    # the stored nulls read as NaN
+    changed = (differs(norm_lat, numpy.array(columns[9], dtype=numpy.float64))
+               | differs(norm_lng, numpy.array(columns[10], dtype=numpy.float64))
+               | differs(norm_alt, numpy.array(columns[11], dtype=numpy.float64)))
+    updates = []
+    for index in numpy.flatnonzero(changed).tolist():
+        values = (norm_lat[index], norm_lng[index], norm_alt[index])
+        updates.append(chunk[index][:3] + tuple(None if numpy.isnan(value) else float(value) for value in values))
+    return (len(chunk), time.process_time() - start, int(numpy.isnan(norm_lat).sum()),
+            int(numpy.isnan(norm_alt).sum()), updates)
+
+
+class Command(BaseCommand):
+    """
+    Django command to normalize the well coordinates and altitudes.
+
+    """
+    help = 'Normalize the well coordinates to NAD83 and altitudes to NAVD88 with local shift grids.'
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument('path', help='Directory of the SOURCE_TARGET.npz shift grids.')
+        parser.add_argument('--dry-run', action='store_true', help='Report the changes without writing them.')
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help='The number of worker processes.')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Wells per worker task.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='The database alias.')
+
+    def handle(self, *args, **options):
+        """Load the grids, normalize the wells and write the changes."""
+        try:
+            normalizer = DatumNormalizer.from_directory(options['path'])
+        except (OSError, ValueError) as error:
+            raise CommandError(f"cannot load the grids: {error}")
+        self.stdout.write(f"grids for {', '.join(normalizer.datums) or 'no datums'}")
+
+        using = options['database']
+        wells = Registry.objects.using(using).order_by().values_list(*COLUMNS).iterator(
+            chunk_size=options['chunk_size'])
+        tasks = chunks(wells, options['chunk_size'])
+
+        start = time.perf_counter()
+        if options['processes'] <= 1:
+            init_worker(normalizer)
+            results = map(normalize_chunk, tasks)
+            totals = self.run(results, using, options['dry_run'])
+        else:
+            with multiprocessing.Pool(options['processes'], initializer=init_worker, initargs=(normalizer,)) as pool:
+                results = submit(pool, normalize_chunk, tasks, options['processes'] * 2)
+                totals = self.run(results, using, options['dry_run'])
+        elapsed = time.perf_counter() - start
+
+        total, cpu, no_coordinates, no_altitude, changed, written, write_seconds = totals
+        self.stdout.write(f"{total} wells in {elapsed:.1f}s, {total / elapsed if elapsed else 0:,.0f} wells/s; "
+                          f"normalization {cpu:.1f}s CPU, {total / cpu if cpu else 0:,.0f} wells/s per process")
+        self.stdout.write(f"{no_coordinates} wells without normalized coordinates, "
+                          f"{no_altitude} without normalized altitude")
+        if options['dry_run']:
+            self.stdout.write(f"{changed} wells would change")
+        else:
+            self.stdout.write(f"{changed} wells changed, {written} written in {write_seconds:.1f}s, "
+                              f"{changed - written} edited meanwhile and left for the next run")
+
+    @staticmethod
+    def run(results, using, dry_run):
+        """Sum the chunk results and write their changes."""
+        total = no_coordinates = no_altitude = changed = written = 0
+        cpu = write_seconds = 0.0
+        entries = Registry.objects.using(using)
+        for chunk_total, chunk_cpu, chunk_no_coordinates, chunk_no_altitude, updates in results:
+            total += chunk_total
+            cpu += chunk_cpu
+            no_coordinates += chunk_no_coordinates
+            no_altitude += chunk_no_altitude
+            changed += len(updates)
+            if dry_run or not updates:
+                continue
+            start = time.perf_counter()
+            updated = [Registry(id=pk, version=version, content_hash=row_hash, norm_lat_va=lat, norm_long_va=lng,
+                                norm_alt_va=alt) for pk, version, row_hash, lat, lng, alt in updates]
+            conflicts = versioned_update(entries, updated, NORMALIZED_FIELDS + ['content_hash'])
+            written += len(updated) - len(conflicts)
+            write_seconds += time.perf_counter() - start
+        return total, cpu, no_coordinates, no_altitude, changed, written, write_seconds
@@ -0,0 +1,56 @@
+"""
+Reload a provider file into the registry, writing only what changed.
+
+The file is a CSV with a header of registry field names. It is streamed, each row is hashed and
+compared with the stored content hash. Registry rows of the agencies in the file that are not in
+the file are deleted unless --no-delete is given. Rows that fail the batch validation are skipped
+and listed by their line in the file.
+> python -m manage reconcile_registry provider.csv --dry-run
+"""
+import csv
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from registry.reconcile import BATCH_SIZE, Reconciler
+
+# the most validation errors listed
+MAX_ERRORS_SHOWN = 50
+
+
+class Command(BaseCommand):
+    """
+    Django command to reconcile the registry with a provider file.
+
+    """
+    help = 'Reconcile the registry with a provider CSV file and print a diff summary.'
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument('path', help='The provider CSV file with a header of registry field names.')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='The database alias to write to.')
+        parser.add_argument('--user', default='reconcile', help='The user id recorded on inserted and updated rows.')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Rows per bulk write.')
+        parser.add_argument('--delimiter', default=',', help='The CSV field delimiter.')
+        parser.add_argument('--no-delete', action='store_true',
+                            help='Keep registry rows that are not in the file.')
+        parser.add_argument('--dry-run', action='store_true', help='Only print what would be written.')
+        parser.add_argument('--no-validate', action='store_true', help='Skip the batch validation.')
+
+    def handle(self, *args, **options):
+        """Stream the file through the reconciler."""
+        reconciler = Reconciler(using=options['database'], user=options['user'],
+                                batch_size=options['batch_size'], delete_missing=not options['no_delete'],
+                                dry_run=options['dry_run'], validate=not options['no_validate'])
+        start = time.perf_counter()
+        with open(options['path'], newline='', encoding='utf-8') as source:
+            summary = reconciler.run(csv.DictReader(source, delimiter=options['delimiter']))
+
+        prefix = 'dry run: ' if options['dry_run'] else ''
+        self.stdout.write(f"{prefix}{summary} in {time.perf_counter() - start:.1f}s")
+
+        for index in reconciler.report.invalid_rows[:MAX_ERRORS_SHOWN]:
+            # the header is line 1
+            for field, messages in reconciler.report.errors[index].items():
+                self.stderr.write(f"line {index + 2}: {field}: {' '.join(messages)}")
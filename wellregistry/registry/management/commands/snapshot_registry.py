@@ -0,0 +1,57 @@
+"""
+Write the Parquet snapshot of the registry.
+
+Without --output the snapshot of the current registry version is written to the cache that the
+registry/snapshot.parquet download serves, when it is not there yet, for example from a schedule after
+the nightly loads so that no download waits for it.
+> python -m manage snapshot_registry
+> python -m manage snapshot_registry --output registry.parquet
+"""
+import os
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import router
+
+from registry import snapshot
+from registry.models import Registry
+
+
+class Command(BaseCommand):
+    """
+    Django command to write the registry snapshot.
+
+    """
+    help = 'Write the Parquet snapshot of the registry to the download cache or a file.'
+
+    def add_arguments(self, parser):
+        """Command line options."""
+        parser.add_argument('--output', help='Write the snapshot to this file instead of the cache.')
+        parser.add_argument('--database', help='The database alias, by default the one the registry reads use.')
+        parser.add_argument('--batch-rows', type=int, default=snapshot.BATCH_ROWS, help='Wells per row group.')
+
+    def handle(self, *args, **options):
+        """Write the snapshot and print its size, throughput and peak Python memory."""
+        using = options['database'] or router.db_for_read(Registry)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        try:
+            if options['output']:
+                wells = snapshot.write_snapshot(options['output'], using, options['batch_rows'])
+                path = options['output']
+            else:
+                path = snapshot.build_snapshot(using, options['batch_rows'])
+                wells = None
+                if path is None:
+                    raise CommandError('Another snapshot build is running.')
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        summary = f"{path}: {os.path.getsize(path):,} bytes in {elapsed:.1f}s, peak memory {peak / 2 ** 20:.1f}MB"
+        if wells is not None:
+            summary += f", {wells:,} wells, {wells / elapsed if elapsed else 0:,.0f} wells/s"
+        self.stdout.write(summary)
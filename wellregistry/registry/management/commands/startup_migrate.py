@@ -0,0 +1,122 @@
+"""
+Run the migrations at container start only when the bundled migrations changed.
+
+The fingerprint of the migration files is compared with the one recorded after the last run.
+When they match there is nothing to migrate and the container goes straight to serving.
+Otherwise the migrations run in the required order under a postgres advisory lock, so that
+replicas starting together migrate once, and the new fingerprint is recorded. A step with a target
+migration only runs until its target is applied: migrating an app back to an applied target would
+unapply, and drop the tables of, every later migration.
+> python -m manage startup_migrate && gunicorn --config wellregistry/gunicorn.conf.py wellregistry.wsgi
+"""
+import hashlib
+import importlib.util
+import os
+
+from django.apps import apps
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.recorder import MigrationRecorder
+from django.utils import timezone
+
+from registry.models import MigrationFingerprint
+
+# the migrate steps as (app label, target migration, database alias), in the required order
+# the 0000 registry migration sets the search_path so it runs alone and the connection is reopened after it,
+# it is skipped once applied
+MIGRATE_STEPS = [
+    ('postgres', None, 'postgres'),
+    ('registry', '0000', DEFAULT_DB_ALIAS),
+    ('registry', None, DEFAULT_DB_ALIAS),
+]
+
+# the advisory lock key held while migrating, on the 'postgres' database that always exists
+MIGRATION_LOCK_KEY = 874_201_553
+
+
+def migration_paths(app_labels):
+    """The migration directories of the apps, found without importing the migration modules."""
+    paths = []
+    for label in app_labels:
+        module_name, _ = MigrationLoader.migrations_module(label)
+        spec = importlib.util.find_spec(module_name)
+        if spec is not None and spec.submodule_search_locations:
+            paths.extend(spec.submodule_search_locations)
+    return paths
+
+
+def fingerprint(paths):
+    """The digest of the names and contents of the python files in the migration directories."""
+    digest = hashlib.sha256()
+    for path in paths:
+        for name in sorted(os.listdir(path)):
+            if name.endswith('.py'):
+                digest.update(name.encode())
+                with open(os.path.join(path, name), 'rb') as migration:
+                    digest.update(migration.read())
+    return digest.hexdigest()
+
+
+def bundled_fingerprint():
+    """The fingerprint of the migrations of the apps migrated at startup."""
+    labels = sorted({label for label, _, _ in MIGRATE_STEPS if apps.is_installed(label)})
+    return fingerprint(migration_paths(labels))
+
+
+def is_applied(app_label, target, database):
+    """True when the migration of the app named by the target prefix is recorded as applied in the database."""
+    applied = MigrationRecorder(connections[database]).applied_migrations()
+    return any(label == app_label and name.startswith(target) for label, name in applied)
+
+
+def stored_fingerprint():
+    """The last recorded fingerprint, None when there is none or the database is not there yet."""
+    try:
+        return MigrationFingerprint.objects.using(DEFAULT_DB_ALIAS).order_by('-applied_date').values_list(
+            'fingerprint', flat=True).first()
+    except DatabaseError:
+        connections[DEFAULT_DB_ALIAS].close()
+        return None
+
+
+class Command(BaseCommand):
+    """
+    Django command to migrate at startup only when needed.
+
+    """
+    help = 'Run the startup migrations when the migration fingerprint differs from the recorded one.'
+
+    def handle(self, *args, **options):
+        """Compare the fingerprints and migrate under the lock when they differ."""
+        current = bundled_fingerprint()
+        if stored_fingerprint() == current:
+            self.stdout.write(f"migrations up to date {current[:12]}")
+            return
+
+        with connections['postgres'].cursor() as lock:
+            lock.execute("SELECT pg_advisory_lock(%s)", [MIGRATION_LOCK_KEY])
+            try:
+                # another replica may have migrated while this one waited for the lock
+                if stored_fingerprint() == current:
+                    self.stdout.write(f"migrations applied by another instance {current[:12]}")
+                    return
+                self.migrate(options['verbosity'])
+                MigrationFingerprint.objects.using(DEFAULT_DB_ALIAS).create(
+                    fingerprint=current, applied_date=timezone.now())
+                self.stdout.write(f"migrations applied {current[:12]}")
+            finally:
+                lock.execute("SELECT pg_advisory_unlock(%s)", [MIGRATION_LOCK_KEY])
+
+    @staticmethod
+    def migrate(verbosity):
+        """Run the migrate steps, each application database step on a fresh connection."""
+        for app_label, target, database in MIGRATE_STEPS:
+            if target is not None and is_applied(app_label, target, database):
+                continue
+            args = [app_label] if target is None else [app_label, target]
+            call_command('migrate', *args, database=database, verbosity=verbosity)
+            # the 'postgres' connection holds the lock and stays open
+            if database == DEFAULT_DB_ALIAS:
+                connections[database].close()
@@ -0,0 +1,102 @@
+"""
+Compact the registry row layout.
+
+The 0/1 flags become booleans (wl_baseline_flag is a smallint because it carries a few 999 values),
+the unit ids become smallints and the coordinates become double precision. Double precision does not
+hold most decimal fractions exactly, but its 15 significant digits keep the 8 decimal places of a
+NUMERIC(11,8) in the -180..180 range: rounded to 8 places the stored value is the original one. It
+compares much faster.
+
+On postgres the type changes are issued as one ALTER TABLE so that the table is only rewritten once.
+The existing values are cast in place, so no data is lost. The rewrite is not opt-in: the model fields
+are booleans and doubles from here on and postgres refuses them in the old integer and numeric columns.
+It holds an exclusive lock on the table for the whole rewrite, so it belongs in a maintenance window,
+and gives up after LOCK_TIMEOUT rather than queue every registry query behind its lock request. The
+reverse refuses to run when a coordinate has more than the 8 decimal places NUMERIC(11,8) keeps.
+
+The reordering of the physical columns, hot fixed width columns first and the 4000 character notes
+last, is opt-in because it is a full copy of the table and does not change what the model can store.
+> python -m manage compact_registry
+"""
+import sys
+
+from django.conf import settings
+from django.db import migrations, models
+import django.core.validators
+
+env = settings.ENVIRONMENT
+
+FLAG_COLUMNS = ('qw_sn_flag', 'qw_baseline_flag', 'wl_sn_flag', 'display_flag')
+SMALLINT_COLUMNS = ('wl_baseline_flag', 'well_depth_units', 'alt_units')
+COORDINATE_COLUMNS = ('dec_lat_va', 'dec_long_va')
+# the wait for the exclusive lock of the table, the migration fails rather than wait longer
+LOCK_TIMEOUT = '10s'
+
+
+def alter_table_sql():
+    """One ALTER TABLE statement with all the compact column types, after a bounded wait for the lock."""
+    clauses = [f"ALTER COLUMN {column} TYPE boolean USING {column} <> 0" for column in FLAG_COLUMNS]
+    clauses += [f"ALTER COLUMN {column} TYPE smallint" for column in SMALLINT_COLUMNS]
+    clauses += [f"ALTER COLUMN {column} TYPE double precision" for column in COORDINATE_COLUMNS]
+    return (f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}';\n"
+            f"ALTER TABLE {env['APP_SCHEMA_NAME']}.registry_registry " + ",\n".join(clauses) + ";")
+
+
+def reverse_alter_table_sql():
+    """One ALTER TABLE statement restoring the original column types, unless it would round coordinates."""
+    clauses = [f"ALTER COLUMN {column} TYPE integer USING {column}::integer" for column in FLAG_COLUMNS]
+    clauses += [f"ALTER COLUMN {column} TYPE integer" for column in SMALLINT_COLUMNS]
+    clauses += [f"ALTER COLUMN {column} TYPE numeric(11,8) USING round({column}::numeric, 8)"
+                for column in COORDINATE_COLUMNS]
+    rounded = ' OR '.join(f"{column}::numeric <> round({column}::numeric, 8)" for column in COORDINATE_COLUMNS)
+    return (f"SET LOCAL lock_timeout = '{LOCK_TIMEOUT}';\n"
+            f"LOCK TABLE {env['APP_SCHEMA_NAME']}.registry_registry IN ACCESS EXCLUSIVE MODE;\n"
+            "DO $$ BEGIN\n"
+            f"    IF EXISTS (SELECT 1 FROM {env['APP_SCHEMA_NAME']}.registry_registry WHERE {rounded}) THEN\n"
+            f"        RAISE EXCEPTION 'coordinates with more than 8 decimal places, numeric(11,8) would round them';\n"
+            "    END IF;\n"
+            "END $$;\n"
+            f"ALTER TABLE {env['APP_SCHEMA_NAME']}.registry_registry " + ",\n".join(clauses) + ";")
+
+
+def flag_validators():
+    """The 0/1 domain validators retained on the smallint flag."""
+    return [django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)]
+
+
+class Migration(migrations.Migration):
+    """
+    Django Migration.
+
+    Compact column types for the registry table.
+
+    """
+    initial = False
+
+    dependencies = [('registry', '0003_grant_select_migrations')]
+
+    state_operations = [
+        migrations.AlterField(model_name='registry', name='qw_sn_flag', field=models.BooleanField(default=False)),
+        migrations.AlterField(model_name='registry', name='qw_baseline_flag',
+                              field=models.BooleanField(default=False)),
+        migrations.AlterField(model_name='registry', name='wl_sn_flag', field=models.BooleanField(default=False)),
+        migrations.AlterField(model_name='registry', name='display_flag', field=models.BooleanField(default=False)),
+        migrations.AlterField(model_name='registry', name='wl_baseline_flag',
+                              field=models.SmallIntegerField(default=0, validators=flag_validators())),
+        migrations.AlterField(model_name='registry', name='well_depth_units', field=models.SmallIntegerField()),
+        migrations.AlterField(model_name='registry', name='alt_units', field=models.SmallIntegerField()),
+        migrations.AlterField(model_name='registry', name='dec_lat_va', field=models.FloatField()),
+        migrations.AlterField(model_name='registry', name='dec_long_va', field=models.FloatField()),
+    ]
+
+    if 'test' in sys.argv:
+        # sqlite has no ALTER COLUMN, let Django rebuild the table
+        operations = state_operations
+    else:
+        operations = [
+            migrations.SeparateDatabaseAndState(
+                database_operations=[
+                    migrations.RunSQL(sql=alter_table_sql(), reverse_sql=reverse_alter_table_sql()),
+                ],
+                state_operations=state_operations),
+        ]
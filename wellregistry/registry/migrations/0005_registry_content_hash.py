@@ -0,0 +1,53 @@
+"""
+Add the registry content hash.
+
+The content hash is a digest of the business fields. Reloads compare it, together with the
+(agency_cd, site_no) key in the same index, to only write the rows that changed.
+"""
+from django.db import migrations, models
+
+from registry.models import content_hash, hashed_fields
+
+BATCH_SIZE = 2000
+
+
+def backfill_content_hash(apps, schema_editor):
+    """Compute the content hash of the existing rows in batches."""
+    registry = apps.get_model('registry', 'Registry')
+    fields = hashed_fields(registry)
+    entries = registry.objects.using(schema_editor.connection.alias)
+
+    batch = []
+    for entry in entries.only(*[field.name for field in fields]).iterator(chunk_size=BATCH_SIZE):
+        entry.content_hash = content_hash(fields, {field.name: getattr(entry, field.attname) for field in fields})
+        batch.append(entry)
+        if len(batch) == BATCH_SIZE:
+            entries.bulk_update(batch, ['content_hash'])
+            batch = []
+    if batch:
+        entries.bulk_update(batch, ['content_hash'])
+
+
+class Migration(migrations.Migration):
+    """
+    Django Migration.
+
+    Registry content hash column, backfill and index.
+
+    """
+    initial = False
+
+    dependencies = [('registry', '0004_compact_row_layout')]
+
+    operations = [
+        migrations.AddField(
+            model_name='registry',
+            name='content_hash',
+            field=models.CharField(default='', editable=False, max_length=32),
+        ),
+        migrations.RunPython(backfill_content_hash, reverse_code=migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='registry',
+            index=models.Index(fields=['agency_cd', 'site_no', 'content_hash'], name='registry_site_hash_idx'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+"""
+# Generated by Django 3.0.6 on 2026-10-19 12:38
+migration: near duplicate well candidates
+"""
+import sys
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+env = settings.ENVIRONMENT
+
+
+class Migration(migrations.Migration):
+    """
+    Django Migration.
+
+    Table of the candidate duplicate well pairs for review.
+
+    """
+    initial = False
+
+    dependencies = [('registry', '0005_registry_content_hash')]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateCandidate',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('distance', models.FloatField(help_text='meters')),
+                ('name_similarity', models.FloatField()),
+                ('depth_difference', models.FloatField(blank=True, null=True)),
+                ('score', models.FloatField()),
+                ('status', models.CharField(choices=[('new', 'New'), ('duplicate', 'Duplicate'),
+                                                     ('distinct', 'Distinct')], default='new', max_length=10)),
+                ('found_date', models.DateTimeField()),
+                ('other_well', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+',
+                                                 to='registry.Registry')),
+                ('well', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                           related_name='duplicate_candidates', to='registry.Registry')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='duplicatecandidate',
+            index=models.Index(fields=['status', '-score'], name='duplicate_status_score_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='duplicatecandidate',
+            unique_together={('well', 'other_well')},
+        ),
+    ]
+
+    if 'test' not in sys.argv:
+        operations += [
+            # the matching job runs on the client connection
+            migrations.RunSQL(
+                sql=f"""
+                    GRANT INSERT, SELECT, UPDATE, DELETE
+                    ON {env['APP_SCHEMA_NAME']}.registry_duplicatecandidate
+                    TO {env['APP_CLIENT_USERNAME']};
+                    GRANT USAGE ON {env['APP_SCHEMA_NAME']}.registry_duplicatecandidate_id_seq
+                    TO {env['APP_CLIENT_USERNAME']};
+                """,
+                reverse_sql=f"""
+                    REVOKE INSERT, SELECT, UPDATE, DELETE
+                    ON {env['APP_SCHEMA_NAME']}.registry_duplicatecandidate
+                    FROM {env['APP_CLIENT_USERNAME']};
+                    REVOKE USAGE ON {env['APP_SCHEMA_NAME']}.registry_duplicatecandidate_id_seq
+                    FROM {env['APP_CLIENT_USERNAME']};
+                """),
+        ]
@@ -0,0 +1,28 @@
+"""
+# Generated by Django 3.0.6 on 2026-10-19 13:20
+migration: fingerprint of the applied migration files
+"""
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Django Migration.
+
+    Table of the migration fingerprints recorded by startup_migrate.
+
+    """
+    initial = False
+
+    dependencies = [('registry', '0006_duplicate_candidate')]
+
+    operations = [
+        migrations.CreateModel(
+            name='MigrationFingerprint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('applied_date', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,28 @@
+"""
+Add the registry row version.
+
+Every write bumps the version and an update only applies to the version it was read at, so concurrent
+edits of a well conflict instead of overwriting each other. Adding a column with a constant default
+does not rewrite the table.
+"""
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Django Migration.
+
+    Adds the version column of the optimistic concurrency control.
+
+    """
+    initial = False
+
+    dependencies = [('registry', '0007_migration_fingerprint')]
+
+    operations = [
+        migrations.AddField(
+            model_name='registry',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,65 @@
+"""
+# Generated by Django 3.0.6 on 2026-10-19 14:10
+migration: request profiles of the staff users
+"""
+import sys
+
+from django.conf import settings
+from django.db import migrations, models
+
+env = settings.ENVIRONMENT
+
+
+class Migration(migrations.Migration):
+    """
+    Django Migration.
+
+    Table of the request profiles reported in the admin.
+
+    """
+    initial = False
+
+    dependencies = [('registry', '0008_registry_version')]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=500)),
+                ('method', models.CharField(max_length=10)),
+                ('username', models.CharField(max_length=150)),
+                ('status_code', models.PositiveSmallIntegerField()),
+                ('duration', models.FloatField(help_text='milliseconds')),
+                ('query_count', models.PositiveIntegerField()),
+                ('query_duration', models.FloatField(help_text='milliseconds')),
+                ('stats', models.TextField()),
+                ('queries', models.TextField()),
+                ('profiled_date', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='requestprofile',
+            index=models.Index(fields=['-profiled_date'], name='profile_date_idx'),
+        ),
+    ]
+
+    if 'test' not in sys.argv:
+        operations += [
+            # the profiling middleware saves on the client connection
+            migrations.RunSQL(
+                sql=f"""
+                    GRANT INSERT, SELECT, DELETE
+                    ON {env['APP_SCHEMA_NAME']}.registry_requestprofile
+                    TO {env['APP_CLIENT_USERNAME']};
+                    GRANT USAGE ON {env['APP_SCHEMA_NAME']}.registry_requestprofile_id_seq
+                    TO {env['APP_CLIENT_USERNAME']};
+                """,
+                reverse_sql=f"""
+                    REVOKE INSERT, SELECT, DELETE
+                    ON {env['APP_SCHEMA_NAME']}.registry_requestprofile
+                    FROM {env['APP_CLIENT_USERNAME']};
+                    REVOKE USAGE ON {env['APP_SCHEMA_NAME']}.registry_requestprofile_id_seq
+                    FROM {env['APP_CLIENT_USERNAME']};
+                """),
+        ]
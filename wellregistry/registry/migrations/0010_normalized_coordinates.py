@@ -0,0 +1,41 @@
+"""
+Add the normalized coordinates of the wells.
+
+The coordinates in NAD83 and the altitudes in NAVD88 are written by the normalize_datums command.
+Adding the nullable columns does not rewrite the table and their index starts out with null values only.
+"""
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    """
+    Django Migration.
+
+    Normalized coordinate columns and their index.
+
+    """
+    initial = False
+
+    dependencies = [('registry', '0009_request_profile')]
+
+    operations = [
+        migrations.AddField(
+            model_name='registry',
+            name='norm_lat_va',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='registry',
+            name='norm_long_va',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='registry',
+            name='norm_alt_va',
+            field=models.FloatField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='registry',
+            index=models.Index(fields=['norm_lat_va', 'norm_long_va'], name='registry_norm_coords_idx'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+"""
+# Generated by Django 3.0.6 on 2026-10-19 16:02
+migration: results of the well link checks
+"""
+import sys
+
+from django.conf import settings
+from django.db import migrations, models
+
+env = settings.ENVIRONMENT
+
+
+class Migration(migrations.Migration):
+    """
+    Django Migration.
+
+    Table of the last check of each distinct well link.
+
+    """
+    initial = False
+
+    dependencies = [('registry', '0010_normalized_coordinates')]
+
+    operations = [
+        migrations.CreateModel(
+            name='LinkCheck',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.CharField(max_length=500, unique=True)),
+                ('status_code', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('ok', models.BooleanField(default=False)),
+                ('error', models.CharField(blank=True, max_length=300)),
+                ('final_url', models.CharField(blank=True, max_length=2000)),
+                ('etag', models.CharField(blank=True, max_length=200)),
+                ('last_modified', models.CharField(blank=True, max_length=50)),
+                ('failures', models.PositiveIntegerField(default=0)),
+                ('elapsed', models.FloatField(help_text='milliseconds')),
+                ('checked_date', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='linkcheck',
+            index=models.Index(fields=['checked_date'], name='link_checked_idx'),
+        ),
+    ]
+
+    if 'test' not in sys.argv:
+        operations += [
+            # the check_links command writes the checks on the default connection of the client user, the admin
+            # reads them on django_admin with the schema default grants of the admin user
+            migrations.RunSQL(
+                sql=f"""
+                    GRANT INSERT, SELECT, UPDATE, DELETE
+                    ON {env['APP_SCHEMA_NAME']}.registry_linkcheck
+                    TO {env['APP_CLIENT_USERNAME']};
+                    GRANT USAGE ON {env['APP_SCHEMA_NAME']}.registry_linkcheck_id_seq
+                    TO {env['APP_CLIENT_USERNAME']};
+                """,
+                reverse_sql=f"""
+                    REVOKE INSERT, SELECT, UPDATE, DELETE
+                    ON {env['APP_SCHEMA_NAME']}.registry_linkcheck
+                    FROM {env['APP_CLIENT_USERNAME']};
+                    REVOKE USAGE ON {env['APP_SCHEMA_NAME']}.registry_linkcheck_id_seq
+                    FROM {env['APP_CLIENT_USERNAME']};
+                """),
+        ]
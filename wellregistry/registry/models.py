@@ -1,10 +1,174 @@
 """
 Well Registry ORM object.
 """
+import hashlib
+from decimal import Decimal
 
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Cast
+from django.db.models.sql import UpdateQuery
 from django.core.validators import MaxValueValidator, MinValueValidator
 
+# the decimal places kept by the coordinate columns
+COORDINATE_PLACES = 8
+
+# bookkeeping fields that are not part of the content hash
+HASH_EXCLUDED_FIELDS = ('id', 'content_hash', 'version', 'insert_user_id', 'update_user_id', 'insert_date',
+                        'update_date', 'norm_lat_va', 'norm_long_va', 'norm_alt_va')
+
+# the fields each normalized field is computed from, the vertical shift is taken at the position of the well
+NORMALIZED_SOURCES = {
+    'norm_lat_va': ('dec_lat_va', 'dec_long_va', 'horz_datum'),
+    'norm_long_va': ('dec_lat_va', 'dec_long_va', 'horz_datum'),
+    'norm_alt_va': ('dec_lat_va', 'dec_long_va', 'alt_va', 'alt_datum_cd', 'alt_units'),
+}
+
+
+class VersionConflict(Exception):
+    """A registry row was changed by someone else since it was read, nothing was written."""
+
+    def __init__(self, entry):
+        """The entry whose version is out of date."""
+        super().__init__(f"{entry.agency_cd}:{entry.site_no} is no longer at version {entry.version}")
+        self.entry = entry
+
+
+def hashed_fields(model):
+    """The business fields of a registry model that make up its content hash."""
+    return [field for field in model._meta.concrete_fields if field.name not in HASH_EXCLUDED_FIELDS]
+
+
+def canonical_value(value):
+    """A stable text form of a field value so that equal values hash equally whatever their source."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        return f"{value:.{COORDINATE_PLACES}f}"
+    if isinstance(value, Decimal):
+        return f"{value.normalize():f}"
+    return str(value)
+
+
+def content_hash(fields, values):
+    """The hex digest of the canonical values, a dict by field name, of the given fields."""
+    digest = hashlib.blake2b(digest_size=16)
+    for field in fields:
+        digest.update(canonical_value(values.get(field.name)).encode())
+        digest.update(b'\x1f')
+    return digest.hexdigest()
+
+
+def refresh_content_hashes(queryset, batch_size=2000):
+    """
+    Recompute the stored content hash of the rows of a queryset, after set based updates of business fields.
+
+    The version of the rows is bumped, so that the forms opened before see the change.
+    """
+    fields = hashed_fields(queryset.model)
+    batch = []
+    for entry in queryset.only(*[field.name for field in fields]).iterator(chunk_size=batch_size):
+        entry.content_hash = content_hash(fields, {field.name: getattr(entry, field.attname) for field in fields})
+        entry.version = F('version') + 1
+        batch.append(entry)
+        if len(batch) == batch_size:
+            queryset.bulk_update(batch, ['content_hash', 'version'])
+            batch = []
+    if batch:
+        queryset.bulk_update(batch, ['content_hash', 'version'])
+
+
+def can_return_updated(connection):
+    """True when the database returns the rows of an UPDATE, postgres and sqlite from 3.35."""
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)
+
+
+def update_returning(queryset, values):
+    """Update the rows of a queryset with the values, by attname, and return the primary keys of the rows written."""
+    query = queryset.query.chain(UpdateQuery)
+    query.add_update_values(values)
+    compiler = query.get_compiler(queryset.db)
+    compiler.pre_sql_setup()
+    update_sql, params = compiler.as_sql()
+    connection = connections[queryset.db]
+    with transaction.mark_for_rollback_on_error(using=queryset.db), connection.cursor() as cursor:
+        cursor.execute(f"{update_sql} RETURNING {connection.ops.quote_name(queryset.model._meta.pk.column)}",
+                       params)
+        return {row[0] for row in cursor.fetchall()}
+
+
+def stale_normalized(model, entries, fields, connection):
+    """
+    The update values that null the normalized fields of the rows whose written sources change.
+
+    A normalized field keeps its value in the rows where the entry writes the same sources as stored, and is
+    left alone when the fields do not write any of its sources or write the normalized field itself.
+    """
+    values = {}
+    for name, sources in NORMALIZED_SOURCES.items():
+        written = [source for source in sources if source in fields]
+        if not written or name in fields:
+            continue
+        field = model._meta.get_field(name)
+        value = Case(*[When(Q(pk=entry.pk) & ~Q(**{source: getattr(entry, source) for source in written}),
+                            then=Value(None)) for entry in entries],
+                     default=F(name), output_field=field)
+        if connection.features.requires_casted_case_in_updates:
+            value = Cast(value, output_field=field)
+        values[field.attname] = value
+    return values
+
+
+def versioned_update(queryset, entries, fields):
+    """
+    Write the fields of registry entries in one UPDATE per batch, each row only while it is at the entry version.
+
+    The version of every written row, and of its entry, is bumped. The normalized values of the rows whose
+    coordinates, datums or altitude change are nulled. The rows written are the ones the UPDATE returns, or,
+    on a database that cannot return them, the entries are written one UPDATE each. Returns the entries that
+    were not written.
+    """
+    connection = connections[queryset.db]
+    if not can_return_updated(connection):
+        conflicts = []
+        for entry in entries:
+            values = {name: getattr(entry, queryset.model._meta.get_field(name).attname) for name in fields}
+            values.update(stale_normalized(queryset.model, [entry], fields, connection))
+            if queryset.filter(pk=entry.pk, version=entry.version).update(version=F('version') + 1, **values):
+                entry.version += 1
+            else:
+                conflicts.append(entry)
+        return conflicts
+
+    model_fields = [queryset.model._meta.get_field(name) for name in fields]
+    batch_size = max(connection.ops.bulk_batch_size(['pk', 'pk', 'version'] + model_fields, entries), 1)
+    conflicts = []
+    for start in range(0, len(entries), batch_size):
+        batch = entries[start:start + batch_size]
+        at_version = Q()
+        for entry in batch:
+            at_version |= Q(pk=entry.pk, version=entry.version)
+        values = {'version': F('version') + 1}
+        for field in model_fields:
+            value = Case(*[When(pk=entry.pk, then=Value(getattr(entry, field.attname), output_field=field))
+                           for entry in batch], output_field=field)
+            if connection.features.requires_casted_case_in_updates:
+                value = Cast(value, output_field=field)
+            values[field.attname] = value
+        values.update(stale_normalized(queryset.model, batch, fields, connection))
+
+        written = update_returning(queryset.filter(at_version), values)
+        for entry in batch:
+            if entry.pk in written:
+                entry.version += 1
+            else:
+                conflicts.append(entry)
+    return conflicts
+
 
 class Registry(models.Model):
     """
@@ -17,9 +181,9 @@ class Registry(models.Model):
     """
     # these will become lookups with                    foreign keys
     agency_cd = models.CharField(max_length=20)       # AGENCY_LOV.AGENCY_CD
-    well_depth_units = models.IntegerField()          # UNITS_DIM.UNIT_ID
+    well_depth_units = models.SmallIntegerField()     # UNITS_DIM.UNIT_ID
     alt_datum_cd = models.CharField(max_length=10)    # ALT_DATUM_DIM.ADATUM_CD
-    alt_units = models.IntegerField()                 # UNITS_DIM.UNIT_ID
+    alt_units = models.SmallIntegerField()            # UNITS_DIM.UNIT_ID
     horz_datum = models.CharField(max_length=10)      # HORZ_DATUM_DIM.HDATUM_CD
     nat_aquifer_cd = models.CharField(max_length=10)  # NAT_AQFR.NAT_AQFR_CD
     country_cd = models.CharField(max_length=2)       # COUNTRY.COUNTRY_CD
@@ -30,27 +194,28 @@ class Registry(models.Model):
     agency_med = models.CharField(max_length=200)
     site_no = models.CharField(max_length=16)
     site_name = models.CharField(max_length=300)
-    # have to keep an eye on these when in postgres. in sqlite3 they loose the given precision
-    dec_lat_va = models.DecimalField(max_digits=11, decimal_places=8)
-    dec_long_va = models.DecimalField(max_digits=11, decimal_places=8)
+    # double precision keeps the 8 decimal places of the original NUMERIC(11,8) once rounded, see COORDINATE_PLACES
+    dec_lat_va = models.FloatField()
+    dec_long_va = models.FloatField()
     alt_va = models.DecimalField(max_digits=10, decimal_places=6)
     nat_aqfr_desc = models.CharField(max_length=100)
     local_aquifer_name = models.CharField(max_length=100)
     # for all flags ensure null->0 on load
-    qw_sn_flag = models.IntegerField(default=0, validators=[MinValueValidator(0), MaxValueValidator(1)])
-    qw_baseline_flag = models.IntegerField(default=0, validators=[MinValueValidator(0), MaxValueValidator(1)])
+    qw_sn_flag = models.BooleanField(default=False)
+    qw_baseline_flag = models.BooleanField(default=False)
     qw_well_chars = models.CharField(max_length=3)
     qw_well_purpose = models.CharField(max_length=15)
-    wl_sn_flag = models.IntegerField(default=0, validators=[MinValueValidator(0), MaxValueValidator(1)])
+    wl_sn_flag = models.BooleanField(default=False)
     # for some reason this field has a couple with 999 but there is no cache use case and not a lookup field
-    wl_baseline_flag = models.IntegerField(default=0, validators=[MinValueValidator(0), MaxValueValidator(1)])
+    # so it remains a small integer rather than a boolean
+    wl_baseline_flag = models.SmallIntegerField(default=0, validators=[MinValueValidator(0), MaxValueValidator(1)])
     wl_well_chars = models.CharField(max_length=3)
     wl_well_purpose = models.CharField(max_length=15)
     data_provider = models.CharField(max_length=30)
     qw_sys_name = models.CharField(max_length=50)
     wl_sys_name = models.CharField(max_length=50)
     pk_siteid = models.CharField(max_length=37)
-    display_flag = models.IntegerField(default=0, validators=[MinValueValidator(0), MaxValueValidator(1)])
+    display_flag = models.BooleanField(default=False)
     wl_data_provider = models.CharField(max_length=20)
     qw_data_provider = models.CharField(max_length=20)
     lith_data_provider = models.CharField(max_length=20)
@@ -75,9 +240,193 @@ class Registry(models.Model):
     insert_date = models.DateTimeField()
     update_date = models.DateTimeField()
 
+    # digest of the business fields, a cheap way to tell changed rows on reload
+    content_hash = models.CharField(max_length=32, default='', editable=False)
+    # bumped by every write, an update only applies to the version it was read at, see VersionConflict
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    # the coordinates in NAD83 and the altitude in NAVD88, null until normalized, see registry.datums
+    norm_lat_va = models.FloatField(null=True, editable=False)
+    norm_long_va = models.FloatField(null=True, editable=False)
+    norm_alt_va = models.FloatField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['agency_cd', 'site_no', 'content_hash'], name='registry_site_hash_idx'),
+            models.Index(fields=['norm_lat_va', 'norm_long_va'], name='registry_norm_coords_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Keep the loaded values of the normalization sources, to tell when the normalized values go stale."""
+        instance = super().from_db(db, field_names, values)
+        sources = {source for names in NORMALIZED_SOURCES.values() for source in names}
+        instance._loaded_sources = {name: value for name, value in zip(field_names, values) if name in sources}
+        return instance
+
+    def clear_stale_normalized(self):
+        """
+        Null the normalized values whose sources changed since the entry was loaded.
+
+        Returns the names of the cleared fields. An entry not loaded from the database has nothing to compare.
+        """
+        loaded = getattr(self, '_loaded_sources', {})
+        cleared = [name for name, sources in NORMALIZED_SOURCES.items()
+                   if any(source in loaded and getattr(self, source) != loaded[source] for source in sources)]
+        for name in cleared:
+            setattr(self, name, None)
+        return cleared
+
+    def remember_sources(self):
+        """Take the saved values of the normalization sources as the loaded ones."""
+        loaded = getattr(self, '_loaded_sources', {})
+        self._loaded_sources = {name: getattr(self, name) for name in loaded}
+
+    def compute_content_hash(self):
+        """The content hash of the current field values."""
+        fields = hashed_fields(self)
+        return content_hash(fields, {field.name: getattr(self, field.attname) for field in fields})
+
+    def save(self, *args, **kwargs):
+        """
+        Keep the content hash current on every save, and update the row only while it is at the version read.
+
+        The version is bumped by the update. Raises VersionConflict when the row is at another version, nothing
+        is written then. A new entry, or a missing row, is inserted as Django does. The normalized values of
+        changed coordinates or altitude are nulled until normalize_datums runs again.
+        """
+        self.content_hash = self.compute_content_hash()
+        update_fields = kwargs.get('update_fields')
+        cleared = self.clear_stale_normalized()
+        if cleared and update_fields:
+            update_fields = kwargs['update_fields'] = set(update_fields) | set(cleared)
+        if self.pk is None or kwargs.get('force_insert') or (update_fields is not None and not update_fields):
+            super().save(*args, **kwargs)
+            self.remember_sources()
+            return
+
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        values = {field.attname: field.pre_save(self, False) for field in self._meta.concrete_fields
+                  if not field.primary_key and field.name != 'version'
+                  and (update_fields is None or field.name in update_fields)}
+        entries = type(self)._base_manager.using(using).filter(pk=self.pk)
+        if entries.filter(version=self.version).update(version=F('version') + 1, **values):
+            self.version += 1
+            self._state.adding = False
+            self._state.db = using
+        elif entries.exists():
+            raise VersionConflict(self)
+        elif not kwargs.get('force_update') and update_fields is None:
+            super().save(*args, **kwargs)
+        else:
+            raise self.DoesNotExist('The registry entry to update no longer exists.')
+        self.remember_sources()
+
     def __str__(self):
         """Default string."""
         # Django does not honor tabs \t, multiple spaces '   ', nor &nbsp for formatting
-        str_rep = f"{self.agency_nm}:{self.site_no} display:{self.display_flag} "
-        str_rep += f"qw:{self.qw_sn_flag} wl:{self.wl_sn_flag}"
+        str_rep = f"{self.agency_nm}:{self.site_no} display:{self.display_flag:d} "
+        str_rep += f"qw:{self.qw_sn_flag:d} wl:{self.wl_sn_flag:d}"
         return str_rep
+
+
+class DuplicateCandidate(models.Model):
+    """
+    A pair of registry wells that may be the same physical well.
+
+    Found by the find_duplicate_wells command and kept for review in the admin.
+    The pair is stored with the lower id first.
+
+    """
+    NEW = 'new'
+    DUPLICATE = 'duplicate'
+    DISTINCT = 'distinct'
+    STATUS_CHOICES = [(NEW, 'New'), (DUPLICATE, 'Duplicate'), (DISTINCT, 'Distinct')]
+
+    well = models.ForeignKey(Registry, on_delete=models.CASCADE, related_name='duplicate_candidates')
+    other_well = models.ForeignKey(Registry, on_delete=models.CASCADE, related_name='+')
+    distance = models.FloatField(help_text='meters')
+    name_similarity = models.FloatField()
+    depth_difference = models.FloatField(null=True, blank=True)
+    score = models.FloatField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=NEW)
+    found_date = models.DateTimeField()
+
+    class Meta:
+        unique_together = [('well', 'other_well')]
+        indexes = [models.Index(fields=['status', '-score'], name='duplicate_status_score_idx')]
+
+    def __str__(self):
+        """Default string."""
+        return f"{self.well_id}~{self.other_well_id} score:{self.score:.2f} {self.status}"
+
+
+class MigrationFingerprint(models.Model):
+    """
+    The fingerprint of the migration files last applied by the startup_migrate command.
+
+    When it matches the bundled migrations a starting container can skip the migrations.
+
+    """
+    fingerprint = models.CharField(max_length=64)
+    applied_date = models.DateTimeField()
+
+    def __str__(self):
+        """Default string."""
+        return f"{self.fingerprint} {self.applied_date}"
+
+
+class RequestProfile(models.Model):
+    """
+    The profile of a request that a staff user asked to profile, see wellregistry.profiling.
+
+    """
+    path = models.CharField(max_length=500)
+    method = models.CharField(max_length=10)
+    username = models.CharField(max_length=150)
+    status_code = models.PositiveSmallIntegerField()
+    duration = models.FloatField(help_text='milliseconds')
+    query_count = models.PositiveIntegerField()
+    query_duration = models.FloatField(help_text='milliseconds')
+    # the top functions of the profile by cumulative time as pstats prints them
+    stats = models.TextField()
+    # json list of the queries with their alias, sql, duration and, for the slowest ones, their plan
+    queries = models.TextField()
+    profiled_date = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=['-profiled_date'], name='profile_date_idx')]
+
+    def __str__(self):
+        """Default string."""
+        return f"{self.method} {self.path} {self.duration:.0f}ms {self.profiled_date:%Y-%m-%d %H:%M:%S}"
+
+
+class LinkCheck(models.Model):
+    """
+    The last check of a distinct well link, see the check_links command.
+
+    The validators of the final url are sent with the next check, so that an unchanged target answers 304.
+
+    """
+    url = models.CharField(max_length=500, unique=True)
+    # null when there was no response
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    ok = models.BooleanField(default=False)
+    error = models.CharField(max_length=300, blank=True)
+    # the url answered after the redirects, with its ETag and Last-Modified headers
+    final_url = models.CharField(max_length=2000, blank=True)
+    etag = models.CharField(max_length=200, blank=True)
+    last_modified = models.CharField(max_length=50, blank=True)
+    # the checks in a row that failed
+    failures = models.PositiveIntegerField(default=0)
+    elapsed = models.FloatField(help_text='milliseconds')
+    checked_date = models.DateTimeField()
+
+    class Meta:
+        indexes = [models.Index(fields=['checked_date'], name='link_checked_idx')]
+
+    def __str__(self):
+        """Default string."""
+        return f"{self.url} {self.status_code or self.error} {self.checked_date:%Y-%m-%d %H:%M:%S}"
+
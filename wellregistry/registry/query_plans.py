@@ -0,0 +1,166 @@
+"""
+Plan regression checks of the critical registry queries.
+
+Each query of CATALOG is built from a sample well, so that its filters match real values, and run with
+EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON). The plan is reduced to a summary: the scan node, relation and
+index of each table access and the shared buffers, hit or read, of the whole query. The summaries are
+compared with baselines kept in query_plans.json. A scan that changes, typically an index scan that
+flips to a sequential scan after data growth or a migration, or buffers that grow past the tolerance
+are regressions.
+
+The plans depend on the size of the table, the baselines are recorded on a database seeded with
+seed_registry inside a transaction that is rolled back.
+"""
+import datetime
+import difflib
+import json
+import os
+import random
+
+from django.db import connections
+from django.utils import timezone
+
+from .models import Registry
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'query_plans.json')
+
+# the rows of a change list page, as the admin default
+PAGE_SIZE = 100
+# the days of the update_date range query
+UPDATE_DAYS = 30
+# growth of the buffers, as a fraction of the baseline, tolerated before it is a regression
+BUFFER_TOLERANCE = 0.25
+# blocks of growth always tolerated, small plans vary by a few blocks between runs
+BUFFER_SLACK = 8
+
+CATALOG = {
+    'changelist': lambda well: Registry.objects.order_by('-pk')[:PAGE_SIZE],
+    'changelist_agency': lambda well: Registry.objects.filter(agency_cd=well.agency_cd).order_by('-pk')[:PAGE_SIZE],
+    'changelist_site_no': lambda well: Registry.objects.filter(site_no=well.site_no).order_by('-pk')[:PAGE_SIZE],
+    'site_lookup': lambda well: Registry.objects.filter(agency_cd=well.agency_cd, site_no=well.site_no),
+    'update_date_range': lambda well: Registry.objects.filter(
+        update_date__gt=well.update_date - datetime.timedelta(days=UPDATE_DAYS), update_date__lte=well.update_date),
+    'displayed_wl_network': lambda well: Registry.objects.filter(display_flag=True, wl_sn_flag=True),
+    'displayed_qw_network': lambda well: Registry.objects.filter(display_flag=True, qw_sn_flag=True),
+    'export': lambda well: Registry.objects.filter(display_flag=True).order_by('pk'),
+    'export_state': lambda well: Registry.objects.filter(display_flag=True, state_cd=well.state_cd).order_by('pk'),
+    'snapshot': lambda well: Registry.objects.order_by('pk'),
+}
+
+
+def sample_well(using):
+    """The well in the middle of the table by id, the query parameters are taken from it."""
+    wells = Registry.objects.using(using)
+    count = wells.count()
+    if not count:
+        return None
+    return wells.order_by('pk')[count // 2]
+
+
+def explain_analyze(queryset, using):
+    """The EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) plan of the queryset, which runs it, as a list."""
+    connection = connections[using]
+    sql, params = queryset.query.get_compiler(using).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    # psycopg2 parses the json column, other drivers hand back the text
+    return json.loads(plan) if isinstance(plan, str) else plan
+
+
+def plan_summary(plan):
+    """The table accesses and shared buffers of an analyzed JSON plan."""
+    root = plan[0]['Plan']
+    scans = []
+
+    def walk(node):
+        if 'Relation Name' in node or 'Index Name' in node:
+            scans.append({'node': node['Node Type'], 'relation': node.get('Relation Name'),
+                          'index': node.get('Index Name')})
+        for child in node.get('Plans', []):
+            walk(child)
+
+    walk(root)
+    # a hit in a warm cache is a read in a cold one, their sum does not depend on the cache
+    return {
+        'scans': scans,
+        'buffers': root.get('Shared Hit Blocks', 0) + root.get('Shared Read Blocks', 0),
+        'rows': root.get('Actual Rows', 0),
+    }
+
+
+def regressions(baseline, current, tolerance=BUFFER_TOLERANCE, slack=BUFFER_SLACK):
+    """The reasons the current summary is a regression of the baseline one, empty when it is not."""
+    if baseline is None:
+        # a query without a baseline is not checked, which must not pass silently
+        return ['no baseline, record it with --update']
+    reasons = []
+    if current['scans'] != baseline['scans']:
+        flipped = [scan for scan in current['scans'] if scan['node'] == 'Seq Scan' and scan not in baseline['scans']]
+        for scan in flipped:
+            reasons.append(f"sequential scan of {scan['relation']}")
+        if not flipped:
+            reasons.append('table accesses changed')
+    if current['buffers'] > baseline['buffers'] * (1 + tolerance) + slack:
+        reasons.append(f"buffers grew from {baseline['buffers']} to {current['buffers']}")
+    return reasons
+
+
+def summary_diff(name, baseline, current):
+    """A unified diff of two summaries of a query."""
+    return ''.join(difflib.unified_diff(
+        json.dumps(baseline, indent=2, sort_keys=True).splitlines(keepends=True),
+        json.dumps(current, indent=2, sort_keys=True).splitlines(keepends=True),
+        fromfile=f"{name} baseline", tofile=f"{name} current"))
+
+
+def load_baselines(path=BASELINE_PATH):
+    """The stored baselines, None when there is no file yet."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baselines(baselines, path=BASELINE_PATH):
+    """Store the baselines, formatted to review their changes."""
+    with open(path, 'w') as baseline_file:
+        json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+        baseline_file.write('\n')
+
+
+def seed_registry(count, using, seed=0, batch_size=5000):
+    """
+    Insert count synthetic wells with skewed codes, dates and flags like the national registry.
+
+    The same count and seed always insert the same wells.
+    """
+    generator = random.Random(seed)
+    agencies = [f"AG{number:02d}" for number in range(30)]
+    agency_weights = [1 / (rank + 1) for rank in range(len(agencies))]
+    start = timezone.make_aware(datetime.datetime(2010, 1, 1))
+    wells = []
+    for number in range(count):
+        agency = generator.choices(agencies, agency_weights)[0]
+        site_no = f"{generator.randrange(10 ** 14, 10 ** 15)}"
+        inserted = start + datetime.timedelta(minutes=generator.randrange(10 * 365 * 24 * 60))
+        wells.append(Registry(
+            agency_cd=agency, well_depth_units=1, alt_datum_cd='NAVD88', alt_units=1,
+            horz_datum=generator.choice(['NAD27', 'NAD83', 'WGS84']), nat_aquifer_cd='N100', country_cd='US',
+            state_cd=f"{generator.randrange(1, 57):02d}", county_cd=f"{generator.randrange(1, 200):03d}",
+            agency_nm=agency, agency_med=agency, site_no=site_no, site_name=f"well {number}",
+            dec_lat_va=generator.uniform(25, 49), dec_long_va=generator.uniform(-125, -67),
+            alt_va=generator.randrange(5000), nat_aqfr_desc='', local_aquifer_name='',
+            qw_sn_flag=generator.random() < 0.1, qw_baseline_flag=False, qw_well_chars='', qw_well_purpose='',
+            wl_sn_flag=generator.random() < 0.3, wl_baseline_flag=0, wl_well_chars='', wl_well_purpose='',
+            data_provider=agency, qw_sys_name='', wl_sys_name='', pk_siteid=f"{agency}:{site_no}",
+            display_flag=generator.random() < 0.9, wl_data_provider='', qw_data_provider='',
+            lith_data_provider='', const_data_provider='', well_depth=generator.randrange(1000), link='',
+            wl_well_purpose_notes='', qw_well_purpose_notes='', insert_user_id='seed', update_user_id='seed',
+            wl_well_type='', qw_well_type='', local_aquifer_cd='', review_flag='', site_type='WELL',
+            aqfr_char='', horz_method='', horz_acy='', alt_method='', alt_acy='', insert_date=inserted,
+            update_date=inserted + datetime.timedelta(days=generator.randrange(365))))
+        if len(wells) == batch_size:
+            Registry.objects.using(using).bulk_create(wells)
+            wells = []
+    Registry.objects.using(using).bulk_create(wells)
@@ -0,0 +1,197 @@
+"""
+Reconcile the registry with a provider file.
+
+Each source row is hashed with the same digest as the stored content hash. Only the rows whose
+(agency_cd, site_no) is new, whose hash differs or that are no longer in the file are written,
+so a reload where little changed only writes that little. An update only applies while the row is at
+the version it was read at, the rows changed meanwhile by someone else are counted as conflicts.
+"""
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from .models import Registry, content_hash, hashed_fields, versioned_update
+from .validation import BatchValidator, ValidationReport
+
+BATCH_SIZE = 1000
+
+
+def registry_values(row):
+    """
+    Convert a source row, a dict of text by field name, to python values for the registry fields.
+
+    Blank values of the non character fields take the field default, for the flags this is the null->0 on load.
+    """
+    values = {}
+    for field in hashed_fields(Registry):
+        value = row.get(field.name)
+        if isinstance(value, str) and field.get_internal_type() != 'CharField':
+            value = value.strip()
+        if value in (None, '') and field.get_internal_type() != 'CharField':
+            values[field.name] = field.get_default() if field.has_default() else None
+        else:
+            values[field.name] = field.to_python('' if value is None else value)
+    return values
+
+
+class ReconcileSummary:
+    """
+    Counts of what a reconcile did, or would do on a dry run.
+
+    """
+    def __init__(self):
+        """All counts start at zero."""
+        self.read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.deleted = 0
+        self.unchanged = 0
+        self.invalid = 0
+        self.conflicts = 0
+
+    @property
+    def written(self):
+        """The rows inserted, updated or deleted."""
+        return self.inserted + self.updated + self.deleted
+
+    def __str__(self):
+        """A one line diff summary."""
+        return (f"read {self.read}, inserted {self.inserted}, updated {self.updated}, "
+                f"deleted {self.deleted}, unchanged {self.unchanged}, invalid {self.invalid}, "
+                f"conflicts {self.conflicts}")
+
+
+class Reconciler:
+    """
+    Stream source rows against the stored content hashes.
+
+    The stored keys and hashes of the agencies in scope are loaded once. Inserts and updates are
+    written in batches as the rows stream by and the deletes, the keys not seen, at the end.
+    Each batch is first checked by the batch validator, invalid rows are skipped and reported
+    but their keys count as seen so that they are not deleted.
+
+    """
+    def __init__(self, using=DEFAULT_DB_ALIAS, user='reconcile', batch_size=BATCH_SIZE,
+                 delete_missing=True, dry_run=False, validate=True):
+        """Options for one reconcile run."""
+        self.using = using
+        self.validator = BatchValidator(using=using, check_existing=False) if validate else None
+        self.report = ValidationReport()
+        self.user = user
+        self.batch_size = batch_size
+        self.delete_missing = delete_missing
+        self.dry_run = dry_run
+        self.fields = hashed_fields(Registry)
+        self.summary = ReconcileSummary()
+        self.stored = {}
+        self.seen = set()
+        self.loaded_agencies = set()
+        self.inserts = []
+        self.updates = []
+
+    def run(self, rows):
+        """Reconcile an iterable of source rows and return the summary."""
+        with transaction.atomic(using=self.using):
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) == self.batch_size:
+                    self.reconcile_chunk(chunk)
+                    chunk = []
+            self.reconcile_chunk(chunk)
+            self.flush()
+            self.delete_unseen()
+        return self.summary
+
+    def reconcile_chunk(self, rows):
+        """Validate a chunk of source rows and reconcile the valid ones."""
+        offset = self.report.rows
+        if self.validator:
+            self.validator.validate_chunk(rows, offset, self.report)
+        else:
+            self.report.rows += len(rows)
+        for index, row in enumerate(rows, offset):
+            if index in self.report.errors:
+                self.skip_row(row)
+            else:
+                self.reconcile_row(registry_values(row))
+
+    def skip_row(self, row):
+        """Count an invalid row and keep its stored entry from being deleted."""
+        self.summary.read += 1
+        self.summary.invalid += 1
+        agency_cd, site_no = (str(row.get(name) or '').strip() for name in ('agency_cd', 'site_no'))
+        self.load_agency(agency_cd)
+        self.stored.pop((agency_cd, site_no), None)
+
+    def load_agency(self, agency_cd):
+        """Load the stored keys and hashes of an agency the first time one of its rows is seen."""
+        if agency_cd in self.loaded_agencies:
+            return
+        self.loaded_agencies.add(agency_cd)
+        stored = Registry.objects.using(self.using).filter(agency_cd=agency_cd)
+        for site_no, pk, stored_hash, version in stored.values_list(
+                'site_no', 'id', 'content_hash', 'version').iterator():
+            self.stored[(agency_cd, site_no)] = (pk, stored_hash, version)
+
+    def reconcile_row(self, values):
+        """Queue an insert or update when the row is new or changed."""
+        self.summary.read += 1
+        self.load_agency(values['agency_cd'])
+        row_hash = content_hash(self.fields, values)
+        key = (values['agency_cd'], values['site_no'])
+        stored = self.stored.pop(key, None)
+
+        if key in self.seen:
+            # a duplicate later in the file than the chunk that the validator saw
+            self.summary.invalid += 1
+            message = f"Duplicate of an earlier row for {key[0]}:{key[1]}."
+            self.report.add(self.summary.read - 1, 'site_no', message)
+            return
+        self.seen.add(key)
+        if stored is None:
+            self.summary.inserted += 1
+            self.inserts.append(self.entry(values, row_hash, None))
+        elif stored[1] != row_hash:
+            self.summary.updated += 1
+            self.updates.append(self.entry(values, row_hash, stored[0], stored[2]))
+        else:
+            self.summary.unchanged += 1
+
+        if len(self.inserts) + len(self.updates) >= self.batch_size:
+            self.flush()
+
+    def entry(self, values, row_hash, pk, version=1):
+        """A registry instance for the row with the bookkeeping fields set."""
+        now = timezone.now()
+        entry = Registry(id=pk, content_hash=row_hash, version=version, update_user_id=self.user, update_date=now,
+                         **values)
+        if pk is None:
+            entry.insert_user_id = self.user
+            entry.insert_date = now
+        return entry
+
+    def flush(self):
+        """Write the queued inserts and updates."""
+        if not self.dry_run:
+            entries = Registry.objects.using(self.using)
+            if self.inserts:
+                entries.bulk_create(self.inserts, batch_size=self.batch_size)
+            if self.updates:
+                update_fields = [field.name for field in self.fields]
+                update_fields += ['content_hash', 'update_user_id', 'update_date']
+                conflicts = versioned_update(entries, self.updates, update_fields)
+                self.summary.updated -= len(conflicts)
+                self.summary.conflicts += len(conflicts)
+        self.inserts = []
+        self.updates = []
+
+    def delete_unseen(self):
+        """Delete the stored rows of the agencies in scope that the source no longer has."""
+        if not self.delete_missing:
+            return
+        unseen = [pk for pk, _, _ in self.stored.values()]
+        self.summary.deleted = len(unseen)
+        if self.dry_run:
+            return
+        for start in range(0, len(unseen), self.batch_size):
+            Registry.objects.using(self.using).filter(id__in=unseen[start:start + self.batch_size]).delete()
@@ -0,0 +1,237 @@
+"""
+Columnar Parquet snapshots of the registry for analytics.
+
+A snapshot is a zstd compressed Parquet file of every well with typed columns: the coordinates, the
+altitude and the depth are doubles, the flags booleans, the dates UTC timestamps and the low cardinality
+codes dictionary encoded, which pandas reads as categoricals. The wells are read through a server side
+cursor, BATCH_ROWS at a time, and each batch is written as a row group, so that the memory used does
+not grow with the registry.
+
+The snapshots are cached in settings.SNAPSHOT_DIR by registry version, a digest of the count, the
+highest id, the sum of the row versions and the latest update date of the wells. It is read without
+any lock, so the writers never wait for it. A missing snapshot is built in a background thread, one
+build at a time across the workers of the host under a file lock, and the download answers 503 until
+it is ready.
+> python -m manage snapshot_registry
+"""
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Count, FloatField, Max, Sum
+from django.db.models.functions import Cast
+
+import pyarrow
+import pyarrow.parquet
+
+from .models import Registry
+
+logger = logging.getLogger(__name__)
+
+# the wells of a row group, bounds the memory of a snapshot
+BATCH_ROWS = 50000
+# the snapshot files kept in the cache, the latest ones
+KEPT_SNAPSHOTS = 2
+# the lock file held by the snapshot build, in settings.SNAPSHOT_DIR
+LOCK_NAME = '.build.lock'
+# the code columns with few distinct values, dictionary encoded
+DICTIONARY_FIELDS = (
+    'agency_cd', 'alt_datum_cd', 'horz_datum', 'nat_aquifer_cd', 'country_cd', 'state_cd', 'county_cd',
+    'agency_nm', 'agency_med', 'nat_aqfr_desc', 'qw_well_chars', 'qw_well_purpose', 'wl_well_chars',
+    'wl_well_purpose', 'data_provider', 'qw_sys_name', 'wl_sys_name', 'wl_data_provider', 'qw_data_provider',
+    'lith_data_provider', 'const_data_provider', 'wl_well_type', 'qw_well_type', 'review_flag', 'site_type',
+    'aqfr_char',
+)
+# the bookkeeping fields left out of the snapshots
+EXCLUDED_FIELDS = ('content_hash', 'version')
+
+CONTENT_TYPE = 'application/vnd.apache.parquet'
+
+# the background build thread of this process
+_builder = None
+_builder_lock = threading.Lock()
+
+
+def snapshot_fields():
+    """The model fields of the snapshot columns."""
+    return [field for field in Registry._meta.concrete_fields if field.name not in EXCLUDED_FIELDS]
+
+
+def arrow_type(field):
+    """The arrow type of the column of a model field."""
+    internal_type = field.get_internal_type()
+    if field.name in DICTIONARY_FIELDS:
+        return pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+    if internal_type in ('FloatField', 'DecimalField'):
+        return pyarrow.float64()
+    if internal_type == 'BooleanField':
+        return pyarrow.bool_()
+    if internal_type in ('SmallIntegerField', 'PositiveSmallIntegerField'):
+        return pyarrow.int16()
+    if internal_type in ('AutoField', 'IntegerField', 'PositiveIntegerField', 'BigIntegerField'):
+        return pyarrow.int64()
+    if internal_type == 'DateTimeField':
+        return pyarrow.timestamp('us', tz='UTC')
+    return pyarrow.string()
+
+
+def snapshot_schema(fields):
+    """The arrow schema of the snapshot columns."""
+    return pyarrow.schema([pyarrow.field(field.name, arrow_type(field), nullable=field.null) for field in fields])
+
+
+def registry_version(using):
+    """
+    A digest that changes with every insert, update and delete of a well.
+
+    Every write of a well bumps its version, which the optimistic locking of Registry.save relies on, and
+    sets its update date, so the sum of the versions and the latest date follow the updates and the count
+    and highest id the inserts and deletes. Read in the transaction of a build, it matches the wells read.
+    """
+    totals = Registry.objects.using(using).aggregate(Count('id'), Max('id'), Sum('version'), Max('update_date'))
+    digest = hashlib.blake2b(':'.join(str(value) for value in totals.values()).encode(), digest_size=8)
+    return digest.hexdigest()
+
+
+def snapshot_path(version):
+    """The cached snapshot file of a registry version."""
+    return os.path.join(settings.SNAPSHOT_DIR, f"registry-{version}.parquet")
+
+
+def repeatable_read(using):
+    """Read the version and the wells from one database snapshot, on postgres."""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+
+
+def write_snapshot(out, using, batch_rows=BATCH_ROWS):
+    """Write the Parquet snapshot of the registry to a path or a binary file, returns the wells written."""
+    fields = snapshot_fields()
+    schema = snapshot_schema(fields)
+    # the decimals are cast by the database rather than converted one by one
+    casts = {f"{field.name}_float": Cast(field.name, FloatField())
+             for field in fields if field.get_internal_type() == 'DecimalField'}
+    columns = [f"{field.name}_float" if f"{field.name}_float" in casts else field.name for field in fields]
+    rows = Registry.objects.using(using).annotate(**casts).order_by('pk').values_list(*columns)
+
+    written = 0
+    writer = pyarrow.parquet.ParquetWriter(out, schema, compression='zstd')
+    try:
+        batch = []
+        for row in rows.iterator(chunk_size=batch_rows):
+            batch.append(row)
+            if len(batch) == batch_rows:
+                writer.write_table(record_table(batch, schema))
+                written += len(batch)
+                batch = []
+        if batch or not written:
+            writer.write_table(record_table(batch, schema))
+            written += len(batch)
+    finally:
+        writer.close()
+    return written
+
+
+def record_table(rows, schema):
+    """An arrow table of the rows, a row group of the snapshot."""
+    arrays = []
+    for values, field in zip(zip(*rows) if rows else [[]] * len(schema), schema):
+        if pyarrow.types.is_dictionary(field.type):
+            arrays.append(pyarrow.array(values, pyarrow.string()).dictionary_encode())
+        else:
+            arrays.append(pyarrow.array(values, field.type))
+    return pyarrow.Table.from_arrays(arrays, schema=schema)
+
+
+def open_snapshot(using=None):
+    """
+    The registry version and the open snapshot file of that version, None when it is not built yet.
+
+    The file stays readable through the open handle when a later build deletes it.
+    """
+    using = using or router.db_for_read(Registry)
+    version = registry_version(using)
+    try:
+        return version, open(snapshot_path(version), 'rb')
+    except FileNotFoundError:
+        return version, None
+
+
+def build_snapshot(using=None, batch_rows=BATCH_ROWS):
+    """
+    Write the snapshot of the current registry version unless it exists, returns its path.
+
+    Returns None without waiting when another build holds the lock. The file is written under a temporary
+    name and renamed, so that a request never reads a partial file.
+    """
+    using = using or router.db_for_read(Registry)
+    os.makedirs(settings.SNAPSHOT_DIR, exist_ok=True)
+    with open(os.path.join(settings.SNAPSHOT_DIR, LOCK_NAME), 'a') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        with transaction.atomic(using=using):
+            repeatable_read(using)
+            version = registry_version(using)
+            path = snapshot_path(version)
+            if os.path.exists(path):
+                return path
+
+            start = time.perf_counter()
+            handle, partial = tempfile.mkstemp(suffix='.partial', dir=settings.SNAPSHOT_DIR)
+            try:
+                with os.fdopen(handle, 'wb') as out:
+                    written = write_snapshot(out, using, batch_rows)
+                os.replace(partial, path)
+            except BaseException:
+                os.remove(partial)
+                raise
+        logger.info("wrote snapshot %s of %d wells, %d bytes in %.1fs",
+                    version, written, os.path.getsize(path), time.perf_counter() - start)
+        prune_snapshots(path)
+    return path
+
+
+def prune_snapshots(path):
+    """Delete the snapshots older than the latest KEPT_SNAPSHOTS and the partial files, under the build lock."""
+    names = os.listdir(settings.SNAPSHOT_DIR)
+    for name in names:
+        if name.endswith('.partial'):  # left by a build that died, none runs while the lock is held
+            os.remove(os.path.join(settings.SNAPSHOT_DIR, name))
+    built = os.path.getmtime(path)
+    snapshots = sorted((os.path.join(settings.SNAPSHOT_DIR, name) for name in names
+                        if name.startswith('registry-') and name.endswith('.parquet')),
+                       key=os.path.getmtime, reverse=True)
+    for stale in snapshots[KEPT_SNAPSHOTS:]:
+        # the open files of the downloads stay readable
+        if stale != path and os.path.getmtime(stale) <= built:
+            os.remove(stale)
+
+
+def start_build(using=None):
+    """Build the snapshot in a background thread, unless this process builds one already, returns the thread."""
+    global _builder  # pylint: disable=global-statement
+    with _builder_lock:
+        if _builder is None or not _builder.is_alive():
+            _builder = threading.Thread(target=background_build, args=(using,), name='snapshot-build', daemon=True)
+            _builder.start()
+        return _builder
+
+
+def background_build(using):
+    """Build the snapshot and close the connections of the thread."""
+    try:
+        build_snapshot(using)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception('The snapshot build failed')
+    finally:
+        connections.close_all()
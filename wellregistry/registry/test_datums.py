@@ -0,0 +1,125 @@
+"""
+Tests for the datum normalization
+"""
+
+import json
+import os
+import tempfile
+from io import StringIO
+
+import numpy
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from .checks import check_alt_unit_meters
+from .datums import DatumNormalizer, ShiftGrid
+from .models import Registry
+from .tests import make_registry
+from .validation import load_lookups
+
+
+class TestDatums(TestCase):
+
+    def setUp(self):
+        # shifts growing linearly to the north and east, which the bilinear interpolation reproduces exactly
+        lat, lng = numpy.meshgrid(numpy.arange(40.0, 46.0), numpy.arange(-92.0, -86.0), indexing='ij')
+        self.horizontal = {'lat0': 40.0, 'lon0': -92.0, 'lat_step': 1.0, 'lon_step': 1.0,
+                           'dlat': (lat - 40) * 0.1, 'dlon': (lng + 92) * -0.2}
+        self.vertical = {'lat0': 40.0, 'lon0': -92.0, 'lat_step': 1.0, 'lon_step': 1.0,
+                         'dz': numpy.full(lat.shape, 0.3048)}
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        numpy.savez(os.path.join(self.path, 'NAD27_NAD83.npz'), **self.horizontal)
+        numpy.savez(os.path.join(self.path, 'NGVD29_NAVD88.npz'), **self.vertical)
+
+    def test_interpolate(self):
+        grid = ShiftGrid.load(os.path.join(self.path, 'NAD27_NAD83.npz'))
+
+        shifts = grid.interpolate(numpy.array([43.5, 45.0, 39.9]), numpy.array([-89.25, -87.0, -89.0]))
+
+        numpy.testing.assert_allclose(shifts['dlat'][:2], [0.35, 0.5])
+        numpy.testing.assert_allclose(shifts['dlon'][:2], [-0.55, -1.0])
+        self.assertTrue(numpy.isnan(shifts['dlat'][2]))
+
+    def test_normalize(self):
+        # SETUP
+        normalizer = DatumNormalizer.from_directory(self.path)
+        lat = numpy.array([43.5, 43.5, 43.5, 43.5])
+        lng = numpy.array([-89.25, -89.25, -89.25, -89.25])
+
+        # TEST ACTION
+        norm_lat, norm_lng, norm_alt = normalizer.normalize(
+            lat, lng, numpy.array(['NAD27', 'WGS84', 'OLDHI', 'NAD83'], dtype=object),
+            numpy.array([100.0, 100.0, 100.0, 100.0]),
+            numpy.array(['NGVD29', 'NGVD29', 'NAVD88', 'LMSL'], dtype=object), numpy.array([1, 2, 1, 1]))
+
+        # ASSERTIONS
+        self.assertEqual(normalizer.datums, ['NAD27', 'NGVD29'])
+        numpy.testing.assert_allclose(norm_lat, [43.5 + 0.35 / 3600, 43.5, numpy.nan, 43.5])
+        numpy.testing.assert_allclose(norm_lng, [-89.25 - 0.55 / 3600, -89.25, numpy.nan, -89.25])
+        numpy.testing.assert_allclose(norm_alt, [101.0, 100.3048, 100.0, numpy.nan])
+
+    def test_incomplete_grid(self):
+        numpy.savez(os.path.join(self.path, 'NAD27_NAD83.npz'),
+                    **{name: value for name, value in self.horizontal.items() if name != 'dlon'})
+
+        with self.assertRaisesRegex(ValueError, 'dlat and dlon'):
+            DatumNormalizer.from_directory(self.path)
+
+    def test_unit_meters_check(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as lookups:
+            json.dump({'alt_units': [1, 2]}, lookups)
+            lookups.flush()
+            with override_settings(REGISTRY_LOOKUPS_FILE=lookups.name):
+                load_lookups.cache_clear()
+                self.addCleanup(load_lookups.cache_clear)
+                self.assertEqual(check_alt_unit_meters(None), [])
+                with override_settings(ALT_UNIT_METERS={1: 0.3048, 3: 1.0, 'm': 0}):
+                    errors = check_alt_unit_meters(None)
+
+        self.assertEqual([error.id for error in errors], ['registry.E001', 'registry.E003'])
+        self.assertIn('[3]', errors[1].msg)
+
+    def test_edit_clears_normalized(self):
+        # SETUP
+        make_registry(site_no='1').save()
+        Registry.objects.update(norm_lat_va=43.5, norm_long_va=-89.25, norm_alt_va=100.0)
+        normalized = Registry.objects.values_list('norm_lat_va', 'norm_long_va', 'norm_alt_va')
+
+        # TEST ACTION
+        well = Registry.objects.get()
+        well.site_name = 'renamed'
+        well.save()
+        renamed = normalized.get()
+        well.alt_units = 2
+        well.save(update_fields=['alt_units'])
+        new_units = normalized.get()
+        well = Registry.objects.get()
+        well.horz_datum = 'NAD27'
+        well.save()
+
+        # ASSERTIONS
+        self.assertEqual(renamed, (43.5, -89.25, 100.0))
+        self.assertEqual(new_units, (43.5, -89.25, None))
+        self.assertEqual(normalized.get(), (None, None, None))
+
+    def test_command(self):
+        # SETUP
+        for site_no, horz_datum in (('1', 'NAD27'), ('2', 'NAD83'), ('3', 'OLDHI')):
+            make_registry(site_no=site_no, horz_datum=horz_datum, dec_lat_va=43.5, dec_long_va=-89.25,
+                          alt_datum_cd='NGVD29').save()
+
+        # TEST ACTION
+        first, second = StringIO(), StringIO()
+        call_command('normalize_datums', self.path, '--processes=2', '--chunk-size=2', stdout=first)
+        call_command('normalize_datums', self.path, '--processes=1', stdout=second)
+
+        # ASSERTIONS
+        self.assertIn('3 wells changed, 3 written', first.getvalue())
+        self.assertIn('1 wells without normalized coordinates, 0 without normalized altitude', first.getvalue())
+        self.assertIn('0 wells changed', second.getvalue())
+        well = Registry.objects.get(site_no='1')
+        self.assertEqual((well.norm_lat_va, well.norm_long_va, well.norm_alt_va, well.version),
+                         (round(43.5 + 0.35 / 3600, 8), round(-89.25 - 0.55 / 3600, 8), 861.0, 2))
+        self.assertIsNone(Registry.objects.get(site_no='3').norm_lat_va)
+        self.assertEqual(well.content_hash, well.compute_content_hash())
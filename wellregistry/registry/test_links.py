@@ -0,0 +1,159 @@
+"""
+Tests for the link checks
+"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from .links import LinkChecker, absolute_url
+from .models import LinkCheck
+from .tests import make_registry
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """The responses of the link checks, by path."""
+    active = 0
+    most_active = 0
+    lock = threading.Lock()
+
+    def do_HEAD(self):  # pylint: disable=invalid-name
+        with self.lock:
+            StubHandler.active += 1
+            StubHandler.most_active = max(StubHandler.most_active, StubHandler.active)
+        path = self.path.partition('?')[0]
+        try:
+            if path == '/slow':
+                time.sleep(0.5)
+            if path == '/nohead' and self.command == 'HEAD':
+                self.answer(405)
+            elif path in ('/ok', '/nohead', '/slow'):
+                if self.headers.get('If-None-Match') == '"v1"':
+                    self.answer(304)
+                else:
+                    self.answer(200, ETag='"v1"')
+            elif path == '/moved':
+                self.answer(301, Location='/ok')
+            elif path == '/loop':
+                self.answer(302, Location='/loop')
+            else:
+                self.answer(404)
+        finally:
+            with self.lock:
+                StubHandler.active -= 1
+
+    do_GET = do_HEAD
+
+    def answer(self, status, **headers):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class TestLinks(TestCase):
+
+    def setUp(self):
+        StubHandler.most_active = 0
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    def check(self, *links, **options):
+        checker = LinkChecker(**{'delay': 0, 'timeout': 2, **options})
+        return {result.url: result for result in checker.run([(link, '', '', '') for link in links])}
+
+    def test_absolute_url(self):
+        self.assertEqual(absolute_url(' waterdata.usgs.gov/nwis '), 'http://waterdata.usgs.gov/nwis')
+        self.assertEqual(absolute_url('https://example.com/a?b=1'), 'https://example.com/a?b=1')
+        self.assertIsNone(absolute_url('ftp://example.com/file'))
+        self.assertIsNone(absolute_url('http://'))
+
+    def test_check(self):
+        # TEST ACTION
+        results = self.check(*[f"{self.base}{path}" for path in ('/ok', '/dead', '/moved', '/nohead', '/loop')],
+                             'mailto:someone', 'http://127.0.0.1:1/closed')
+
+        # ASSERTIONS
+        ok = results[f"{self.base}/ok"]
+        self.assertEqual((ok.status_code, ok.ok, ok.etag, ok.final_url), (200, True, '"v1"', f"{self.base}/ok"))
+        self.assertEqual((results[f"{self.base}/dead"].status_code, results[f"{self.base}/dead"].ok), (404, False))
+        moved = results[f"{self.base}/moved"]
+        self.assertEqual((moved.status_code, moved.final_url), (200, f"{self.base}/ok"))
+        self.assertEqual(results[f"{self.base}/nohead"].status_code, 200)
+        self.assertEqual(results[f"{self.base}/loop"].error, 'too many redirects')
+        self.assertEqual(results['mailto:someone'].error, 'invalid url')
+        self.assertFalse(results['http://127.0.0.1:1/closed'].ok)
+        self.assertTrue(results['http://127.0.0.1:1/closed'].error)
+
+    def test_timeout(self):
+        result = self.check(f"{self.base}/slow", timeout=0.2)[f"{self.base}/slow"]
+
+        self.assertEqual((result.error, result.ok), ('timeout', False))
+
+    def test_per_host(self):
+        # TEST ACTION
+        results = self.check(*[f"{self.base}/slow?{index}" for index in range(4)], concurrency=4, per_host=1,
+                             timeout=10)
+
+        # ASSERTIONS
+        self.assertTrue(all(result.ok for result in results.values()))
+        self.assertEqual(StubHandler.most_active, 1)
+
+    def test_unexpected_failure(self):
+        # SETUP
+        checker = LinkChecker(delay=0, timeout=2)
+        checked = checker.check
+
+        async def check(url, *args):
+            if url.endswith('/dead'):
+                raise RuntimeError('bug')
+            return await checked(url, *args)
+
+        # TEST ACTION
+        with mock.patch.object(checker, 'check', side_effect=check), self.assertLogs('registry.links', 'ERROR'):
+            results = {result.url: result for result in checker.run(
+                [(f"{self.base}{path}", '', '', '') for path in ('/ok', '/dead')])}
+
+        # ASSERTIONS
+        self.assertTrue(results[f"{self.base}/ok"].ok)
+        self.assertEqual(results[f"{self.base}/dead"].error, "check failed: RuntimeError('bug')")
+        self.assertEqual([repr(error) for error in checker.failures], ["RuntimeError('bug')"])
+
+    def test_command(self):
+        # SETUP
+        for site_no, path in (('1', '/ok'), ('2', '/ok'), ('3', '/dead'), ('4', '/moved')):
+            make_registry(site_no=site_no, link=f"{self.base}{path}").save()
+        make_registry(site_no='5', link='').save()
+        LinkCheck.objects.create(url='http://removed.example.com', elapsed=0, checked_date=timezone.now())
+        options = {'delay': 0, 'timeout': 2}
+
+        # TEST ACTION
+        first, fresh, stale = StringIO(), StringIO(), StringIO()
+        call_command('check_links', stdout=first, **options)
+        call_command('check_links', stdout=fresh, **options)
+        call_command('check_links', ttl_hours=0, stdout=stale, **options)
+
+        # ASSERTIONS
+        self.assertIn('3 links checked', first.getvalue())
+        self.assertIn('2 ok, 0 unchanged, 1 broken; 1 checks of removed links deleted', first.getvalue())
+        self.assertIn('0 links checked', fresh.getvalue())
+        self.assertIn('0 ok, 2 unchanged, 1 broken', stale.getvalue())
+        self.assertEqual(LinkCheck.objects.count(), 3)
+        dead = LinkCheck.objects.get(url=f"{self.base}/dead")
+        self.assertEqual((dead.status_code, dead.ok, dead.failures), (404, False, 2))
+        moved = LinkCheck.objects.get(url=f"{self.base}/moved")
+        self.assertEqual((moved.status_code, moved.ok, moved.etag, moved.final_url),
+                         (200, True, '"v1"', f"{self.base}/ok"))
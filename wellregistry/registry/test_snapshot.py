@@ -0,0 +1,172 @@
+"""
+Tests for the registry snapshots
+"""
+
+import fcntl
+import os
+import tempfile
+import threading
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from .models import Registry
+from . import snapshot
+from .tests import make_registry
+from .views import snapshot_cost
+
+
+class TestSnapshot(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings = override_settings(SNAPSHOT_DIR=os.path.join(directory.name, 'snapshots'),
+                                          RATE_LIMIT_STORE=os.path.join(directory.name, 'ratelimit.sqlite3'))
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        self.staff = get_user_model().objects.create_user('analyst', is_staff=True)
+        for number, agency in enumerate(['USGS', 'USGS', 'MN DNR']):
+            make_registry(agency_cd=agency, site_no=str(number), alt_va=Decimal('860.5')).save()
+
+    def test_registry_version(self):
+        # TEST ACTION
+        versions = [snapshot.registry_version('default')]
+        well = Registry.objects.first()
+        well.site_name = 'renamed'
+        well.save()
+        versions.append(snapshot.registry_version('default'))
+        Registry.objects.last().delete()
+        versions.append(snapshot.registry_version('default'))
+        with connection.cursor() as cursor:
+            cursor.execute("UPDATE registry_registry SET site_name = 'raw', version = version + 1")
+        versions.append(snapshot.registry_version('default'))
+
+        # ASSERTIONS
+        self.assertEqual(len(set(versions)), 4)
+        self.assertEqual(snapshot.registry_version('default'), versions[-1])
+
+    def test_download_requires_staff(self):
+        self.assertEqual(Client().get('/registry/snapshot.parquet').status_code, 403)
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        self.assertEqual(snapshot_cost(request), 0)
+
+    def test_snapshot(self):
+        # SETUP
+        client = Client()
+        client.force_login(self.staff)
+
+        # TEST ACTION
+        with mock.patch.object(snapshot, 'start_build', side_effect=snapshot.build_snapshot) as start_build:
+            building = client.get('/registry/snapshot.parquet')
+            response = client.get('/registry/snapshot.parquet')
+        content = b''.join(response.streaming_content)
+        response.close()
+        table = snapshot.pyarrow.parquet.read_table(snapshot.pyarrow.BufferReader(content))
+        not_modified = client.get('/registry/snapshot.parquet', HTTP_IF_NONE_MATCH=response['ETag'])
+
+        # ASSERTIONS
+        self.assertEqual((building.status_code, building['Retry-After']), (503, '30'))
+        start_build.assert_called_once_with()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], snapshot.CONTENT_TYPE)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(table.column('agency_cd').to_pylist(), ['USGS', 'USGS', 'MN DNR'])
+        self.assertTrue(snapshot.pyarrow.types.is_dictionary(table.schema.field('agency_cd').type))
+        self.assertEqual(table.column('alt_va').to_pylist(), [860.5] * 3)
+        self.assertNotIn('content_hash', table.column_names)
+
+    def test_one_build_at_a_time(self):
+        os.makedirs(settings.SNAPSHOT_DIR)
+        with open(os.path.join(settings.SNAPSHOT_DIR, snapshot.LOCK_NAME), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            self.assertIsNone(snapshot.build_snapshot('default'))
+
+        self.assertTrue(os.path.exists(snapshot.build_snapshot('default')))
+
+    def test_start_build_once(self):
+        release = threading.Event()
+        with mock.patch.object(snapshot, 'background_build', side_effect=lambda using: release.wait(5)):
+            first = snapshot.start_build()
+            second = snapshot.start_build()
+            release.set()
+            first.join()
+
+        self.assertIs(first, second)
+
+    def test_prune_keeps_open_files(self):
+        # SETUP
+        oldest = snapshot.build_snapshot('default')
+        _, oldest_file = snapshot.open_snapshot('default')
+        self.addCleanup(oldest_file.close)
+        partial = os.path.join(settings.SNAPSHOT_DIR, 'dead.partial')
+        open(partial, 'w').close()
+
+        # TEST ACTION
+        paths = []
+        for name in ('second', 'third'):
+            well = Registry.objects.first()
+            well.site_name = name
+            well.save()
+            paths.append(snapshot.build_snapshot('default'))
+
+        # ASSERTIONS
+        self.assertFalse(os.path.exists(oldest))
+        self.assertFalse(os.path.exists(partial))
+        self.assertTrue(all(os.path.exists(path) for path in paths))
+        self.assertEqual(snapshot.pyarrow.parquet.read_table(oldest_file).num_rows, 3)
+
+    def test_command_batches(self):
+        output = os.path.join(settings.SNAPSHOT_DIR, 'registry.parquet')
+        os.makedirs(settings.SNAPSHOT_DIR)
+        out = StringIO()
+
+        call_command('snapshot_registry', output=output, batch_rows=2, stdout=out)
+
+        self.assertIn('3 wells', out.getvalue())
+        self.assertEqual(snapshot.pyarrow.parquet.ParquetFile(output).num_row_groups, 2)
+
+
+class TestSnapshotWriters(TransactionTestCase):
+
+    def test_writers_in_two_transactions(self):
+        # SETUP
+        for site_no in ('1', '2'):
+            make_registry(site_no=site_no).save()
+        versions = [snapshot.registry_version('default')]
+        statements = []
+
+        def write(site_no):
+            try:
+                with transaction.atomic(), CaptureQueriesContext(connection) as queries:
+                    well = Registry.objects.get(site_no=site_no)
+                    well.site_name = 'renamed'
+                    well.save()
+                statements.extend(query['sql'] for query in queries.captured_queries)
+            finally:
+                connection.close()
+
+        # TEST ACTION
+        for site_no in ('1', '2'):
+            writer = threading.Thread(target=write, args=(site_no,))
+            writer.start()
+            writer.join()
+            versions.append(snapshot.registry_version('default'))
+
+        # ASSERTIONS
+        writes = [sql for sql in statements if sql.lstrip().startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertEqual(len(writes), 2)
+        # the writers share no row, only the wells they write
+        self.assertTrue(all(sql.lstrip().startswith('UPDATE "registry_registry"') for sql in writes))
+        self.assertEqual(len(set(versions)), 3)
+        self.assertEqual(Registry.objects.filter(site_name='renamed').count(), 2)
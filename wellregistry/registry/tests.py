@@ -2,12 +2,66 @@
 Tests for the registry application
 """
 
+import csv
+import datetime
+import importlib
+import json
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.admin.sites import AdminSite
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import F
 from django.test import RequestFactory, TestCase
+from django.utils import timezone
 from .admin import RegistryAdmin, check_mark
-from .models import Registry
+from .forms import RegistryForm, data_value
+from .management.commands.check_query_plans import Command as CheckQueryPlans
+from .management.commands.compact_registry import compact_column_order
+from .management.commands.startup_migrate import bundled_fingerprint, fingerprint
+from .boundaries import BoundaryIndex
+from .duplicates import Well, block, find_candidates, haversine
+from .query_plans import (CATALOG, load_baselines, plan_summary, regressions, sample_well, seed_registry,
+                          summary_diff)
+from .models import (COORDINATE_PLACES, DuplicateCandidate, MigrationFingerprint, Registry,
+                     VersionConflict, hashed_fields, refresh_content_hashes, versioned_update)
+from .reconcile import Reconciler, registry_values
+from .validation import BatchValidator
 from .views import BasePage, status_check
 
 
+def make_registry(**kwargs):
+    """A valid unsaved registry entry, any field can be overridden."""
+    now = timezone.make_aware(datetime.datetime(2020, 5, 1, 12, 0))
+    values = {
+        'agency_cd': 'USGS', 'well_depth_units': 1, 'alt_datum_cd': 'NAVD88', 'alt_units': 1,
+        'horz_datum': 'NAD83', 'nat_aquifer_cd': 'N100', 'country_cd': 'US', 'state_cd': '55',
+        'county_cd': '025', 'agency_nm': 'U.S. Geological Survey', 'agency_med': 'USGS',
+        'site_no': '430406089232901', 'site_name': 'DN-08/09E/20-0001', 'dec_lat_va': 43.06833333,
+        'dec_long_va': -89.39166667, 'alt_va': Decimal('860.000000'), 'nat_aqfr_desc': 'Cambrian-Ordovician',
+        'local_aquifer_name': 'Mount Simon', 'qw_sn_flag': False, 'qw_baseline_flag': False,
+        'qw_well_chars': '', 'qw_well_purpose': '', 'wl_sn_flag': True, 'wl_baseline_flag': 1,
+        'wl_well_chars': '1', 'wl_well_purpose': 'Dedicated', 'data_provider': 'USGS', 'qw_sys_name': '',
+        'wl_sys_name': 'NWIS', 'pk_siteid': 'USGS:430406089232901', 'display_flag': True,
+        'wl_data_provider': 'NWIS', 'qw_data_provider': '', 'lith_data_provider': '',
+        'const_data_provider': '', 'well_depth': Decimal('150.00000000'), 'link': '',
+        'wl_well_purpose_notes': '', 'qw_well_purpose_notes': '', 'insert_user_id': 'test',
+        'update_user_id': 'test', 'wl_well_type': '2', 'qw_well_type': '', 'local_aquifer_cd': '',
+        'review_flag': '', 'site_type': 'WELL', 'aqfr_char': 'UNCONFINED', 'horz_method': '',
+        'horz_acy': '', 'alt_method': '', 'alt_acy': '', 'insert_date': now, 'update_date': now,
+    }
+    values.update(kwargs)
+    return Registry(**values)
+
+
 class TestBasePage(TestCase):
 
     def setUp(self):
@@ -64,3 +118,682 @@ class TestRegistryAdmin(TestCase):
         # ASSERTION
         self.assertEqual(check_html, '&check;')
         self.assertEqual(blank_html, '')
+
+
+class TestCompactRowLayout(TestCase):
+
+    def test_coordinate_precision(self):
+        # SETUP
+        latitudes = ['45.12345678', '-89.99999999', '0.00000001', '19.87654321']
+        longitudes = ['-179.99999999', '179.12345678', '-0.00000001', '-155.55555555']
+        for lat, lng in zip(latitudes, longitudes):
+            make_registry(site_no=lat, dec_lat_va=float(lat), dec_long_va=float(lng)).save()
+
+        # TEST ACTION
+        stored = {entry.site_no: entry for entry in Registry.objects.all()}
+
+        # ASSERTIONS
+        for lat, lng in zip(latitudes, longitudes):
+            entry = stored[lat]
+            self.assertEqual(Decimal(f"{entry.dec_lat_va:.{COORDINATE_PLACES}f}"), Decimal(lat))
+            self.assertEqual(Decimal(f"{entry.dec_long_va:.{COORDINATE_PLACES}f}"), Decimal(lng))
+
+    def test_flags_are_booleans(self):
+        make_registry(display_flag=True, qw_sn_flag=False).save()
+
+        entry = Registry.objects.get()
+
+        self.assertIs(entry.display_flag, True)
+        self.assertIs(entry.qw_sn_flag, False)
+        self.assertEqual(check_mark(entry.display_flag), '&check;')
+        self.assertIn('display:1 qw:0', str(entry))
+
+    def test_type_change_sql(self):
+        migration = importlib.import_module('registry.migrations.0004_compact_row_layout')
+
+        forward, reverse = migration.alter_table_sql(), migration.reverse_alter_table_sql()
+
+        self.assertTrue(forward.startswith("SET LOCAL lock_timeout = '10s';"))
+        self.assertEqual(forward.count('ALTER TABLE'), 1)
+        self.assertIn(f"ALTER TABLE {settings.ENVIRONMENT['APP_SCHEMA_NAME']}.registry_registry", forward)
+        # the reverse checks the coordinates before it rounds them
+        self.assertLess(reverse.index('RAISE EXCEPTION'), reverse.index('TYPE numeric(11,8)'))
+
+    def test_compact_column_order(self):
+        # TEST ACTION
+        columns = [field.column for field in compact_column_order(Registry._meta.concrete_fields)]
+
+        # ASSERTIONS
+        self.assertLess(columns.index('dec_lat_va'), columns.index('id'))
+        self.assertLess(columns.index('id'), columns.index('alt_units'))
+        self.assertLess(columns.index('alt_units'), columns.index('display_flag'))
+        self.assertLess(columns.index('display_flag'), columns.index('agency_cd'))
+        self.assertEqual(columns[-2:], ['wl_well_purpose_notes', 'qw_well_purpose_notes'])
+
+
+def source_row(entry):
+    """The text row a provider file would have for a registry entry."""
+    row = {}
+    for field in hashed_fields(Registry):
+        value = getattr(entry, field.attname)
+        row[field.name] = str(int(value)) if isinstance(value, bool) else str(value)
+    return row
+
+
+class TestContentHash(TestCase):
+
+    def test_saved_hash_matches_source_row(self):
+        # SETUP
+        entry = make_registry()
+        entry.save()
+        row = source_row(entry)
+        row['alt_va'] = '860'
+        row['qw_sn_flag'] = ''
+
+        # TEST ACTION
+        stored = Registry.objects.get()
+        reloaded = Registry(**registry_values(row))
+
+        # ASSERTIONS
+        self.assertEqual(len(stored.content_hash), 32)
+        self.assertEqual(stored.content_hash, reloaded.compute_content_hash())
+
+    def test_hash_ignores_bookkeeping(self):
+        entry = make_registry()
+        before = entry.compute_content_hash()
+
+        entry.update_user_id = 'someone else'
+        entry.update_date = timezone.now()
+        unchanged = entry.compute_content_hash()
+        entry.site_name = 'renamed'
+
+        self.assertEqual(before, unchanged)
+        self.assertNotEqual(before, entry.compute_content_hash())
+
+
+class TestReconcile(TestCase):
+
+    def setUp(self):
+        self.entries = [make_registry(site_no=f"00{index}") for index in range(4)]
+        for entry in self.entries:
+            entry.save()
+        make_registry(agency_cd='OTHER', site_no='001').save()
+
+    def test_only_differences_are_written(self):
+        # SETUP
+        rows = [source_row(entry) for entry in self.entries[:3]]
+        rows[1]['site_name'] = 'changed name'
+        new_row = source_row(make_registry(site_no='999'))
+        original_dates = dict(Registry.objects.values_list('site_no', 'update_date'))
+
+        # TEST ACTION
+        summary = Reconciler(user='tester').run(rows + [new_row])
+
+        # ASSERTIONS
+        self.assertEqual((summary.read, summary.inserted, summary.updated, summary.deleted, summary.unchanged),
+                         (4, 1, 1, 1, 2))
+        self.assertEqual(summary.written, 3)
+        self.assertEqual(Registry.objects.get(site_no='001', agency_cd='USGS').site_name, 'changed name')
+        self.assertFalse(Registry.objects.filter(agency_cd='USGS', site_no='003').exists())
+        self.assertTrue(Registry.objects.filter(agency_cd='OTHER').exists())
+        self.assertEqual(Registry.objects.get(agency_cd='USGS', site_no='000').update_date, original_dates['000'])
+        inserted = Registry.objects.get(site_no='999')
+        self.assertEqual(inserted.insert_user_id, 'tester')
+        self.assertEqual(inserted.content_hash, inserted.compute_content_hash())
+
+    def test_moved_wells_lose_normalized_values(self):
+        for returning in (True, False):
+            with self.subTest(returning=returning), \
+                    mock.patch('registry.models.can_return_updated', return_value=returning):
+                # SETUP
+                Registry.objects.update(norm_lat_va=43.0, norm_long_va=-89.0, norm_alt_va=100.0)
+                rows = [source_row(entry) for entry in Registry.objects.filter(agency_cd='USGS').order_by('site_no')]
+                rows[0]['site_name'] = f"renamed {returning}"
+                rows[1]['dec_lat_va'] = 44.5 if returning else 44.25
+                rows[2]['alt_units'] = 2 if returning else 1
+
+                # TEST ACTION
+                summary = Reconciler(user='tester').run(rows)
+
+                # ASSERTIONS
+                self.assertEqual(summary.updated, 3)
+                normalized = {site_no: values for site_no, *values in Registry.objects.filter(
+                    agency_cd='USGS').values_list('site_no', 'norm_lat_va', 'norm_long_va', 'norm_alt_va')}
+                self.assertEqual(normalized, {'000': [43.0, -89.0, 100.0], '001': [None, None, None],
+                                              '002': [43.0, -89.0, None], '003': [43.0, -89.0, 100.0]})
+
+    def test_dry_run_command(self):
+        # SETUP
+        rows = [source_row(entry) for entry in self.entries]
+        rows[0]['link'] = 'https://example.com'
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', newline='', delete=False) as source:
+            writer = csv.DictWriter(source, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        self.addCleanup(os.remove, source.name)
+        out = StringIO()
+
+        # TEST ACTION
+        call_command('reconcile_registry', source.name, '--dry-run', stdout=out)
+
+        # ASSERTIONS
+        self.assertIn('dry run: read 4, inserted 0, updated 1, deleted 0, unchanged 3', out.getvalue())
+        self.assertEqual(Registry.objects.get(agency_cd='USGS', site_no='000').link, '')
+
+
+class TestBatchValidator(TestCase):
+
+    def setUp(self):
+        self.lookups = {'agency_cd': frozenset(['USGS']), ('state_cd', 'county_cd'): frozenset([('55', '025')])}
+
+    def test_valid_rows(self):
+        rows = [source_row(make_registry(site_no=str(index))) for index in range(3)]
+
+        report = BatchValidator(lookups=self.lookups).validate(rows)
+
+        self.assertTrue(report.is_valid)
+        self.assertEqual(report.rows, 3)
+
+    def test_column_errors(self):
+        # SETUP
+        rows = [source_row(make_registry(site_no=str(index))) for index in range(7)]
+        rows[0]['display_flag'] = '7'
+        rows[1]['dec_lat_va'] = '91.5'
+        rows[2]['dec_long_va'] = '-89.123456789'
+        rows[3]['site_name'] = 'x' * 301
+        rows[4]['county_cd'] = '999'
+        rows[5]['well_depth_units'] = ''
+        rows[6]['wl_baseline_flag'] = '999'
+
+        # TEST ACTION
+        report = BatchValidator(lookups=self.lookups, chunk_size=3).validate(rows)
+
+        # ASSERTIONS
+        self.assertEqual(report.invalid_rows, list(range(7)))
+        self.assertIn('display_flag', report.errors[0])
+        self.assertEqual(report.errors[1]['dec_lat_va'], ['Ensure this value is between -90 and 90.'])
+        self.assertIn('decimal places', report.errors[2]['dec_long_va'][0])
+        self.assertIn('at most 300 characters', report.errors[3]['site_name'][0])
+        self.assertEqual(report.errors[4]['county_cd'], ["'55:999' is not a known state_cd county_cd."])
+        self.assertEqual(report.errors[5]['well_depth_units'], ['This field is required.'])
+        self.assertIn('wl_baseline_flag', report.errors[6])
+
+    def test_unknown_integer_code(self):
+        rows = [source_row(make_registry(site_no=str(index))) for index in range(2)]
+        rows[1]['alt_units'] = '7'
+
+        report = BatchValidator(lookups={**self.lookups, 'alt_units': frozenset([1, 2])}).validate(rows)
+
+        self.assertEqual(report.invalid_rows, [1])
+        self.assertEqual(report.errors[1]['alt_units'], ["'7' is not a known alt_units."])
+
+    def test_duplicates(self):
+        # SETUP
+        make_registry(site_no='stored').save()
+        rows = [source_row(make_registry(site_no=site_no)) for site_no in ('new', 'new', 'stored')]
+
+        # TEST ACTION
+        report = BatchValidator(lookups={}).validate(rows)
+        without_existing = BatchValidator(lookups={}, check_existing=False).validate(rows)
+
+        # ASSERTIONS
+        self.assertEqual(report.invalid_rows, [1, 2])
+        self.assertEqual(report.as_dict()['errors'][0], {'row': 1, 'fields': {
+            'site_no': ['Duplicate of row 0 for USGS:new.']}})
+        self.assertEqual(report.errors[2]['site_no'], ['USGS:stored is already in the registry.'])
+        self.assertEqual(without_existing.invalid_rows, [1])
+
+    def test_existing_row_is_not_its_own_duplicate(self):
+        make_registry().save()
+
+        report = BatchValidator(lookups={}).validate(Registry.objects.values())
+
+        self.assertTrue(report.is_valid)
+
+    def test_reconcile_skips_invalid_rows(self):
+        make_registry(site_no='kept').save()
+        rows = [source_row(make_registry(site_no='kept')), source_row(make_registry(site_no='new'))]
+        rows[0]['dec_lat_va'] = '100'
+
+        reconciler = Reconciler()
+        summary = reconciler.run(rows)
+
+        self.assertEqual((summary.invalid, summary.inserted, summary.deleted), (1, 1, 0))
+        self.assertEqual(reconciler.report.invalid_rows, [0])
+
+    def test_admin_action(self):
+        # SETUP
+        make_registry(site_no='good').save()
+        make_registry(site_no='bad', agency_cd='NOPE').save()
+        reg = RegistryAdmin(model=Registry, admin_site=None)
+        reg.using = 'default'
+
+        # TEST ACTION
+        with mock.patch('registry.validation.load_lookups', return_value=self.lookups), \
+                mock.patch.object(reg, 'message_user') as message_user:
+            reg.validate_wells(None, Registry.objects.all())
+
+        # ASSERTIONS
+        self.assertEqual(message_user.call_count, 2)
+        self.assertEqual(message_user.call_args_list[0][0][1], '2 rows validated, 1 invalid.')
+        self.assertIn('NOPE:bad agency_cd', message_user.call_args_list[1][0][1])
+
+
+class TestDuplicateWells(TestCase):
+
+    def setUp(self):
+        # two pairs about 30 meters apart, the second pair straddles a cell boundary, and a far well
+        self.wells = [
+            Well(1, 43.0, -89.4, 'DN-08/09E/20-0001', 150),
+            Well(2, 43.00027, -89.4, 'DN 08 09E 20 0001', 152),
+            Well(3, 44.00017, -90.0, 'Smith Farm Well', None),
+            Well(4, 44.00019, -90.0003, 'SMITH FARM WELL', 80),
+            Well(5, 45.0, -91.0, 'DN-08/09E/20-0001', 150),
+        ]
+
+    def test_haversine(self):
+        self.assertAlmostEqual(haversine(43.0, -89.4, 43.00027, -89.4), 30.0, delta=0.1)
+
+    def test_neighbouring_cells(self):
+        cells = block(self.wells[2:4], 100)
+        self.assertEqual(len(cells), 2)
+
+        candidates = find_candidates(self.wells, 100, 0.5)
+
+        self.assertEqual(sorted(candidate[:2] for candidate in candidates), [(1, 2), (3, 4)])
+        first = next(candidate for candidate in candidates if candidate[0] == 1)
+        self.assertEqual(first[4], 2.0)
+        self.assertGreater(first[5], 0.8)
+
+    def test_zero_depth(self):
+        candidates = find_candidates([Well(1, 43.0, -89.4, 'Well 1', 0), Well(2, 43.0001, -89.4, 'Well 1', 0)],
+                                     100, 0.5)
+
+        self.assertEqual(Well(3, 43.0, -89.4, '', Decimal('0')).depth, 0.0)
+        self.assertEqual([candidate[4] for candidate in candidates], [0.0])
+
+    def test_antimeridian(self):
+        # SETUP
+        wells = [Well(1, 10.0, 179.9999, 'Island Well', 20), Well(2, 10.0, -179.9999, 'Island Well', 20),
+                 Well(3, 10.0, 180.0, 'Island Well', 20)]
+
+        # TEST ACTION
+        candidates = find_candidates(wells, 100, 0.5)
+
+        # ASSERTIONS
+        self.assertAlmostEqual(haversine(10.0, 179.9999, 10.0, -179.9999), 21.9, delta=0.1)
+        self.assertEqual(sorted(candidate[:2] for candidate in candidates), [(1, 2), (1, 3), (2, 3)])
+
+    def test_invalid_distance(self):
+        with self.assertRaisesMessage(ValueError, 'max_distance must be positive'):
+            find_candidates(self.wells, 0, 0.5)
+        with self.assertRaisesMessage(CommandError, '--distance must be positive'):
+            call_command('find_duplicate_wells', '--distance=-1', stdout=StringIO())
+
+    def test_process_pool(self):
+        single = find_candidates(self.wells, 100, 0.5, processes=1)
+        pooled = find_candidates(self.wells, 100, 0.5, processes=2, cells_per_task=1)
+        self.assertEqual(sorted(single), sorted(pooled))
+
+    def test_command_keeps_reviewed(self):
+        # SETUP
+        entries = [make_registry(site_no=str(well.pk), dec_lat_va=well.lat, dec_long_va=well.lng,
+                                 site_name=well.name, well_depth=Decimal(well.depth or 0)) for well in self.wells]
+        for entry in entries:
+            entry.save()
+        call_command('find_duplicate_wells', '--processes=1', stdout=StringIO())
+        reviewed = DuplicateCandidate.objects.get(well=entries[0])
+        reviewed.status = DuplicateCandidate.DISTINCT
+        reviewed.save()
+
+        # TEST ACTION
+        out = StringIO()
+        call_command('find_duplicate_wells', '--processes=1', stdout=out)
+
+        # ASSERTIONS
+        self.assertIn('5 wells, 2 candidates, 1 stored for review', out.getvalue())
+        self.assertEqual(DuplicateCandidate.objects.count(), 2)
+        self.assertEqual(DuplicateCandidate.objects.get(well=entries[0]).status, DuplicateCandidate.DISTINCT)
+        self.assertEqual(DuplicateCandidate.objects.get(status=DuplicateCandidate.NEW).other_well, entries[3])
+
+
+def square(west, south, east, north):
+    """A closed GeoJSON ring."""
+    return [[west, south], [east, south], [east, north], [west, north], [west, south]]
+
+
+class TestStateCounty(TestCase):
+
+    def setUp(self):
+        collection = {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': {'STATEFP': '55', 'COUNTYFP': '025'},
+             'geometry': {'type': 'Polygon', 'coordinates': [square(-90, 43, -89, 44),
+                                                             square(-89.6, 43.4, -89.4, 43.6)]}},
+            {'type': 'Feature', 'properties': {'STATEFP': '55', 'COUNTYFP': '027'},
+             'geometry': {'type': 'MultiPolygon', 'coordinates': [[square(-89, 43, -88, 44)],
+                                                                  [square(-87.5, 43, -87.4, 43.1)]]}},
+        ]}
+        with tempfile.NamedTemporaryFile('w', suffix='.geojson', delete=False) as geojson:
+            json.dump(collection, geojson)
+        self.addCleanup(os.remove, geojson.name)
+        self.path = geojson.name
+
+    def test_locate(self):
+        index = BoundaryIndex.from_geojson(self.path, grid_degrees=0.25)
+
+        self.assertEqual(index.locate(43.1, -89.9), ('55', '025'))
+        self.assertEqual(index.locate(43.5, -88.5), ('55', '027'))
+        self.assertEqual(index.locate(43.05, -87.45), ('55', '027'))
+        self.assertIsNone(index.locate(43.5, -89.5))
+        self.assertIsNone(index.locate(45.0, -89.5))
+
+    def test_verify_and_assign(self):
+        # SETUP
+        wells = {'right': (43.1, -89.9), 'wrong': (43.5, -88.5), 'hole': (43.5, -89.5), 'far': (45.0, -89.5)}
+        for site_no, (lat, lng) in wells.items():
+            make_registry(site_no=site_no, dec_lat_va=lat, dec_long_va=lng, state_cd='55', county_cd='025').save()
+
+        # TEST ACTION
+        verify = StringIO()
+        call_command('derive_state_county', self.path, '--processes=2', '--chunk-size=1', stdout=verify)
+        unchanged = Registry.objects.get(site_no='wrong').county_cd
+        assign = StringIO()
+        call_command('derive_state_county', self.path, '--assign', '--processes=1', stdout=assign)
+
+        # ASSERTIONS
+        self.assertIn('4 wells located', verify.getvalue())
+        self.assertIn('1 differ, 2 outside every boundary', verify.getvalue())
+        self.assertIn('55:025 located in 55:027', verify.getvalue())
+        self.assertEqual(unchanged, '025')
+        self.assertIn('1 wells updated', assign.getvalue())
+        wrong = Registry.objects.get(site_no='wrong')
+        self.assertEqual(wrong.county_cd, '027')
+        self.assertEqual(wrong.content_hash, wrong.compute_content_hash())
+        self.assertEqual(Registry.objects.get(site_no='hole').county_cd, '025')
+
+
+class TestStartupMigrate(TestCase):
+
+    def test_fingerprint(self):
+        # SETUP
+        with tempfile.TemporaryDirectory() as path:
+            with open(os.path.join(path, '0001_initial.py'), 'w') as migration:
+                migration.write('operations = []')
+            with open(os.path.join(path, 'notes.txt'), 'w') as notes:
+                notes.write('not a migration')
+
+            # TEST ACTION
+            first = fingerprint([path])
+            same = fingerprint([path])
+            with open(os.path.join(path, '0002_next.py'), 'w') as migration:
+                migration.write('operations = []')
+            changed = fingerprint([path])
+
+        # ASSERTIONS
+        self.assertEqual(first, same)
+        self.assertNotEqual(first, changed)
+        self.assertEqual(len(bundled_fingerprint()), 64)
+
+    def test_up_to_date_skips_migrations(self):
+        MigrationFingerprint.objects.create(fingerprint=bundled_fingerprint(), applied_date=timezone.now())
+        out = StringIO()
+
+        with mock.patch('registry.management.commands.startup_migrate.call_command') as migrate:
+            call_command('startup_migrate', stdout=out)
+
+        self.assertIn('migrations up to date', out.getvalue())
+        migrate.assert_not_called()
+
+
+    def test_changed_fingerprint_on_migrated_database(self):
+        # SETUP
+        MigrationFingerprint.objects.create(fingerprint='previous', applied_date=timezone.now())
+        lock = mock.MagicMock()
+        databases = {'postgres': lock, 'default': connection}
+        out = StringIO()
+
+        # TEST ACTION
+        with mock.patch('registry.management.commands.startup_migrate.connections', databases), \
+                mock.patch.object(connection, 'close'), \
+                mock.patch('registry.management.commands.startup_migrate.call_command') as migrate:
+            call_command('startup_migrate', stdout=out)
+
+        # ASSERTIONS
+        # the applied 0000 step is not migrated back to, which would unapply the later migrations
+        self.assertEqual([step.args for step in migrate.call_args_list],
+                         [('migrate', 'postgres'), ('migrate', 'registry')])
+        self.assertIn('migrations applied', out.getvalue())
+        self.assertEqual(MigrationFingerprint.objects.latest('applied_date').fingerprint, bundled_fingerprint())
+
+class TestSessions(TestCase):
+    databases = {'default', 'default_replica'}
+
+    def test_queries_per_mode(self):
+        # SETUP
+        get_user_model().objects.create_superuser('admin', 'admin@example.com', 'secret')
+        out = StringIO()
+
+        # TEST ACTION
+        call_command('benchmark_sessions', 'admin', requests=3, stdout=out)
+
+        # ASSERTIONS
+        queries = {line.split()[0]: float(line.split()[2]) for line in out.getvalue().splitlines()}
+        self.assertEqual(set(queries), {'db', 'cached_db', 'signed_cookies'})
+        self.assertEqual(queries['cached_db'], queries['db'] - 1)
+        self.assertEqual(queries['signed_cookies'], queries['cached_db'])
+
+    def test_clear_expired_sessions(self):
+        # SETUP
+        for expiry in (-60, -60, -60, 3600):
+            session = SessionStore()
+            session.set_expiry(expiry)
+            session.create()
+        out = StringIO()
+
+        # TEST ACTION
+        call_command('clear_expired_sessions', batch_size=2, stdout=out)
+
+        # ASSERTIONS
+        self.assertIn('deleted 3 expired sessions', out.getvalue())
+        self.assertEqual(Session.objects.count(), 1)
+
+
+def form_data(entry):
+    """The data a registry change form posts when saved unchanged."""
+    form = RegistryForm(instance=entry)
+    data = {}
+    for name, field in form.fields.items():
+        data[name] = data_value(field, form[name].value())
+        if field.show_hidden_initial:
+            data[form.add_initial_prefix(name)] = data[name]
+    return data
+
+
+class TestVersionConflict(TestCase):
+
+    def setUp(self):
+        # the form requires every character field
+        entry = make_registry()
+        for field in hashed_fields(Registry):
+            if getattr(entry, field.attname) == '':
+                setattr(entry, field.attname, '-')
+        entry.save()
+        self.entry = Registry.objects.get()
+
+    def test_save_bumps_version(self):
+        stale = Registry.objects.get()
+
+        self.entry.site_name = 'first'
+        self.entry.save()
+        stale.site_name = 'second'
+
+        self.assertEqual(self.entry.version, 2)
+        with self.assertRaises(VersionConflict):
+            stale.save()
+        self.assertEqual(Registry.objects.get().site_name, 'first')
+
+    def test_versioned_update(self):
+        # SETUP
+        make_registry(site_no='other').save()
+        entries = list(Registry.objects.order_by('id'))
+        Registry.objects.get(site_no='other').save()
+        for entry in entries:
+            entry.link = 'https://example.com'
+            entry.content_hash = entry.compute_content_hash()
+
+        # TEST ACTION
+        conflicts = versioned_update(Registry.objects.all(), entries, ['link', 'content_hash'])
+
+        # ASSERTIONS
+        self.assertEqual([entry.site_no for entry in conflicts], ['other'])
+        self.assertEqual(dict(Registry.objects.values_list('site_no', 'link')),
+                         {self.entry.site_no: 'https://example.com', 'other': ''})
+        self.assertEqual(Registry.objects.get(pk=self.entry.pk).version, entries[0].version)
+
+    def test_stale_versioned_update_of_unchanged_content(self):
+        # SETUP
+        stale = Registry.objects.get()
+        Registry.objects.filter(pk=self.entry.pk).update(norm_lat_va=1.0, version=F('version') + 1)
+        stale.norm_lat_va = 42.0
+
+        # TEST ACTION
+        conflicts = versioned_update(Registry.objects.all(), [stale], ['norm_lat_va', 'content_hash'])
+
+        # ASSERTIONS
+        self.assertEqual(conflicts, [stale])
+        self.assertEqual(Registry.objects.get().norm_lat_va, 1.0)
+
+    def test_versioned_update_without_returning(self):
+        stale, current = Registry.objects.get(), Registry.objects.get()
+        current.save()
+        stale.link = current.link = 'https://example.com'
+
+        with mock.patch('registry.models.can_return_updated', return_value=False):
+            conflicts = versioned_update(Registry.objects.all(), [stale], ['link'])
+            written = versioned_update(Registry.objects.all(), [current], ['link'])
+
+        self.assertEqual((conflicts, written), ([stale], []))
+        self.assertEqual(Registry.objects.get().version, 3)
+
+    def test_refresh_content_hashes_bumps_version(self):
+        Registry.objects.update(site_name='renamed')
+
+        refresh_content_hashes(Registry.objects.all())
+
+        stored = Registry.objects.get()
+        self.assertEqual((stored.version, stored.content_hash), (2, stored.compute_content_hash()))
+
+    def test_admin_gives_up_after_conflicts(self):
+        # SETUP
+        request = RequestFactory().post('/')
+        registry_admin = RegistryAdmin(Registry, AdminSite())
+
+        # TEST ACTION
+        with mock.patch('django.contrib.admin.ModelAdmin.changeform_view',
+                        side_effect=VersionConflict(self.entry)) as changeform_view, \
+                mock.patch.object(registry_admin, 'message_user') as message_user:
+            response = registry_admin.changeform_view(request, str(self.entry.pk))
+
+        # ASSERTIONS
+        self.assertEqual(changeform_view.call_count, RegistryAdmin.max_conflict_retries)
+        self.assertEqual(response.status_code, 302)
+        message_user.assert_called_once()
+
+    def test_merge_other_changes(self):
+        # SETUP
+        data = form_data(self.entry)
+        data['site_name'] = 'mine'
+        Registry.objects.filter(pk=self.entry.pk).update(link='https://example.com', version=2)
+
+        # TEST ACTION
+        form = RegistryForm(data, instance=Registry.objects.get())
+        saved = form.is_valid() and form.save()
+
+        # ASSERTIONS
+        self.assertTrue(saved, form.errors)
+        stored = Registry.objects.get()
+        self.assertEqual((stored.site_name, stored.link, stored.version), ('mine', 'https://example.com', 3))
+
+    def test_conflicting_changes(self):
+        # SETUP
+        data = form_data(self.entry)
+        data['site_name'] = 'mine'
+        data['link'] = 'mine.example.com'
+        Registry.objects.filter(pk=self.entry.pk).update(site_name='theirs', wl_sn_flag=False, version=2)
+
+        # TEST ACTION
+        form = RegistryForm(data, instance=Registry.objects.get())
+        valid = form.is_valid()
+        resubmitted = RegistryForm(form.data, instance=Registry.objects.get())
+
+        # ASSERTIONS
+        self.assertFalse(valid)
+        self.assertEqual(list(form.errors), ['site_name', '__all__'])
+        self.assertIn('theirs', form.errors['site_name'][0])
+        self.assertEqual((form.data['version'], form.data['wl_sn_flag']), ('2', ''))
+        self.assertTrue(resubmitted.is_valid(), resubmitted.errors)
+        resubmitted.save()
+        stored = Registry.objects.get()
+        self.assertEqual((stored.site_name, stored.link, stored.wl_sn_flag), ('mine', 'mine.example.com', False))
+
+
+class TestQueryPlans(TestCase):
+
+    plan = [{'Plan': {
+        'Node Type': 'Limit', 'Actual Rows': 1, 'Shared Hit Blocks': 6, 'Shared Read Blocks': 2, 'Plans': [
+            {'Node Type': 'Bitmap Heap Scan', 'Relation Name': 'registry_registry', 'Plans': [
+                {'Node Type': 'Bitmap Index Scan', 'Index Name': 'registry_site_hash_idx'}]}]}}]
+
+    def test_plan_summary(self):
+        summary = plan_summary(self.plan)
+
+        self.assertEqual(summary['buffers'], 8)
+        self.assertEqual(summary['rows'], 1)
+        self.assertEqual([(scan['node'], scan['relation'], scan['index']) for scan in summary['scans']], [
+            ('Bitmap Heap Scan', 'registry_registry', None),
+            ('Bitmap Index Scan', None, 'registry_site_hash_idx')])
+
+    def test_regressions(self):
+        # SETUP
+        baseline = plan_summary(self.plan)
+        seq_scan = {'scans': [{'node': 'Seq Scan', 'relation': 'registry_registry', 'index': None}],
+                    'buffers': 900, 'rows': 1}
+
+        # ASSERTIONS
+        self.assertEqual(regressions(baseline, dict(baseline, buffers=14)), [])
+        self.assertEqual(regressions(baseline, seq_scan),
+                         ['sequential scan of registry_registry', 'buffers grew from 8 to 900'])
+        self.assertIn('+      "node": "Seq Scan"', summary_diff('site_lookup', baseline, seq_scan))
+        self.assertEqual(regressions(None, baseline), ['no baseline, record it with --update'])
+
+    def test_catalog_queries(self):
+        seed_registry(20, 'default', batch_size=8)
+        well = sample_well('default')
+
+        self.assertEqual(Registry.objects.count(), 20)
+        for name, query in CATALOG.items():
+            with self.subTest(name):
+                self.assertIsInstance(list(query(well)), list)
+        self.assertIn(well, CATALOG['site_lookup'](well))
+
+    def test_missing_baselines(self):
+        # SETUP
+        summaries = {'site_lookup': plan_summary(self.plan), 'exports': plan_summary(self.plan)}
+        options = {'baseline': '/nonexistent/query_plans.json', 'seed_rows': 0, 'tolerance': 0.2}
+        out = StringIO()
+        command = CheckQueryPlans(stdout=out)
+
+        # TEST ACTION
+        command.compare(summaries, load_baselines(options['baseline']), options)
+        with self.assertRaisesMessage(CommandError, '1 query plan regressions or missing baselines: exports'):
+            command.compare(summaries, {'seed_rows': 0, 'plans': {'site_lookup': summaries['site_lookup']}},
+                            options)
+
+        # ASSERTIONS
+        self.assertIn('no baseline file /nonexistent/query_plans.json, the plans are not checked', out.getvalue())
+        self.assertIn('site_lookup: Bitmap Heap Scan registry_registry', out.getvalue())
+        self.assertIn('site_lookup: ok', out.getvalue())
+
+    def test_requires_postgres(self):
+        with self.assertRaisesMessage(CommandError, 'requires a postgres database'):
+            call_command('check_query_plans', stdout=StringIO())
@@ -3,10 +3,11 @@ Register Django URL route names.
 """
 from django.urls import path
 
-from .views import BasePage, status_check
+from .views import BasePage, registry_snapshot, status_check
 
 
 urlpatterns = [
     path('', BasePage.as_view(), name='base'),
-    path('status', status_check, name='status')
+    path('status', status_check, name='status'),
+    path('snapshot.parquet', registry_snapshot, name='snapshot'),
 ]
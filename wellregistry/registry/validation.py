@@ -0,0 +1,225 @@
+"""
+Batch validation of registry rows.
+
+Model full_clean validates one instance at a time. Here rows are validated in chunks, each column
+of a chunk at once, and the (agency_cd, site_no) duplicates are found within the chunk and against
+the database with one query per chunk. The result is a report of the errors by row and field.
+
+The same validator is used by the loaders, the admin and any API view.
+"""
+import json
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxLengthValidator
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import COORDINATE_PLACES, Registry, hashed_fields
+
+CHUNK_SIZE = 5000
+
+# the coordinate columns and their allowed range
+COORDINATE_RANGES = {
+    'dec_lat_va': (-90, 90),
+    'dec_long_va': (-180, 180),
+}
+
+# the natural key of a registry well
+KEY_FIELDS = ('agency_cd', 'site_no')
+
+
+@lru_cache(maxsize=None)
+def load_lookups():
+    """
+    The lookup codes from the REGISTRY_LOOKUPS_FILE json, cached for the life of the process.
+
+    The file maps a field name, or comma separated field names, to the list of valid codes.
+    {"agency_cd": ["USGS"], "state_cd": ["55"], "state_cd,county_cd": [["55", "025"]]}
+    """
+    path = getattr(settings, 'REGISTRY_LOOKUPS_FILE', None)
+    if not path:
+        return {}
+    with open(path, encoding='utf-8') as lookup_file:
+        raw = json.load(lookup_file)
+    lookups = {}
+    for key, codes in raw.items():
+        names = tuple(key.split(','))
+        if len(names) == 1:
+            lookups[names[0]] = frozenset(codes)
+        else:
+            lookups[names] = frozenset(tuple(code) for code in codes)
+    return lookups
+
+
+class ValidationReport:
+    """
+    The errors of a batch by row index and field name.
+
+    """
+    def __init__(self):
+        """An empty report."""
+        self.rows = 0
+        self.errors = defaultdict(lambda: defaultdict(list))
+
+    def add(self, index, field, message):
+        """Record one error for a row and field."""
+        self.errors[index][field].append(message)
+
+    @property
+    def is_valid(self):
+        """True when no row has an error."""
+        return not self.errors
+
+    @property
+    def invalid_rows(self):
+        """The sorted indexes of the rows with errors."""
+        return sorted(self.errors)
+
+    def as_dict(self):
+        """A json friendly form of the report."""
+        return {
+            'rows': self.rows,
+            'invalid': len(self.errors),
+            'errors': [{'row': index, 'fields': {field: list(messages) for field, messages in fields.items()}}
+                       for index, fields in sorted(self.errors.items())],
+        }
+
+    def __str__(self):
+        """A one line summary."""
+        return f"{self.rows} rows validated, {len(self.errors)} invalid"
+
+
+class BatchValidator:
+    """
+    Validate registry rows in column chunks.
+
+    Rows are dicts by field name of text, as read from a provider file, or of python values.
+    A row with an 'id' is an existing registry entry and is not a duplicate of itself.
+
+    """
+    def __init__(self, lookups=None, using=DEFAULT_DB_ALIAS, check_existing=True, chunk_size=CHUNK_SIZE):
+        """
+        Options for validation.
+
+        lookups defaults to load_lookups(), a field or tuple of fields mapped to the valid codes.
+        check_existing reports keys already in the database, loaders that update rows turn it off.
+        """
+        self.lookups = load_lookups() if lookups is None else lookups
+        self.using = using
+        self.check_existing = check_existing
+        self.chunk_size = chunk_size
+        self.fields = hashed_fields(Registry)
+
+    def validate(self, rows):
+        """Validate all the rows and return the report."""
+        report = ValidationReport()
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == self.chunk_size:
+                self.validate_chunk(chunk, report.rows, report)
+                chunk = []
+        if chunk:
+            self.validate_chunk(chunk, report.rows, report)
+        return report
+
+    def validate_chunk(self, rows, offset, report):
+        """Validate one chunk, the row indexes in the report start at offset."""
+        report.rows += len(rows)
+        columns = {}
+        for field in self.fields:
+            raw = [row.get(field.name) for row in rows]
+            columns[field.name] = self.check_column(field, raw, offset, report)
+            if field.name in COORDINATE_RANGES:
+                self.check_coordinates(field.name, raw, columns[field.name], offset, report)
+        self.check_lookups(columns, offset, report)
+        self.check_duplicates(rows, columns, offset, report)
+
+    @staticmethod
+    def check_column(field, raw, offset, report):
+        """Convert a column to python values, checking types, blanks, max length and field validators."""
+        is_char = field.get_internal_type() == 'CharField'
+        # the max length is checked directly, it is the common case
+        validators = [validator for validator in field.validators if not isinstance(validator, MaxLengthValidator)]
+        values = []
+        for index, value in enumerate(raw, offset):
+            if isinstance(value, str) and not is_char:
+                value = value.strip()
+            if value in (None, ''):
+                if is_char:
+                    value = ''
+                elif field.has_default():
+                    value = field.get_default()
+                else:
+                    report.add(index, field.name, 'This field is required.')
+                    values.append(None)
+                    continue
+            try:
+                value = field.to_python(value)
+            except ValidationError as error:
+                report.add(index, field.name, ' '.join(error.messages))
+                values.append(None)
+                continue
+
+            if is_char and len(value) > field.max_length:
+                report.add(index, field.name, f"Ensure this value has at most {field.max_length} characters.")
+            for validator in validators:
+                try:
+                    validator(value)
+                except ValidationError as error:
+                    report.add(index, field.name, ' '.join(error.messages))
+            values.append(value)
+        return values
+
+    @staticmethod
+    def check_coordinates(name, raw, values, offset, report):
+        """Check the coordinate range and that the source has no more decimal places than are stored."""
+        low, high = COORDINATE_RANGES[name]
+        for index, (text, value) in enumerate(zip(raw, values), offset):
+            if value is None:
+                continue
+            if not low <= value <= high:
+                report.add(index, name, f"Ensure this value is between {low} and {high}.")
+            if isinstance(text, str):
+                try:
+                    exponent = Decimal(text.strip()).as_tuple().exponent
+                except InvalidOperation:
+                    continue
+                if exponent < -COORDINATE_PLACES:
+                    report.add(index, name, f"Ensure that there are no more than {COORDINATE_PLACES} decimal places.")
+
+    def check_lookups(self, columns, offset, report):
+        """Check the code columns are in their lookups."""
+        for key, codes in self.lookups.items():
+            names = key if isinstance(key, tuple) else (key,)
+            if any(name not in columns for name in names):
+                continue
+            for index, code in enumerate(zip(*[columns[name] for name in names]), offset):
+                if None in code or all(part == '' for part in code):
+                    continue
+                if (code if isinstance(key, tuple) else code[0]) not in codes:
+                    report.add(index, names[-1], f"'{':'.join(map(str, code))}' is not a known {' '.join(names)}.")
+
+    def check_duplicates(self, rows, columns, offset, report):
+        """Check the natural key is unique within the batch and, with one query, against the database."""
+        keys = list(zip(*[columns[name] for name in KEY_FIELDS]))
+        first_seen = {}
+        for index, key in enumerate(keys, offset):
+            if key in first_seen:
+                report.add(index, 'site_no', f"Duplicate of row {first_seen[key]} for {key[0]}:{key[1]}.")
+            else:
+                first_seen[key] = index
+
+        if not self.check_existing or not keys:
+            return
+        existing = defaultdict(set)
+        stored = Registry.objects.using(self.using).filter(
+            agency_cd__in={key[0] for key in keys}, site_no__in={key[1] for key in keys})
+        for pk, agency_cd, site_no in stored.values_list('id', 'agency_cd', 'site_no'):
+            existing[(agency_cd, site_no)].add(pk)
+        for index, (row, key) in enumerate(zip(rows, keys), offset):
+            if existing.get(key, set()) - {row.get('id')}:
+                report.add(index, 'site_no', f"{key[0]}:{key[1]} is already in the registry.")
@@ -1,9 +1,23 @@
 """
 Registry application views.
 """
-from django.http import JsonResponse
+import os
+
+from django.db import router
+from django.http import FileResponse, HttpResponseNotModified, JsonResponse
+from django.views.decorators.http import require_safe
 from django.views.generic.base import TemplateView
 
+from wellregistry.ratelimit import rate_limited
+
+from . import snapshot
+from .models import Registry
+
+# the export tokens of a snapshot download, a full registry export
+SNAPSHOT_COST = 10
+# the seconds a download waits for a snapshot being built
+SNAPSHOT_RETRY_AFTER = 30
+
 
 class BasePage(TemplateView):
     """
@@ -22,3 +36,51 @@ def status_check(request):
     # pylint: disable=unused-argument
     resp = {'status': 'up'}
     return JsonResponse(resp)
+
+
+def snapshot_cost(request):
+    """
+    The export tokens of a snapshot request, by what it is answered.
+
+    A download is a full export and a revalidation costs one token. The users who may not download and the
+    requests answered while the snapshot is built are not charged.
+    """
+    if not request.user.is_staff:
+        return 0
+    path = snapshot.snapshot_path(snapshot.registry_version(router.db_for_read(Registry)))
+    if not os.path.exists(path):
+        return 0
+    return 1 if request.META.get('HTTP_IF_NONE_MATCH') == snapshot_etag(path) else SNAPSHOT_COST
+
+
+def snapshot_etag(path):
+    """The ETag of a snapshot, its file name holds the registry version."""
+    return f'"{os.path.basename(path)}"'
+
+
+@rate_limited('export', cost=snapshot_cost)
+@require_safe
+def registry_snapshot(request):
+    """
+    Download the Parquet snapshot of the registry, for staff users.
+
+    A snapshot not built yet is built in the background and the request answered 503 meanwhile.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Staff login required.'}, status=403)
+    version, snapshot_file = snapshot.open_snapshot()
+    if snapshot_file is None:
+        snapshot.start_build()
+        response = JsonResponse({'error': 'The snapshot is being built, try again shortly.'}, status=503)
+        response['Retry-After'] = str(SNAPSHOT_RETRY_AFTER)
+        return response
+    path = snapshot.snapshot_path(version)
+    etag = snapshot_etag(path)
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        snapshot_file.close()
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(snapshot_file, as_attachment=True, filename=os.path.basename(path),
+                                content_type=snapshot.CONTENT_TYPE)
+    response['ETag'] = etag
+    return response
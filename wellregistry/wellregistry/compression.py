@@ -0,0 +1,229 @@
+"""
+Response compression.
+
+The CompressionMiddleware compresses the text responses, buffered or streaming, with the best coding
+the client accepts: brotli when the brotli package is installed, otherwise gzip. Streaming bodies are
+compressed chunk by chunk and flushed whenever STREAM_FLUSH_BYTES were read since the last flush, so
+that the client receives them as they are produced without a flush for every small row. The compressed
+buffered bodies are kept in a small per process cache keyed by the digest of the body, so a repeated
+response is not compressed again. The bytes before and after and the CPU time
+spent are logged for each response at the debug level.
+
+An HTML page holding a CSRF token or rendered for a signed in user is sent uncompressed: the size of a
+compressed page that also reflects request input gives its secrets away (BREACH). This covers the admin,
+whose pages are all signed in or hold a token.
+"""
+import hashlib
+import logging
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.utils.cache import patch_vary_headers
+
+from .static import accepted_codings
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# buffered responses smaller than this are sent as they are
+MIN_COMPRESS_SIZE = 512
+# the budget of the compressed body cache in bytes of compressed bodies
+CACHE_BYTES = 8 * 1024 * 1024
+# bodies larger than this are compressed but not cached
+MAX_CACHED_BODY = 1024 * 1024
+
+# the streamed bytes read before the compressor output is flushed to the client
+STREAM_FLUSH_BYTES = 16 * 1024
+
+GZIP_LEVEL = 6
+# brotli qualities above 5 cost much more CPU for little gain on dynamic responses
+BROTLI_QUALITY = 5
+
+# the content types worth compressing
+COMPRESSIBLE_TYPES = re.compile(r'^(text/|application/(json|javascript|xml|csv|.*\+json|.*\+xml))')
+# the content types of the pages that may hold secrets, see private_page
+PAGE_TYPES = re.compile(r'^(text/html|application/xhtml\+xml)')
+
+
+def preferred_coding(accept_encoding):
+    """The coding to use for an Accept-Encoding header, None when no supported coding is accepted."""
+    codings = accepted_codings(accept_encoding)
+    if brotli is not None and 'br' in codings:
+        return 'br'
+    if 'gzip' in codings:
+        return 'gzip'
+    return None
+
+
+def compress(coding, content):
+    """The content compressed with the coding."""
+    if coding == 'br':
+        return brotli.compress(content, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(content) + compressor.flush()
+
+
+class StreamCompressor:
+    """
+    Incremental compression of a stream.
+
+    """
+    def __init__(self, coding):
+        """A compressor for the coding."""
+        self.coding = coding
+        if coding == 'br':
+            self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self.compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, chunk, flush=False):
+        """The output for the chunk, with a flush all the input so far can be decoded from the output."""
+        if self.coding == 'br':
+            return self.compressor.process(chunk) + (self.compressor.flush() if flush else b'')
+        return self.compressor.compress(chunk) + (self.compressor.flush(zlib.Z_SYNC_FLUSH) if flush else b'')
+
+    def finish(self):
+        """The end of the compressed stream."""
+        if self.coding == 'br':
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+
+class CompressedBodyCache:
+    """
+    A thread safe LRU cache of compressed bodies with a budget in bytes.
+
+    """
+    def __init__(self, max_bytes=CACHE_BYTES):
+        """An empty cache."""
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """The cached compressed body, or None."""
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        """Cache a compressed body, evicting the least recently used ones over the budget."""
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        """Empty the cache."""
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+body_cache = CompressedBodyCache()
+
+
+class CompressionMiddleware:
+    """
+    Compress the responses with the best coding the client accepts.
+
+    It must come before the middleware that reads or changes the response body, and after the
+    StaticFilesMiddleware whose files are already compressed.
+
+    """
+    def __init__(self, get_response):
+        """Django middleware hook."""
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """Compress the response when it is worth it."""
+        response = self.get_response(request)
+        if not self.compressible(response) or self.private_page(request, response):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        coding = preferred_coding(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if coding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = self.measured(request.path, coding, response.streaming_content)
+            del response['Content-Length']
+        else:
+            start = time.thread_time()
+            content = response.content
+            key = (coding, hashlib.blake2b(content, digest_size=16).digest())
+            compressed = body_cache.get(key)
+            cached = compressed is not None
+            if not cached:
+                compressed = compress(coding, content)
+                if len(content) <= MAX_CACHED_BODY:
+                    body_cache.put(key, compressed)
+            if len(compressed) >= len(content):
+                return response
+            response.content = compressed
+            response['Content-Length'] = str(len(compressed))
+            logger.debug("compressed %s %s %d to %d bytes in %.2fms cpu%s", request.path, coding, len(content),
+                         len(compressed), (time.thread_time() - start) * 1000, ' cached' if cached else '')
+
+        # the compressed representation differs from the one the strong ETag was computed for
+        if response.has_header('ETag'):
+            response['ETag'] = re.sub(r'^"', 'W/"', response['ETag'])
+        response['Content-Encoding'] = coding
+        return response
+
+    @staticmethod
+    def compressible(response):
+        """True for successful, not yet encoded, text responses large enough or streaming."""
+        if response.status_code != 200 or response.has_header('Content-Encoding'):
+            return False
+        if not COMPRESSIBLE_TYPES.match(response.get('Content-Type', '')):
+            return False
+        return response.streaming or len(response.content) >= MIN_COMPRESS_SIZE
+
+    @staticmethod
+    def private_page(request, response):
+        """True for a page with a CSRF token or of a signed in user, which must not be compressed."""
+        if not PAGE_TYPES.match(response.get('Content-Type', '')):
+            return False
+        user = getattr(request, 'user', None)
+        return request.META.get('CSRF_COOKIE_USED', False) or (user is not None and user.is_authenticated)
+
+    @staticmethod
+    def measured(path, coding, chunks):
+        """Compress the streaming chunks and log the totals when the stream ends."""
+        compressor = StreamCompressor(coding)
+        read, written, cpu, pending = 0, 0, 0.0, 0
+        for chunk in chunks:
+            if not chunk:
+                continue
+            pending += len(chunk)
+            start = time.thread_time()
+            compressed = compressor.compress(chunk, flush=pending >= STREAM_FLUSH_BYTES)
+            cpu += time.thread_time() - start
+            read += len(chunk)
+            if pending >= STREAM_FLUSH_BYTES:
+                pending = 0
+            if compressed:
+                written += len(compressed)
+                yield compressed
+        start = time.thread_time()
+        compressed = compressor.finish()
+        cpu += time.thread_time() - start
+        written += len(compressed)
+        yield compressed
+        logger.debug("compressed stream %s %s %d to %d bytes in %.2fms cpu", path, coding, read, written, cpu * 1000)
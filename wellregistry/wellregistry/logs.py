@@ -0,0 +1,279 @@
+"""
+Non-blocking structured logging.
+
+A request thread that logs only puts the record in a bounded queue. A listener thread per worker
+process formats the records, as JSON lines by default, and writes them. A full queue does not block
+the request: the record is dropped and counted, and the listener logs the count with the next record
+it writes. The loggers of settings.LOG_SAMPLING, and their children, keep only a share of their
+records below WARNING, each kept record has its sample_rate so that counts can be scaled back.
+
+The RequestLogMiddleware adds the request id and the view name to every record logged during a
+request and logs one line per request with its status, duration, queries and database aliases.
+> LOG_FORMAT=basic python -m manage runserver
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+import uuid
+from contextlib import ExitStack
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from django.db import connections
+
+# the header of a request id set by the load balancer, a new one is made otherwise
+REQUEST_ID_HEADER = 'HTTP_X_REQUEST_ID'
+# the attributes of every record, the others are extras written as JSON fields
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+# seconds to wait for the listener to write the queued records when it stops
+STOP_TIMEOUT = 5
+
+_context = ContextVar('log_context', default=None)
+
+request_logger = logging.getLogger('wellregistry.requests')
+
+
+def log_context():
+    """The fields added to the records of the current request, None outside of a request."""
+    return _context.get()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format a record as one JSON object with its extra fields.
+
+    """
+    def format(self, record):
+        """The JSON line of the record."""
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class DropReportingListener(logging.handlers.QueueListener):
+    """
+    A queue listener that reports the records its handler dropped.
+
+    """
+    def __init__(self, record_queue, target, source):
+        """Listen to the queue of the source NonBlockingHandler and write to the target handler."""
+        super().__init__(record_queue, target)
+        self.source = source
+        self.reported = 0
+
+    def handle(self, record):
+        """Write the record, after the count of the records dropped since the last report."""
+        self.report_drops()
+        super().handle(record)
+
+    def report_drops(self):
+        """Write a warning with the records dropped since the last report, if any."""
+        dropped = self.source.dropped
+        if dropped != self.reported:
+            super().handle(logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': '%d log records dropped, the log queue was full', 'args': (dropped - self.reported,),
+                'dropped_total': dropped}))
+            self.reported = dropped
+
+    def enqueue_sentinel(self):
+        """Wait for room in a full queue rather than fail to stop."""
+        self.queue.put(self._sentinel, timeout=STOP_TIMEOUT)
+
+    def stop(self):
+        """Write the queued records and the last drops, then stop the thread."""
+        try:
+            super().stop()
+        except queue.Full:
+            self._thread = None
+        self.report_drops()
+
+
+class NonBlockingHandler(logging.handlers.QueueHandler):
+    """
+    Queue the records for a listener thread of the process, drop them when the queue is full.
+
+    The queue and the listener are made on the first record of each process, so that a worker forked
+    from a process that logged already gets its own.
+
+    """
+    def __init__(self, capacity=10000, sampling=None, stream=None):
+        """The queue capacity, the sample rates by logger name and the stream written, stderr by default."""
+        logging.Handler.__init__(self)  # pylint: disable=non-parent-init-called
+        self.capacity = capacity
+        self.sampling = dict(sampling or {})
+        self.stream = stream
+        self.queue = None
+        self.listener = None
+        self.pid = None
+        self.dropped = 0
+        self.rates = {}
+
+    def sample_rate(self, name):
+        """The share of the records of a logger kept, from its own rate or its closest parent's."""
+        rate = self.rates.get(name)
+        if rate is None:
+            rate = 1.0
+            parts = name.split('.')
+            for end in range(len(parts), 0, -1):
+                parent = '.'.join(parts[:end])
+                if parent in self.sampling:
+                    rate = self.sampling[parent]
+                    break
+            self.rates[name] = rate
+        return rate
+
+    def filter(self, record):
+        """Apply the handler filters and the sampling of the logger."""
+        if not super().filter(record):
+            return False
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.sample_rate(record.name)
+        if rate >= 1.0:
+            return True
+        if random.random() >= rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+    def prepare(self, record):
+        """
+        Resolve the message and exception and add the request fields, in the thread that logs.
+
+        The formatting itself is left to the listener.
+        """
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        context = _context.get()
+        if context:
+            for name, value in context.items():
+                if not hasattr(record, name):
+                    setattr(record, name, value)
+        return record
+
+    def enqueue(self, record):
+        """Queue the record or count it as dropped, called with the handler lock held."""
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def start(self):
+        """Make the queue and start the listener of this process."""
+        if self.pid is None:
+            atexit.register(self.stop)
+        self.queue = queue.Queue(self.capacity)
+        target = logging.StreamHandler(self.stream or sys.stderr)
+        target.setFormatter(self.formatter)
+        self.listener = DropReportingListener(self.queue, target, self)
+        self.listener.start()
+        self.pid = os.getpid()
+
+    def stop(self):
+        """Write the queued records and stop the listener of this process."""
+        self.acquire()
+        try:
+            if self.listener is not None and self.pid == os.getpid():
+                self.listener.stop()
+                self.listener = None
+                self.pid = None
+        finally:
+            self.release()
+
+    def close(self):
+        """Stop the listener along with the handler."""
+        self.stop()
+        super().close()
+
+
+class QueryCounter:
+    """
+    A database execute wrapper that counts the queries of a request by alias.
+
+    """
+    def __init__(self):
+        """No queries yet."""
+        self.queries = {}
+        self.duration = 0.0
+
+    def wrapper(self, alias):
+        """The execute wrapper of an alias."""
+        def execute(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                self.duration += time.perf_counter() - start
+                self.queries[alias] = self.queries.get(alias, 0) + 1
+        return execute
+
+
+class RequestLogMiddleware:
+    """
+    Add the request fields to the records of a request and log the request.
+
+    It should be the first middleware, to time all the others.
+
+    """
+    def __init__(self, get_response):
+        """Django middleware hook."""
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """Log the request with its duration and queries."""
+        request_id = request.META.get(REQUEST_ID_HEADER, '')[:64] or uuid.uuid4().hex
+        context = {'request_id': request_id}
+        token = _context.set(context)
+        counter = QueryCounter()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(counter.wrapper(alias)))
+                response = self.get_response(request)
+            request_logger.info('%s %s %d', request.method, request.path, response.status_code, extra={
+                'status': response.status_code,
+                'duration_ms': round((time.perf_counter() - start) * 1000, 1),
+                'queries': sum(counter.queries.values()),
+                'db_ms': round(counter.duration * 1000, 1),
+                'aliases': sorted(counter.queries),
+            })
+        finally:
+            _context.reset(token)
+        response['X-Request-Id'] = request_id
+        return response
+
+    @staticmethod
+    def process_view(request, view_func, view_args, view_kwargs):
+        """Add the view name to the request fields."""
+        # pylint: disable=unused-argument
+        context = _context.get()
+        if context is not None:
+            match = request.resolver_match
+            context['view'] = match.view_name if match else view_func.__qualname__
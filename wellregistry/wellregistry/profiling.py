@@ -0,0 +1,188 @@
+"""
+On demand request profiling for staff users.
+
+A staff user profiles a request by sending the X-Profile header or adding the _profile query parameter,
+for example /admin/registry/registry/?_profile=1. The request runs under cProfile with every SQL query
+timed on every database alias, the slowest SELECT queries are explained and the report is stored as a
+RequestProfile to read in the admin. The response carries the id of the report in X-Profile-Id.
+A streaming response, such as an export, is profiled until its last chunk is sent and its report is
+saved then, so it has no X-Profile-Id header and its report is found in the admin.
+Requests that do not ask for a profile only pay for the header and query string checks.
+"""
+import cProfile
+import io
+import json
+import logging
+import pstats
+import time
+
+from django.db import DatabaseError, connections
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAMETER = '_profile'
+
+# the functions listed in the report, by cumulative time
+STATS_LINES = 40
+# the slowest queries explained
+EXPLAINED_QUERIES = 3
+# the reports kept, the oldest are deleted
+KEPT_PROFILES = 200
+
+
+def profile_requested(request):
+    """True when the request asks for a profile, without parsing anything."""
+    return PROFILE_HEADER in request.META or PROFILE_PARAMETER in request.META.get('QUERY_STRING', '')
+
+
+class QueryRecorder:
+    """
+    A database execute wrapper that records each query with its alias and duration.
+
+    """
+    def __init__(self, alias):
+        """A recorder for one database alias."""
+        self.alias = alias
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        """Time the query."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({'alias': self.alias, 'sql': sql,
+                                 'params': None if many or not isinstance(params, (list, tuple)) else params,
+                                 'duration': (time.perf_counter() - start) * 1000})
+
+
+def explain(query):
+    """The plan of a recorded SELECT query as text, None for the other queries."""
+    if query['params'] is None or not query['sql'].lstrip().upper().startswith('SELECT'):
+        return None
+    connection = connections[query['alias']]
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"{connection.ops.explain_query_prefix()} {query['sql']}", query['params'])
+            return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+    except DatabaseError as error:
+        return f"not explained: {error}"
+
+
+def profile_stats(profiler):
+    """The top functions of the profile by cumulative time."""
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(STATS_LINES)
+    return out.getvalue()
+
+
+class RequestProfiler:
+    """
+    The profiler and the query recorders of a request, active within the with blocks.
+
+    """
+    def __init__(self):
+        """A profiler recording the queries of every database alias."""
+        self.recorders = [QueryRecorder(alias) for alias in connections]
+        self.profiler = cProfile.Profile()
+        self.wrappers = []
+        self.start = None
+        self.duration = 0.0
+
+    @property
+    def queries(self):
+        """The recorded queries of all the aliases."""
+        return [query for recorder in self.recorders for query in recorder.queries]
+
+    def __enter__(self):
+        """Start recording, the time is counted from the first block."""
+        self.wrappers = [connections[recorder.alias].execute_wrapper(recorder) for recorder in self.recorders]
+        for wrapper in self.wrappers:
+            wrapper.__enter__()
+        if self.start is None:
+            self.start = time.perf_counter()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        """Stop recording."""
+        self.profiler.disable()
+        self.duration = (time.perf_counter() - self.start) * 1000
+        for wrapper in self.wrappers:
+            wrapper.__exit__(None, None, None)
+
+
+class ProfilingMiddleware:
+    """
+    Profile the requests of staff users that ask for it.
+
+    It must follow the AuthenticationMiddleware.
+
+    """
+    def __init__(self, get_response):
+        """Django middleware hook."""
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """Profile the request when asked by a staff user."""
+        if not profile_requested(request) or not request.user.is_staff:
+            return self.get_response(request)
+
+        # the parameter is not a filter of the admin change lists
+        if PROFILE_PARAMETER in request.GET:
+            request.GET = request.GET.copy()
+            del request.GET[PROFILE_PARAMETER]
+
+        with RequestProfiler() as profiler:
+            response = self.get_response(request)
+
+        if response.streaming:
+            response.streaming_content = self.profiled(request, response, profiler, response.streaming_content)
+            return response
+        profile = self.store(request, response, profiler)
+        if profile is not None:
+            response['X-Profile-Id'] = str(profile.pk)
+        return response
+
+    def profiled(self, request, response, profiler, chunks):
+        """Profile the making of each chunk and save the report when the stream ends or is dropped."""
+        chunks = iter(chunks)
+        try:
+            while True:
+                with profiler:
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    return
+                yield chunk
+        finally:
+            self.store(request, response, profiler)
+
+    @staticmethod
+    def store(request, response, profiler):
+        """Explain the slowest queries and save the report, None when it cannot be saved."""
+        # pylint: disable=import-outside-toplevel
+        from registry.models import RequestProfile
+
+        queries = profiler.queries
+        duration = profiler.duration
+
+        for query in sorted(queries, key=lambda query: query['duration'], reverse=True)[:EXPLAINED_QUERIES]:
+            query['plan'] = explain(query)
+        for query in queries:
+            if query['params'] is not None:
+                query['params'] = [str(param) for param in query['params']]
+        try:
+            profile = RequestProfile.objects.create(
+                path=request.get_full_path()[:500], method=request.method, username=request.user.get_username(),
+                status_code=response.status_code, duration=duration, query_count=len(queries),
+                query_duration=sum(query['duration'] for query in queries), stats=profile_stats(profiler.profiler),
+                queries=json.dumps(queries), profiled_date=timezone.now())
+            stale = RequestProfile.objects.order_by('-profiled_date').values_list('id', flat=True)[KEPT_PROFILES:]
+            RequestProfile.objects.filter(id__in=list(stale)).delete()
+        except DatabaseError as error:
+            logger.warning("profile of %s not saved: %s", request.path, error)
+            return None
+        logger.info("profiled %s %s in %.0fms as %d", request.method, request.path, duration, profile.pk)
+        return profile
@@ -0,0 +1,203 @@
+"""
+Per client rate limiting and concurrency caps shared by the gunicorn workers.
+
+Each client, a known API key from the X-Api-Key header or else the client IP, has a token bucket and a
+count of requests in flight per policy of settings.RATE_LIMITS. A request takes its cost in tokens from
+the bucket and a slot for its duration, a client out of either gets a 429 with a Retry-After header.
+Views use the 'default' policy with a cost of 1 unless decorated with rate_limited, for example the
+exports with the stricter 'export' policy and a cost by the size of what they export.
+
+The buckets and the slots are rows in a small SQLite file, settings.RATE_LIMIT_STORE, that every worker
+of the host opens, so that no cache service is needed. Each check is one short write transaction.
+"""
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.http import JsonResponse
+
+logger = logging.getLogger(__name__)
+
+# a slot older than this is from a worker that died with the request in flight
+STALE_SLOT_SECONDS = 600
+# a bucket not used for this long is full again with any of the policies and is deleted
+IDLE_BUCKET_SECONDS = 86400
+# the checks of a worker between purges of the stale rows
+PURGE_EVERY = 1000
+
+API_KEY_HEADER = 'HTTP_X_API_KEY'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bucket (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS slot (id TEXT PRIMARY KEY, key TEXT NOT NULL, started REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS slot_key_idx ON slot (key, started);
+"""
+
+
+def rate_limited(policy, cost=1):
+    """Decorate a view with its policy and its cost, a number or a function of the request."""
+    def decorator(view):
+        view.rate_limit = (policy, cost)
+        return view
+    return decorator
+
+
+def client_id(request):
+    """The API key of the request when it is a known one, otherwise the client IP."""
+    api_key = request.META.get(API_KEY_HEADER)
+    if api_key and api_key in settings.RATE_LIMIT_API_KEYS:
+        return f"key:{api_key}"
+    hops = settings.RATE_LIMIT_PROXY_HOPS
+    forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+    if hops and len(forwarded) >= hops:
+        # the address added by the outermost of the trusted proxies
+        return f"ip:{forwarded[-hops]}"
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+class RateLimitStore:
+    """
+    The token buckets and the in flight slots in a SQLite file, one connection per thread.
+
+    """
+    def __init__(self, path):
+        """Open the store at the path, the file and its tables are created when missing."""
+        self.path = path
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        """The connection of the current thread and process."""
+        connection = getattr(self.local, 'connection', None)
+        if connection is None or self.local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            # the limits are ephemeral, losing the last writes on a power cut does not matter
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.executescript(SCHEMA)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return connection
+
+    def acquire(self, key, policy, cost, now=None):
+        """
+        Take the cost from the bucket and a slot for the key.
+
+        Returns (slot id, 0) or, when the key is out of tokens or slots, (None, seconds to retry after).
+        """
+        now = time.time() if now is None else now
+        rate, burst, concurrency = policy['rate'], policy['burst'], policy['concurrency']
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            result = self.take(connection, key, now, rate, burst, concurrency, cost)
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+        return result
+
+    @staticmethod
+    def take(connection, key, now, rate, burst, concurrency, cost):
+        """The acquire checks and writes, inside its transaction."""
+        in_flight = connection.execute('SELECT COUNT(*) FROM slot WHERE key = ? AND started > ?',
+                                       (key, now - STALE_SLOT_SECONDS)).fetchone()[0]
+        if in_flight >= concurrency:
+            return None, 1
+        row = connection.execute('SELECT tokens, updated FROM bucket WHERE key = ?', (key,)).fetchone()
+        tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+        # a cost above the burst can never be paid, it takes the whole bucket instead
+        cost = min(cost, burst)
+        if tokens < cost:
+            return None, math.ceil((cost - tokens) / rate)
+        connection.execute('INSERT OR REPLACE INTO bucket (key, tokens, updated) VALUES (?, ?, ?)',
+                           (key, tokens - cost, now))
+        slot = uuid.uuid4().hex
+        connection.execute('INSERT INTO slot (id, key, started) VALUES (?, ?, ?)', (slot, key, now))
+        return slot, 0
+
+    def release(self, slot):
+        """Free a slot taken by acquire."""
+        self.connection.execute('DELETE FROM slot WHERE id = ?', (slot,))
+
+    def purge(self, now=None):
+        """Delete the stale slots and the idle buckets."""
+        now = time.time() if now is None else now
+        connection = self.connection
+        connection.execute('DELETE FROM slot WHERE started < ?', (now - STALE_SLOT_SECONDS,))
+        connection.execute('DELETE FROM bucket WHERE updated < ?', (now - IDLE_BUCKET_SECONDS,))
+
+
+def too_many_requests(retry_after):
+    """The 429 response."""
+    response = JsonResponse({'error': 'Too many requests, retry later.', 'retry_after': retry_after}, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+class RateLimitMiddleware:
+    """
+    Apply the rate limit policy of the view to the client of the request.
+
+    The paths of settings.RATE_LIMIT_EXEMPT_PATHS, the admin and the health checks, are not limited.
+
+    """
+    def __init__(self, get_response):
+        """Django middleware hook."""
+        self.get_response = get_response
+        self.store = RateLimitStore(settings.RATE_LIMIT_STORE)
+        self.checks = 0
+
+    def __call__(self, request):
+        """Release the slot once the response, streaming ones included, is done."""
+        response = self.get_response(request)
+        slot = getattr(request, 'rate_limit_slot', None)
+        if slot is None:
+            return response
+        if response.streaming:
+            response.streaming_content = self.released(slot, response.streaming_content)
+        else:
+            self.release(slot)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Take the tokens and the slot of the request or answer 429."""
+        # pylint: disable=unused-argument
+        if request.path_info.startswith(tuple(settings.RATE_LIMIT_EXEMPT_PATHS)):
+            return None
+        policy_name, cost = getattr(view_func, 'rate_limit', ('default', 1))
+        if callable(cost):
+            cost = cost(request)
+        try:
+            slot, retry_after = self.store.acquire(f"{policy_name}:{client_id(request)}",
+                                                   settings.RATE_LIMITS[policy_name], cost)
+            self.checks += 1
+            if self.checks % PURGE_EVERY == 0:
+                self.store.purge()
+        except sqlite3.Error as error:
+            # a limiter that cannot reach its store lets the requests through
+            logger.warning("rate limit store unavailable: %s", error)
+            return None
+        if slot is None:
+            return too_many_requests(retry_after)
+        request.rate_limit_slot = slot
+        return None
+
+    def released(self, slot, chunks):
+        """Stream the chunks and release the slot when the stream ends or is dropped."""
+        try:
+            yield from chunks
+        finally:
+            self.release(slot)
+
+    def release(self, slot):
+        """Free the slot, a slot that cannot be freed now goes stale."""
+        try:
+            self.store.release(slot)
+        except sqlite3.Error as error:
+            logger.warning("rate limit slot not released: %s", error)
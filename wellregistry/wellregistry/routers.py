@@ -0,0 +1,130 @@
+"""
+Read replica database routing.
+
+settings.REPLICA_DATABASES maps a primary alias, 'default' or 'django_admin', to its replica aliases.
+Reads of the registry models go to a replica of the primary while writes stay on the primary.
+A request is pinned to the primaries when it is not a safe method or, for REPLICA_PIN_SECONDS after
+a write, by a timestamp kept in its session so that the user reads their own writes.
+"""
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+# the apps whose reads may be served by a replica, sessions and auth always read the primary
+ROUTED_APPS = {'registry'}
+# the session key of the time until which the requests of a session read the primary
+PIN_SESSION_KEY = '_replica_pinned_until'
+# the HTTP methods that do not write
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_pinned = ContextVar('replica_pinned', default=False)
+
+
+def replicas_of(primary):
+    """The replica aliases of a primary alias."""
+    return getattr(settings, 'REPLICA_DATABASES', {}).get(primary, [])
+
+
+def primary_of(alias):
+    """The primary alias of a replica alias, any other alias is its own primary."""
+    for primary, replicas in getattr(settings, 'REPLICA_DATABASES', {}).items():
+        if alias in replicas:
+            return primary
+    return alias
+
+
+def is_pinned(request=None):
+    """True when reads must use the primary, for the current request or the given one."""
+    if _pinned.get():
+        return True
+    if request is None:
+        return False
+    if request.method not in SAFE_METHODS:
+        return True
+    session = getattr(request, 'session', None)
+    return session is not None and session.get(PIN_SESSION_KEY, 0) > time.time()
+
+
+def read_alias(primary, request=None):
+    """The alias to read from, a random replica of the primary unless reads are pinned."""
+    replicas = replicas_of(primary)
+    if not replicas or is_pinned(request):
+        return primary
+    return random.choice(replicas)
+
+
+def stick_to_primary(request):
+    """Pin the reads of the request session to the primary for the REPLICA_PIN_SECONDS after a write."""
+    session = getattr(request, 'session', None)
+    if session is not None and replicas_of(DEFAULT_DB_ALIAS) + replicas_of('django_admin'):
+        session[PIN_SESSION_KEY] = time.time() + settings.REPLICA_PIN_SECONDS
+
+
+class ReplicaPinningMiddleware:
+    """
+    Pin the reads of a request to the primary when it writes or was recently preceded by a write.
+
+    It must follow the SessionMiddleware.
+
+    """
+    def __init__(self, get_response):
+        """Django middleware hook."""
+        self.get_response = get_response
+
+    def __call__(self, request):
+        """Set the pin for the duration of the request."""
+        token = _pinned.set(is_pinned(request))
+        try:
+            return self.get_response(request)
+        finally:
+            _pinned.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Django database router that sends registry reads to the replicas.
+
+    Without configured replicas every method defers to the default routing.
+
+    """
+    @staticmethod
+    def db_for_read(model, **hints):
+        """A replica of the primary of the hinted instance or of 'default'."""
+        if model._meta.app_label not in ROUTED_APPS:
+            return None
+        instance = hints.get('instance')
+        primary = primary_of(instance._state.db) if instance is not None and instance._state.db else DEFAULT_DB_ALIAS
+        replicas = replicas_of(primary)
+        if not replicas or _pinned.get():
+            return None if primary == DEFAULT_DB_ALIAS else primary
+        return random.choice(replicas)
+
+    @staticmethod
+    def db_for_write(model, **hints):
+        """The primary, also for instances that were read from a replica."""
+        # pylint: disable=unused-argument
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            primary = primary_of(instance._state.db)
+            if primary != instance._state.db:
+                return primary
+        return None
+
+    @staticmethod
+    def allow_relation(obj1, obj2, **hints):
+        """Objects from a primary and its replicas may be related."""
+        # pylint: disable=unused-argument
+        if primary_of(obj1._state.db) == primary_of(obj2._state.db):
+            return True
+        return None
+
+    @staticmethod
+    def allow_migrate(db, app_label, **hints):
+        """Replicas are never migrated, they follow their primary."""
+        # pylint: disable=unused-argument
+        if primary_of(db) != db:
+            return False
+        return None
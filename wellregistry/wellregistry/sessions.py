@@ -0,0 +1,45 @@
+"""
+Cached database session engine with a bounded cache lifetime.
+
+Django's cached_db engine caches a session for its whole expiry age. With a cache that is not shared by
+every worker, a logout or a change made through one worker would not be seen by the others for weeks.
+This engine keeps the sessions in the cache for at most SESSION_CACHE_SECONDS, so that the other workers
+read the database again soon after, while most requests are still served without a session query.
+"""
+from django.conf import settings
+from django.contrib.sessions.backends import cached_db
+
+
+class BoundedTimeoutCache:
+    """
+    A cache wrapper that caps the timeout of the values set.
+
+    """
+    def __init__(self, cache, max_timeout):
+        """Wrap the cache."""
+        self.cache = cache
+        self.max_timeout = max_timeout
+
+    def set(self, key, value, timeout=None, version=None):
+        """Set the value for at most the max timeout."""
+        timeout = self.max_timeout if timeout is None else min(timeout, self.max_timeout)
+        return self.cache.set(key, value, timeout, version=version)
+
+    def __contains__(self, key):
+        """True when the key is cached."""
+        return key in self.cache
+
+    def __getattr__(self, name):
+        """Everything else is the cache's."""
+        return getattr(self.cache, name)
+
+
+class SessionStore(cached_db.SessionStore):
+    """
+    The cached_db session store with the cache lifetime bounded by SESSION_CACHE_SECONDS.
+
+    """
+    def __init__(self, session_key=None):
+        """Wrap the session cache."""
+        super().__init__(session_key)
+        self._cache = BoundedTimeoutCache(self._cache, settings.SESSION_CACHE_SECONDS)
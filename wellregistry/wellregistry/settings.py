@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 import ast
 import os
 import sys
+import tempfile
 
 from django.core.management.utils import get_random_secret_key
 
@@ -42,7 +43,7 @@ except ValueError:
 
 INSTALLED_APPS = [
     'postgres',
-    'registry',
+    'registry.apps.RegistryConfig',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -52,11 +53,17 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'wellregistry.logs.RequestLogMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'wellregistry.static.StaticFilesMiddleware',
+    'wellregistry.compression.CompressionMiddleware',
+    'wellregistry.ratelimit.RateLimitMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'wellregistry.routers.ReplicaPinningMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'wellregistry.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allow_cidr.middleware.AllowCIDRMiddleware'
@@ -81,18 +88,35 @@ TEMPLATES = [
     },
 ]
 
+# Logging, see wellregistry.logs
+# 'json' lines or the 'basic' text format
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+# the records queued for the listener thread of a worker, more are dropped and counted
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+# the share of the records below WARNING kept, by logger and its children, as logger=rate pairs
+LOG_SAMPLING = {
+    name.strip(): float(rate)
+    for name, _, rate in (pair.partition('=') for pair in os.getenv(
+        'LOG_SAMPLING', 'django.db.backends=0.01,wellregistry.compression=0.1').split(','))
+    if name.strip()
+}
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
-    'formatters':{
+    'formatters': {
         'basic': {
             'format': '%(asctime)s [%(levelname)-8s] %(message)s'
-        }
+        },
+        'json': {
+            '()': 'wellregistry.logs.JsonFormatter',
+        },
     },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
-            'formatter': 'basic'
+            'class': 'wellregistry.logs.NonBlockingHandler',
+            'formatter': LOG_FORMAT,
+            'capacity': LOG_QUEUE_SIZE,
+            'sampling': LOG_SAMPLING,
         },
     },
     'root': {
@@ -100,6 +124,10 @@ LOGGING = {
         'level': 'DEBUG' if DEBUG else 'INFO'
     }
 }
+# the log records are kept out of the test output, the tests capture the ones they check
+if 'test' in sys.argv:
+    LOGGING['handlers'] = {'null': {'class': 'logging.NullHandler'}}
+    LOGGING['root']['handlers'] = ['null']
 
 # use the AllowCIDRMiddleware to support a CIDR range to ensure that an AWS health check can work
 CIDR_RANGES = os.getenv('CIDR_RANGES', None)
@@ -131,19 +159,32 @@ ENVIRONMENT = {
     'APP_ADMIN_PASSWORD': os.getenv('APP_ADMIN_PASSWORD'),
     'APP_CLIENT_USERNAME': os.getenv('APP_CLIENT_USERNAME'),
     'APP_CLIENT_PASSWORD': os.getenv('APP_CLIENT_PASSWORD'),
+
+    # optional comma separated hosts of read replicas of the application database
+    'DATABASE_REPLICA_HOSTS': os.getenv('DATABASE_REPLICA_HOSTS', ''),
 }
 
 # short alias
 env = ENVIRONMENT
 
+# management commands that change the schema and connect as the application database owner
+OWNER_COMMANDS = ('migrate', 'startup_migrate', 'compact_registry')
+
+# the replica aliases of each primary alias, see wellregistry.routers
+REPLICA_DATABASES = {}
+
 if 'test' in sys.argv:
     DATABASES = {
         'default': {  # used for integration tests
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
         },
+        'default_replica': {  # only used by the replica routing tests
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(BASE_DIR, 'db_replica.sqlite3'),
+        },
     }
-elif 'migrate' in sys.argv:
+elif any(command in sys.argv for command in OWNER_COMMANDS):
     DATABASES = {
         # Because the default connection alias is not a full dba,
         # this requires this command 'python manager.py migrate --database=postgres'
@@ -186,6 +227,78 @@ else:
         },
     }
 
+    # each replica host gets a client and an admin alias with the credentials of its primary
+    replica_hosts = [host.strip() for host in env['DATABASE_REPLICA_HOSTS'].split(',') if host.strip()]
+    for primary in ('default', 'django_admin'):
+        REPLICA_DATABASES[primary] = []
+        for number, replica_host in enumerate(replica_hosts, 1):
+            alias = f"{primary}_replica_{number}"
+            DATABASES[alias] = dict(DATABASES[primary], HOST=replica_host)
+            REPLICA_DATABASES[primary].append(alias)
+
+DATABASE_ROUTERS = ['wellregistry.routers.ReplicaRouter']
+
+# how long the requests of a session read the primary after a write, so that users read their own writes
+REPLICA_PIN_SECONDS = int(os.getenv('REPLICA_PIN_SECONDS', '5'))
+
+
+# Sessions
+# 'db' reads the session table on every authenticated request, 'cached_db' reads it only on a cache miss
+# and 'signed_cookies' keeps the session in the cookie without any storage
+SESSION_ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'wellregistry.sessions',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+SESSION_MODE = os.getenv('SESSION_MODE', 'db')
+if SESSION_MODE not in SESSION_ENGINES:
+    raise ValueError(f"SESSION_MODE must be one of {', '.join(SESSION_ENGINES)}.")
+SESSION_ENGINE = SESSION_ENGINES[SESSION_MODE]
+
+# the session cache is a file based cache shared by the workers when SESSION_CACHE_DIR is set,
+# otherwise a cache local to each worker, see wellregistry.sessions
+SESSION_CACHE_DIR = os.getenv('SESSION_CACHE_DIR')
+# how long a worker may use a cached session before reading it from the database again
+SESSION_CACHE_SECONDS = int(os.getenv('SESSION_CACHE_SECONDS', '60'))
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'sessions': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': SESSION_CACHE_DIR,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    } if SESSION_CACHE_DIR else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'sessions',
+    },
+}
+SESSION_CACHE_ALIAS = 'sessions'
+
+
+# Rate limiting, see wellregistry.ratelimit
+# the file of the buckets shared by the workers of a host
+RATE_LIMIT_STORE = os.getenv('RATE_LIMIT_STORE', os.path.join(tempfile.gettempdir(), 'wellregistry_ratelimit.sqlite3'))
+# per client, rate in tokens per second, burst in tokens and concurrency in requests in flight
+RATE_LIMITS = {
+    'default': {
+        'rate': float(os.getenv('RATE_LIMIT_RATE', '5')),
+        'burst': float(os.getenv('RATE_LIMIT_BURST', '60')),
+        'concurrency': int(os.getenv('RATE_LIMIT_CONCURRENCY', '4')),
+    },
+    # the exports cost tokens by their size, see rate_limited
+    'export': {
+        'rate': float(os.getenv('EXPORT_RATE_LIMIT_RATE', '0.05')),
+        'burst': float(os.getenv('EXPORT_RATE_LIMIT_BURST', '20')),
+        'concurrency': int(os.getenv('EXPORT_RATE_LIMIT_CONCURRENCY', '1')),
+    },
+}
+# the API keys limited on their own rather than by client IP
+RATE_LIMIT_API_KEYS = {key.strip() for key in os.getenv('RATE_LIMIT_API_KEYS', '').split(',') if key.strip()}
+# the proxies in front of the application whose X-Forwarded-For entries are trusted, 0 uses the peer address
+RATE_LIMIT_PROXY_HOPS = int(os.getenv('RATE_LIMIT_PROXY_HOPS', '0'))
+RATE_LIMIT_EXEMPT_PATHS = ['/admin/', '/registry/status']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
@@ -224,3 +337,23 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+# collectstatic writes the hashed and compressed files here, the StaticFilesMiddleware serves them
+STATIC_ROOT = os.getenv('STATIC_ROOT', os.path.join(BASE_DIR, 'static'))
+
+# the tests render templates without a collectstatic manifest
+if 'test' not in sys.argv:
+    STATICFILES_STORAGE = 'wellregistry.static.CompressedManifestStaticFilesStorage'
+
+
+# Registry
+
+# optional json file of the valid lookup codes used by the batch validation, see registry.validation
+REGISTRY_LOOKUPS_FILE = os.getenv('REGISTRY_LOOKUPS_FILE')
+
+# meters per altitude unit by the UNITS_DIM id of alt_units, feet and meters, see registry.datums;
+# the ids must be alt_units lookup codes when the lookups file has them, see registry.checks
+ALT_UNIT_METERS = {1: 0.3048, 2: 1.0}
+
+# the cache of the Parquet snapshots by registry version, see registry.snapshot
+SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', os.path.join(tempfile.gettempdir(), 'wellregistry-snapshots'))
@@ -0,0 +1,475 @@
+"""
+Tests for the wellregistry project modules
+"""
+import gzip
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.core.management import call_command
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from django.contrib.auth import get_user_model
+
+from registry.admin import RegistryAdmin, RequestProfileAdmin
+from registry.models import Registry, RequestProfile
+from registry.tests import make_registry
+from . import warmup
+from .compression import CompressionMiddleware, body_cache
+from .logs import JsonFormatter, NonBlockingHandler
+from .profiling import ProfilingMiddleware
+from .ratelimit import RateLimitStore, client_id
+from .static import IMMUTABLE_CACHE_CONTROL, UNHASHED_CACHE_CONTROL, StaticFilesMiddleware
+from .routers import PIN_SESSION_KEY, ReplicaPinningMiddleware, read_alias, stick_to_primary
+
+
+@override_settings(REPLICA_DATABASES={'default': ['default_replica']}, REPLICA_PIN_SECONDS=5)
+class TestReplicaRouter(TestCase):
+    databases = {'default', 'default_replica'}
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        make_registry(site_no='primary').save(using='default')
+        make_registry(site_no='replica').save(using='default_replica')
+
+    def sites(self, request):
+        """The site numbers read while handling a request."""
+        request.session = getattr(request, 'session', {})
+        middleware = ReplicaPinningMiddleware(lambda req: list(Registry.objects.values_list('site_no', flat=True)))
+        return middleware(request)
+
+    def test_reads_go_to_the_replica(self):
+        self.assertEqual(list(Registry.objects.values_list('site_no', flat=True)), ['replica'])
+        self.assertEqual(self.sites(self.factory.get('/registry/')), ['replica'])
+
+    def test_writes_go_to_the_primary(self):
+        # SETUP
+        entry = Registry.objects.get()
+        self.assertEqual(entry._state.db, 'default_replica')
+
+        # TEST ACTION
+        entry.site_name = 'edited'
+        entry.save()
+
+        # ASSERTIONS
+        self.assertEqual(Registry.objects.using('default').get(site_no='replica').site_name, 'edited')
+        self.assertEqual(Registry.objects.using('default_replica').get().site_name, make_registry().site_name)
+
+    def test_unsafe_requests_read_the_primary(self):
+        self.assertEqual(self.sites(self.factory.post('/registry/')), ['primary'])
+
+    def test_sticky_after_write(self):
+        # SETUP
+        request = self.factory.post('/admin/')
+        request.session = {}
+
+        # TEST ACTION
+        stick_to_primary(request)
+        after_write = self.factory.get('/registry/')
+        after_write.session = request.session
+        expired = self.factory.get('/registry/')
+        expired.session = {PIN_SESSION_KEY: time.time() - 1}
+
+        # ASSERTIONS
+        self.assertEqual(self.sites(after_write), ['primary'])
+        self.assertEqual(self.sites(expired), ['replica'])
+
+    def test_admin_reads(self):
+        reg = RegistryAdmin(model=Registry, admin_site=None)
+        get = self.factory.get('/admin/registry/registry/')
+        get.session = {}
+        post = self.factory.post('/admin/registry/registry/')
+
+        self.assertEqual(read_alias('default', get), 'default_replica')
+        self.assertEqual(read_alias('default', post), 'default')
+        self.assertEqual(read_alias(reg.using, get), 'django_admin')
+
+
+class TestWarmUp(TestCase):
+
+    def test_warm_up(self):
+        # TEST ACTION
+        with mock.patch('wellregistry.ratelimit.RateLimitMiddleware.__call__') as rate_limit, \
+                self.assertLogs('wellregistry.warmup', 'INFO') as logs:
+            warmup.warm_up(aliases=['default'])
+
+        # ASSERTIONS
+        self.assertTrue(any('warm up GET /registry/ first' in line for line in logs.output))
+        self.assertTrue(any('warm up GET /admin/login/ first' in line for line in logs.output))
+        self.assertFalse(any('ERROR' in line for line in logs.output))
+        rate_limit.assert_not_called()
+
+    def test_failed_warm_up(self):
+        with mock.patch.object(warmup, 'compile_templates', side_effect=RuntimeError('boom')), \
+                self.assertLogs('wellregistry.warmup', 'INFO') as logs:
+            warmup.warm_up(aliases=['default'])
+
+        self.assertIn('warm up failed', logs.output[-2])
+        self.assertIn('warm up done', logs.output[-1])
+
+
+class TestStaticFiles(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        source = tempfile.TemporaryDirectory()
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(source.cleanup)
+        self.addCleanup(root.cleanup)
+        with open(os.path.join(source.name, 'registry.css'), 'w') as css:
+            css.write('.registry { color: #000000; }\n' * 100)
+        with open(os.path.join(source.name, 'tiny.css'), 'w') as css:
+            css.write('.a { }')
+
+        settings = override_settings(
+            STATIC_ROOT=root.name,
+            STATICFILES_DIRS=[source.name],
+            STATICFILES_FINDERS=['django.contrib.staticfiles.finders.FileSystemFinder'],
+            STATICFILES_STORAGE='wellregistry.static.CompressedManifestStaticFilesStorage')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.root = root.name
+        self.middleware = StaticFilesMiddleware(lambda request: HttpResponse('passed'))
+
+    def hashed_name(self, name):
+        """The collected hashed name of a source file."""
+        with open(os.path.join(self.root, 'staticfiles.json')) as manifest:
+            return json.load(manifest)['paths'][name]
+
+    def test_collect_compressed_variants(self):
+        hashed = self.hashed_name('registry.css')
+
+        self.assertTrue(os.path.isfile(os.path.join(self.root, hashed + '.gz')))
+        self.assertTrue(os.path.isfile(os.path.join(self.root, 'registry.css.gz')))
+        self.assertFalse(any(name.startswith('tiny') and name.endswith('.gz') for name in os.listdir(self.root)))
+
+    def test_serve_hashed_gzip(self):
+        hashed = self.hashed_name('registry.css')
+
+        resp = self.middleware(self.factory.get(f'/static/{hashed}', HTTP_ACCEPT_ENCODING='gzip, deflate'))
+
+        self.assertEqual(resp['Content-Encoding'], 'gzip')
+        self.assertEqual(resp['Content-Type'], 'text/css')
+        self.assertEqual(resp['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(resp['Vary'], 'Accept-Encoding')
+        self.assertIn('.registry', gzip.decompress(b''.join(resp.streaming_content)).decode())
+        resp.close()
+
+    def test_serve_unhashed_identity(self):
+        resp = self.middleware(self.factory.get('/static/registry.css', HTTP_ACCEPT_ENCODING='gzip;q=0'))
+
+        self.assertNotIn('Content-Encoding', resp)
+        self.assertEqual(resp['Cache-Control'], UNHASHED_CACHE_CONTROL)
+        self.assertTrue(b''.join(resp.streaming_content).startswith(b'.registry'))
+        resp.close()
+
+    def test_pass_through(self):
+        for path in ('/static/missing.css', '/static/../settings.py', '/registry/'):
+            resp = self.middleware(self.factory.get(path))
+            self.assertEqual(resp.content, b'passed', path)
+
+
+class TestCompression(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        body_cache.clear()
+        self.addCleanup(body_cache.clear)
+
+    @staticmethod
+    def rows(count):
+        """Registry like rows with repeated values."""
+        return [{'agency_cd': 'USGS', 'agency_nm': 'U.S. Geological Survey', 'horz_datum': 'NAD83', 'site_no': str(row)}
+                for row in range(count)]
+
+    def test_compress_buffered(self):
+        # SETUP
+        middleware = CompressionMiddleware(lambda request: JsonResponse(self.rows(100), safe=False))
+        request = self.factory.get('/registry/', HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+        # TEST ACTION
+        with self.assertLogs('wellregistry.compression', 'DEBUG') as logs:
+            first = middleware(request)
+            second = middleware(request)
+
+        # ASSERTIONS
+        self.assertEqual(first['Content-Encoding'], 'gzip')
+        self.assertEqual(first['Vary'], 'Accept-Encoding')
+        self.assertEqual(int(first['Content-Length']), len(first.content))
+        self.assertEqual(json.loads(gzip.decompress(first.content)), self.rows(100))
+        self.assertEqual(second.content, first.content)
+        self.assertNotIn('cached', logs.output[0])
+        self.assertIn('cached', logs.output[1])
+
+    def test_compress_streaming(self):
+        # SETUP
+        lines = [f"USGS,{row},NAD83,U.S. Geological Survey\n" for row in range(1000)]
+        middleware = CompressionMiddleware(lambda request: StreamingHttpResponse(iter(lines), content_type='text/csv'))
+
+        # TEST ACTION
+        with self.assertLogs('wellregistry.compression', 'DEBUG') as logs:
+            resp = middleware(self.factory.get('/registry/', HTTP_ACCEPT_ENCODING='gzip'))
+            body = b''.join(resp.streaming_content)
+
+        # ASSERTIONS
+        self.assertEqual(resp['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(body).decode(), ''.join(lines))
+        self.assertLess(len(body), len(''.join(lines)) / 4)
+        self.assertIn('compressed stream /registry/ gzip', logs.output[0])
+
+    def test_skip(self):
+        responses = {
+            'small': HttpResponse('{"status": "up"}', content_type='application/json'),
+            'binary': HttpResponse(b'\0' * 1000, content_type='application/octet-stream'),
+            'error': HttpResponse('x' * 1000, status=404),
+        }
+        for name, response in responses.items():
+            resp = CompressionMiddleware(lambda request, response=response: response)(
+                self.factory.get('/registry/', HTTP_ACCEPT_ENCODING='gzip'))
+            self.assertNotIn('Content-Encoding', resp, name)
+
+        resp = CompressionMiddleware(lambda request: JsonResponse(self.rows(100), safe=False))(
+            self.factory.get('/registry/'))
+        self.assertNotIn('Content-Encoding', resp)
+        self.assertEqual(resp['Vary'], 'Accept-Encoding')
+
+
+    def test_private_pages(self):
+        # SETUP
+        page = '<html><body>' + 'registry wells ' * 100 + '</body></html>'
+        middleware = CompressionMiddleware(lambda request: HttpResponse(page))
+        public = self.factory.get('/registry/', HTTP_ACCEPT_ENCODING='gzip')
+        with_token = self.factory.get('/admin/login/', HTTP_ACCEPT_ENCODING='gzip')
+        with_token.META['CSRF_COOKIE_USED'] = True
+        signed_in = self.factory.get('/registry/', HTTP_ACCEPT_ENCODING='gzip')
+        signed_in.user = mock.Mock(is_authenticated=True)
+
+        # TEST ACTION
+        responses = [middleware(request) for request in (public, with_token, signed_in)]
+
+        # ASSERTIONS
+        self.assertEqual([resp.get('Content-Encoding') for resp in responses], ['gzip', None, None])
+        self.assertEqual(responses[1].content.decode(), page)
+
+class TestRateLimit(SimpleTestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'ratelimit.sqlite3')
+
+    def test_requests_over_the_burst(self):
+        limits = {'default': {'rate': 1, 'burst': 2, 'concurrency': 4}}
+        with override_settings(RATE_LIMIT_STORE=self.path, RATE_LIMITS=limits), \
+                self.assertLogs('django.request', 'WARNING'):
+            client = Client()
+            statuses = [client.get('/registry/').status_code for _ in range(3)]
+            limited = client.get('/registry/')
+            health = client.get('/registry/status')
+
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(limited['Retry-After'], '1')
+        self.assertEqual(health.status_code, 200)
+
+    def test_shared_concurrency_and_cost(self):
+        # SETUP
+        worker, other_worker = RateLimitStore(self.path), RateLimitStore(self.path)
+        export = {'rate': 0.5, 'burst': 10, 'concurrency': 1}
+
+        # TEST ACTION
+        slot, _ = worker.acquire('export:ip:10.0.0.1', export, cost=4, now=100)
+        busy = other_worker.acquire('export:ip:10.0.0.1', export, cost=1, now=100)
+        other_client = other_worker.acquire('export:ip:10.0.0.2', export, cost=1, now=100)
+        worker.release(slot)
+        over_budget = other_worker.acquire('export:ip:10.0.0.1', export, cost=8, now=100)
+        refilled, _ = other_worker.acquire('export:ip:10.0.0.1', export, cost=8, now=104)
+
+        # ASSERTIONS
+        self.assertEqual(busy, (None, 1))
+        self.assertIsNotNone(other_client[0])
+        self.assertEqual(over_budget, (None, 4))
+        self.assertIsNotNone(refilled)
+
+    def test_client_id(self):
+        with override_settings(RATE_LIMIT_API_KEYS={'partner'}, RATE_LIMIT_PROXY_HOPS=1):
+            known = client_id(self.factory.get('/', HTTP_X_API_KEY='partner'))
+            unknown = client_id(self.factory.get('/', HTTP_X_API_KEY='made-up', REMOTE_ADDR='10.0.0.9',
+                                                 HTTP_X_FORWARDED_FOR='1.2.3.4, 5.6.7.8'))
+
+        self.assertEqual(known, 'key:partner')
+        self.assertEqual(unknown, 'ip:5.6.7.8')
+
+
+class TestProfiling(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.user = get_user_model().objects.create_user('staff', 'staff@example.com', 'secret', is_staff=True)
+
+    def test_profile_staff_request(self):
+        # SETUP
+        self.client.force_login(self.user)
+
+        # TEST ACTION
+        with self.assertLogs('wellregistry.profiling', 'INFO'):
+            resp = self.client.get('/admin/?_profile=1')
+
+        # ASSERTIONS
+        profile = RequestProfile.objects.get()
+        queries = json.loads(profile.queries)
+        self.assertEqual(resp['X-Profile-Id'], str(profile.pk))
+        self.assertEqual((profile.path, profile.username, profile.status_code), ('/admin/?_profile=1', 'staff', 200))
+        self.assertEqual(profile.query_count, len(queries))
+        self.assertTrue(any(query.get('plan') for query in queries))
+        self.assertIn('cumulative', profile.stats)
+        self.assertIn('<pre>', RequestProfileAdmin(RequestProfile, None).slowest_queries(profile))
+
+    def test_profile_streaming_response(self):
+        # SETUP
+        def rows():
+            for _ in range(2):
+                yield f"{Registry.objects.count()}\n"
+                time.sleep(0.01)
+
+        request = RequestFactory().get('/export/?_profile=1')
+        request.user = self.user
+        middleware = ProfilingMiddleware(lambda request: StreamingHttpResponse(rows(), content_type='text/csv'))
+
+        # TEST ACTION
+        response = middleware(request)
+        saved_before = RequestProfile.objects.exists()
+        with self.assertLogs('wellregistry.profiling', 'INFO'):
+            body = b''.join(response.streaming_content)
+
+        # ASSERTIONS
+        profile = RequestProfile.objects.get()
+        self.assertFalse(saved_before)
+        self.assertEqual(body, b'0\n0\n')
+        self.assertEqual(profile.query_count, 2)
+        self.assertGreaterEqual(profile.duration, 20)
+        self.assertIn('rows', profile.stats)
+
+    def test_no_profile_unless_staff_asks(self):
+        self.user.is_staff = False
+        self.user.save()
+        self.client.force_login(self.user)
+
+        plain = self.client.get('/registry/')
+        not_staff = self.client.get('/registry/', HTTP_X_PROFILE='1')
+
+        self.assertNotIn('X-Profile-Id', plain)
+        self.assertNotIn('X-Profile-Id', not_staff)
+        self.assertFalse(RequestProfile.objects.exists())
+
+
+class BlockedStream(io.StringIO):
+    """A stream whose writes wait until it is released."""
+
+    def __init__(self):
+        super().__init__()
+        self.released = threading.Event()
+
+    def write(self, text):
+        self.released.wait(5)
+        return super().write(text)
+
+
+class TestLogging(SimpleTestCase):
+
+    def make_logger(self, name, handler):
+        logger = logging.getLogger(name)
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG)
+        logger.propagate = False
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(handler.close)
+        return logger
+
+    def test_json_format(self):
+        try:
+            raise ValueError('bad')
+        except ValueError:
+            record = logging.getLogger('test').makeRecord('test', logging.ERROR, __file__, 1, 'failed %s', ('x',),
+                                                          exc_info=sys.exc_info(), extra={'duration_ms': 1.5})
+
+        entry = json.loads(JsonFormatter().format(record))
+
+        self.assertEqual((entry['level'], entry['logger'], entry['message']), ('ERROR', 'test', 'failed x'))
+        self.assertEqual(entry['duration_ms'], 1.5)
+        self.assertIn('ValueError: bad', entry['exception'])
+
+    def test_full_queue_drops(self):
+        # SETUP
+        stream = BlockedStream()
+        handler = NonBlockingHandler(capacity=2, stream=stream)
+        handler.setFormatter(JsonFormatter())
+        logger = self.make_logger('test.blocked', handler)
+
+        # TEST ACTION
+        start = time.perf_counter()
+        for number in range(20):
+            logger.info('record %d', number)
+        elapsed = time.perf_counter() - start
+        stream.released.set()
+        handler.stop()
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+
+        # ASSERTIONS
+        self.assertLess(elapsed, 1)
+        self.assertGreater(handler.dropped, 0)
+        self.assertEqual(len(lines), 20 - handler.dropped + 1)
+        self.assertEqual([line['dropped_total'] for line in lines if 'dropped_total' in line], [handler.dropped])
+
+    def test_sampling(self):
+        # SETUP
+        stream = io.StringIO()
+        handler = NonBlockingHandler(sampling={'test.noisy': 0.0, 'test.noisy.half': 0.5}, stream=stream)
+        handler.setFormatter(JsonFormatter())
+        self.make_logger('test.noisy', handler)
+
+        # TEST ACTION
+        with mock.patch('wellregistry.logs.random.random', return_value=0.25):
+            logging.getLogger('test.noisy.child').debug('dropped')
+            logging.getLogger('test.noisy').warning('kept')
+            logging.getLogger('test.noisy.half').info('sampled')
+        handler.stop()
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+
+        # ASSERTIONS
+        self.assertEqual([line['message'] for line in lines], ['kept', 'sampled'])
+        self.assertEqual(lines[1]['sample_rate'], 0.5)
+
+    def test_request_fields(self):
+        # SETUP
+        stream = io.StringIO()
+        handler = NonBlockingHandler(stream=stream)
+        handler.setFormatter(JsonFormatter())
+        logging.getLogger('wellregistry.requests').addHandler(handler)
+        self.addCleanup(logging.getLogger('wellregistry.requests').removeHandler, handler)
+
+        # TEST ACTION
+        response = Client().get('/registry/status', HTTP_X_REQUEST_ID='abc123')
+        handler.close()
+        entry = json.loads(stream.getvalue())
+
+        # ASSERTIONS
+        self.assertEqual(response['X-Request-Id'], 'abc123')
+        self.assertEqual((entry['request_id'], entry['view'], entry['status']), ('abc123', 'status', 200))
+        self.assertEqual(entry['message'], 'GET /registry/status 200')
+        self.assertEqual(entry['aliases'], [])
+
+    def test_benchmark(self):
+        out = io.StringIO()
+
+        call_command('benchmark_logging', '--requests=3', '--write-delay=0', stdout=out)
+
+        self.assertEqual([line.split()[0] for line in out.getvalue().splitlines()], ['off', 'sync', 'queue'])
@@ -0,0 +1,133 @@
+"""
+Worker warm up.
+
+A new worker pays on its first request for the database connections, the URL resolver, template
+compilation and the caches. warm_up pays for them before the worker takes traffic: gunicorn calls it
+from the post_worker_init hook in gunicorn.conf.py, which runs before the worker accepts connections.
+The main views are called directly, outside of the middleware, so that the warm up is neither rate
+limited, logged as requests nor profiled.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.http import HttpRequest
+from django.template.loader import get_template
+from django.urls import resolve
+
+logger = logging.getLogger(__name__)
+
+# the templates compiled into the template cache
+WARMUP_TEMPLATES = [
+    'base.html',
+    'admin/base_site.html',
+    'admin/login.html',
+    'admin/index.html',
+    'admin/change_list.html',
+    'admin/change_form.html',
+]
+
+# the routes whose views are called, each twice to log the cold and warm latency
+WARMUP_PATHS = [
+    '/registry/',
+    '/registry/status',
+    '/admin/login/',
+]
+
+# the aliases only used by the migrations are not opened
+SKIPPED_DATABASES = ('postgres',)
+
+def warmup_host():
+    """A host name the ALLOWED_HOSTS accept for the internal requests."""
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def open_connections(aliases=None):
+    """Open the database connections, a failure is logged and left to the first request."""
+    for alias in aliases if aliases is not None else connections:
+        if alias in SKIPPED_DATABASES:
+            continue
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError as error:
+            logger.warning("warm up could not connect to '%s': %s", alias, error)
+
+
+def prime_caches():
+    """Load the lookups and the content types of the registry models."""
+    # pylint: disable=import-outside-toplevel
+    from django.apps import apps
+    from django.contrib.contenttypes.models import ContentType
+    from registry.validation import load_lookups
+
+    load_lookups()
+    try:
+        ContentType.objects.get_for_models(*apps.get_app_config('registry').get_models())
+    except DatabaseError as error:
+        logger.warning("warm up could not load the content types: %s", error)
+
+
+def compile_templates():
+    """Compile the common templates into the template cache."""
+    for name in WARMUP_TEMPLATES:
+        get_template(name)
+
+
+def internal_request(path):
+    """An anonymous GET request of a path, for a view called without the middleware."""
+    # pylint: disable=import-outside-toplevel
+    from django.contrib.auth.models import AnonymousUser
+
+    host = warmup_host()
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = path
+    request.META = {'HTTP_HOST': host, 'SERVER_NAME': host, 'SERVER_PORT': '80', 'SCRIPT_NAME': '',
+                    'REMOTE_ADDR': '127.0.0.1'}
+    request.user = AnonymousUser()
+    return request
+
+
+def render_routes():
+    """Call and render the views of the main routes, returns the (path, cold, warm) latencies in seconds."""
+    latencies = []
+    for path in WARMUP_PATHS:
+        match = resolve(path)
+        durations = []
+        for _ in range(2):
+            start = time.perf_counter()
+            request = internal_request(path)
+            request.resolver_match = match
+            response = match.func(request, *match.args, **match.kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            durations.append(time.perf_counter() - start)
+        latencies.append((path, durations[0], durations[1]))
+    return latencies
+
+
+def timed(name, step):
+    """Run a warm up step and log its duration."""
+    start = time.perf_counter()
+    result = step()
+    logger.info("warm up %s %.0fms", name, (time.perf_counter() - start) * 1000)
+    return result
+
+
+def warm_up(aliases=None):
+    """Run all the warm up steps, a failed step is logged and the worker serves cold."""
+    start = time.perf_counter()
+    try:
+        timed('connections', lambda: open_connections(aliases))
+        timed('caches', prime_caches)
+        timed('templates', compile_templates)
+        for path, cold, warm in timed('routes', render_routes):
+            logger.info("warm up GET %s first %.1fms then %.1fms", path, cold * 1000, warm * 1000)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception('warm up failed, the worker serves cold')
+    finally:
+        logger.info("warm up done in %.0fms", (time.perf_counter() - start) * 1000)